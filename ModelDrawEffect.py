@@ -1,177 +1,18 @@
-import os
 import unittest
 from __main__ import vtk, qt, ctk, slicer
-import EditorLib
-from EditorLib.EditOptions import HelpButton
-from EditorLib.EditOptions import EditOptions
-from EditorLib import EditUtil
-from EditorLib import LabelEffect
+import ModelDrawEffectCore
 
 #
 # The Editor Extension itself.
 #
-# This needs to define the hooks to be come an editor effect.
+# The effect's options, tool and logic classes live in ModelDrawEffectEditor,
+# which imports EditorLib. The Editor finds the extension class through a
+# LazyClass that only imports it when the Editor creates the effect, so
+# discovering this module stays cheap and the curve engine in
+# ModelDrawEffectCore can be used without Slicer.
 #
 
-#
-# ModelDrawEffectOptions - see LabelEffect, EditOptions and Effect for superclasses
-#
-
-class ModelDrawEffectOptions(EditorLib.LabelEffectOptions):
-  """ ModelDrawEffect-specfic gui
-  """
-
-  def __init__(self, parent=0):
-    super(ModelDrawEffectOptions,self).__init__(parent)
-
-    # self.attributes should be tuple of options:
-    # 'MouseTool' - grabs the cursor
-    # 'Nonmodal' - can be applied while another is active
-    # 'Disabled' - not available
-    self.attributes = ('MouseTool')
-    self.displayName = 'ModelDrawEffect Effect'
-
-  def __del__(self):
-    super(ModelDrawEffectOptions,self).__del__()
-
-  def create(self):
-    super(ModelDrawEffectOptions,self).create()
-    self.apply = qt.QPushButton("Apply", self.frame)
-    self.apply.setToolTip("Apply the extension operation")
-    self.frame.layout().addWidget(self.apply)
-    self.widgets.append(self.apply)
-
-    HelpButton(self.frame, "This is a sample with no real functionality.")
-
-    self.connections.append( (self.apply, 'clicked()', self.onApply) )
-
-    # Add vertical spacer
-    self.frame.layout().addStretch(1)
-
-  def destroy(self):
-    super(ModelDrawEffectOptions,self).destroy()
-
-  # note: this method needs to be implemented exactly as-is
-  # in each leaf subclass so that "self" in the observer
-  # is of the correct type
-  def updateParameterNode(self, caller, event):
-    node = EditUtil.EditUtil().getParameterNode()
-    if node != self.parameterNode:
-      if self.parameterNode:
-        node.RemoveObserver(self.parameterNodeTag)
-      self.parameterNode = node
-      self.parameterNodeTag = node.AddObserver(vtk.vtkCommand.ModifiedEvent, self.updateGUIFromMRML)
-
-  def setMRMLDefaults(self):
-    super(ModelDrawEffectOptions,self).setMRMLDefaults()
-
-  def updateGUIFromMRML(self,caller,event):
-    self.disconnectWidgets()
-    super(ModelDrawEffectOptions,self).updateGUIFromMRML(caller,event)
-    self.connectWidgets()
-
-  def onApply(self):
-    print('This is just an example - nothing here yet')
-
-  def updateMRMLFromGUI(self):
-    if self.updatingGUI:
-      return
-    disableState = self.parameterNode.GetDisableModifiedEvent()
-    self.parameterNode.SetDisableModifiedEvent(1)
-    super(ModelDrawEffectOptions,self).updateMRMLFromGUI()
-    self.parameterNode.SetDisableModifiedEvent(disableState)
-    if not disableState:
-      self.parameterNode.InvokePendingModifiedEvent()
-
-
-#
-# ModelDrawEffectTool
-#
-
-class ModelDrawEffectTool(LabelEffect.LabelEffectTool):
-  """
-  One instance of this will be created per-view when the effect
-  is selected.  It is responsible for implementing feedback and
-  label map changes in response to user input.
-  This class observes the editor parameter node to configure itself
-  and queries the current view for background and label volume
-  nodes to operate on.
-  """
-
-  def __init__(self, sliceWidget):
-    super(ModelDrawEffectTool,self).__init__(sliceWidget)
-    # create a logic instance to do the non-gui work
-    self.logic = ModelDrawEffectLogic(self.sliceWidget.sliceLogic())
-
-  def cleanup(self):
-    super(ModelDrawEffectTool,self).cleanup()
-
-  def processEvent(self, caller=None, event=None):
-    """
-    handle events from the render window interactor
-    """
-
-    # let the superclass deal with the event if it wants to
-    if super(ModelDrawEffectTool,self).processEvent(caller,event):
-      return
-
-    if event == "LeftButtonPressEvent":
-      xy = self.interactor.GetEventPosition()
-      sliceLogic = self.sliceWidget.sliceLogic()
-      logic = ModelDrawEffectLogic(sliceLogic)
-      logic.apply(xy)
-      print("NEW!!!! Got a %s at %s in %s" % (event,str(xy),self.sliceWidget.sliceLogic().GetSliceNode().GetName()))
-      self.abortEvent(event)
-    else:
-      pass
-
-    # events from the slice node
-    if caller and caller.IsA('vtkMRMLSliceNode'):
-      # here you can respond to pan/zoom or other changes
-      # to the view
-      pass
-
-
-#
-# ModelDrawEffectLogic
-#
-
-class ModelDrawEffectLogic(LabelEffect.LabelEffectLogic):
-  """
-  This class contains helper methods for a given effect
-  type.  It can be instanced as needed by an ModelDrawEffectTool
-  or ModelDrawEffectOptions instance in order to compute intermediate
-  results (say, for user feedback) or to implement the final
-  segmentation editing operation.  This class is split
-  from the ModelDrawEffectTool so that the operations can be used
-  by other code without the need for a view context.
-  """
-
-  def __init__(self,sliceLogic):
-    self.sliceLogic = sliceLogic
-
-  def apply(self,xy):
-    pass
-
-
-#
-# The ModelDrawEffect class definition
-#
-
-class ModelDrawEffectExtension(LabelEffect.LabelEffect):
-  """Organizes the Options, Tool, and Logic classes into a single instance
-  that can be managed by the EditBox
-  """
-
-  def __init__(self):
-    # name is used to define the name of the icon image resource (e.g. ModelDrawEffect.png)
-    self.name = "ModelDrawEffect"
-    # tool tip is displayed on mouse hover
-    self.toolTip = "Paint: circular paint brush for label map editing"
-
-    self.options = ModelDrawEffectOptions
-    self.tool = ModelDrawEffectTool
-    self.logic = ModelDrawEffectLogic
+ModelDrawEffectExtension = ModelDrawEffectCore.LazyClass('ModelDrawEffectEditor', 'ModelDrawEffectExtension')
 
 
 #
@@ -228,19 +69,6 @@ class ModelDrawEffectWidget:
       self.parent.show()
 
     self.overlaysByLayoutName = None
-    self.htmlFormat = """
-    <HEAD></HEAD> <BODY>
-      <div id="annotation"> <p style ="position: absolute;
-                display: inline;
-                top: 5;
-                left: 5;
-                border: 2px solid #777;
-                padding: 5px;
-                background-color: #fff;
-                opacity: 0.70" >
-                Annotation Text %d</p>
-      </div> </BODY>
-    """
 
   def cleanup(self):
     pass
@@ -259,6 +87,11 @@ class ModelDrawEffectWidget:
     overlayFormLayout.addRow("Overlays", self.overlaysCheck)
     self.overlaysCheck.connect("toggled(bool)", self.onOverlaysToggled)
 
+    self.timingCheck = qt.QCheckBox()
+    self.timingCheck.toolTip = "Time the stages of the effect and show their percentiles on the overlays."
+    overlayFormLayout.addRow("Timing HUD", self.timingCheck)
+    self.timingCheck.connect("toggled(bool)", self.onTimingToggled)
+
     #
     # Reload and Test area
     #
@@ -296,7 +129,7 @@ class ModelDrawEffectWidget:
       # get new slice nodes
       layoutManager = slicer.app.layoutManager()
       sliceNodeCount = slicer.mrmlScene.GetNumberOfNodesByClass('vtkMRMLSliceNode')
-      for nodeIndex in xrange(sliceNodeCount):
+      for nodeIndex in range(sliceNodeCount):
         # find the widget for each node in scene
         sliceNode = slicer.mrmlScene.GetNthNodeByClass(nodeIndex, 'vtkMRMLSliceNode')
         layoutName = sliceNode.GetLayoutName()
@@ -304,14 +137,27 @@ class ModelDrawEffectWidget:
         if sliceWidget:
           # add obserservers and keep track of tags
           overlay = SliceWebOverlay(sliceWidget.sliceView())
-          overlay.setHtml(self.htmlFormat % nodeIndex)
+          overlay.setAnnotation('Annotation Text %d' % nodeIndex, 5, 5)
+          if self.timingCheck.checked:
+            overlay.profiler = ModelDrawEffectCore.profiler
           self.overlaysByLayoutName[layoutName] = overlay
     else:
-      for layoutName,overlay in self.overlaysByLayoutName.iteritems():
+      for layoutName,overlay in self.overlaysByLayoutName.items():
         overlay.release()
       self.overlaysByLayoutName = None
 
 
+  def onTimingToggled(self):
+    """
+    turn the stage profiler on or off and show its summary on the overlays
+    """
+    profiler = ModelDrawEffectCore.profiler
+    profiler.enabled = self.timingCheck.checked
+    if profiler.enabled:
+      profiler.reset()
+    for overlay in (self.overlaysByLayoutName or {}).values():
+      overlay.profiler = profiler if profiler.enabled else None
+
   def onReload(self,moduleName="ModelDrawEffect"):
     """Generic reload method for any scripted module.
     ModuleWizard will subsitute correct default moduleName.
@@ -331,6 +177,11 @@ class ModelDrawEffectWidget:
     globals()[moduleName] = imp.load_module(
         moduleName, fp, filePath, ('.py', 'r', imp.PY_SOURCE))
     fp.close()
+    # the core and editor modules are reloaded as well, core first
+    # since the editor classes derive from it
+    for name in ('ModelDrawEffectCore', 'ModelDrawEffectEditor'):
+      if name in sys.modules:
+        imp.reload(sys.modules[name])
 
     # rebuild the widget
     # - find and hide the existing widget
@@ -358,7 +209,7 @@ class ModelDrawEffectWidget:
     setattr(globals()['slicer'].modules, widgetName, globals()[widgetName.lower()])
 
     # special for Editor Effects - register as the new implementation of effect
-    slicer.modules.editorExtensions['ModelDrawEffect'] = ModelDrawEffectExtension
+    slicer.modules.editorExtensions['ModelDrawEffect'] = globals()[moduleName].ModelDrawEffectExtension
 
   def onReloadAndTest(self,moduleName="ModelDrawEffect",scenario=None):
     try:
@@ -366,18 +217,62 @@ class ModelDrawEffectWidget:
       evalString = 'globals()["%s"].%sTest()' % (moduleName, moduleName)
       tester = eval(evalString)
       tester.runTest(scenario=scenario)
-    except Exception, e:
+    except Exception as e:
       import traceback
       traceback.print_exc()
       qt.QMessageBox.warning(slicer.util.mainWindow(),
           "Reload and Test", 'Exception!\n\n' + str(e) + "\n\nSee Python Console for Stack Trace")
 
 
+def timingTable(summary):
+  """
+  html table of a StageProfiler summary (milliseconds)
+  """
+  rows = ['<tr><th>stage</th><th>n</th><th>p50</th><th>p95</th><th>p99</th></tr>']
+  for name in sorted(summary):
+    stage = summary[name]
+    rows.append('<tr><td>%s</td><td>%d</td><td>%.1f</td><td>%.1f</td><td>%.1f</td></tr>'
+                % (name, stage['count'], stage['p50'], stage['p95'], stage['p99']))
+  return '<table style="font-size: small">%s</table>' % ''.join(rows)
+
+
 class SliceWebOverlay:
+  """
+  Renders html over a slice view through an offscreen QWebView.
+  The page is loaded once and rendered in full only when it is loaded or
+  the view is resized; annotation updates edit the page in place, and only
+  the area the annotation covered before and after the change is
+  re-rendered and copied into the overlay image. Updates that do not change
+  the annotation are skipped, and the back buffer is only reallocated when
+  the view outgrows it.
+  """
+
+  # static page: the annotation paragraph is positioned and filled in place
+  template = """
+    <HEAD></HEAD> <BODY>
+      <div id="annotation"> <p id="annotationText" style ="position: absolute;
+                display: inline;
+                top: 0;
+                left: 0;
+                border: 2px solid #777;
+                padding: 5px;
+                background-color: #fff;
+                opacity: 0.70" ></p>
+
+<svg width="640" height="480" xmlns="http://www.w3.org/2000/svg"> <!-- Created with SVG-edit - http://svg-edit.googlecode.com/ --> <defs> <radialGradient id="svg_2" spreadMethod="pad"> <stop stop-color="#3f00ff" offset="0"/> <stop stop-color="#c0ff00" offset="1"/> </radialGradient> <linearGradient spreadMethod="pad" id="svg_5"> <stop stop-color="#3f00ff" offset="0"/> <stop stop-opacity="0.996094" stop-color="#7f0000" offset="0.737549"/> </linearGradient> </defs> <g> <title>Layer 1</title> <rect fill="url(#svg_5)" stroke="#000000" stroke-width="5" x="101" y="136" width="380" height="248" id="svg_1" fill-opacity="0.66" opacity="0.5"/> <path id="svg_4" d="m163,50l131,120l-129,101l-115,-65" opacity="0.5" fill-opacity="0.66" stroke-linecap="null" stroke-linejoin="null" stroke-dasharray="null" stroke-width="5" stroke="#000000" fill="url(#svg_2)"/> </g> </svg>
+
+      </div> </BODY>
+    """
 
   def __init__(self,sliceView):
     self.observerTags = []
     self.sliceView = sliceView
+    self.loaded = False
+    # (text,left,top) currently shown and waiting to be shown
+    self.annotation = None
+    self.pendingAnnotation = None
+    # StageProfiler whose summary is shown with the annotation, if any
+    self.profiler = None
     self.addWebActor()
 
   def release(self):
@@ -388,42 +283,101 @@ class SliceWebOverlay:
     self.observerTags = []
 
   def setHtml(self,html):
+    """
+    load a new page - it is rendered in full once loaded
+    """
+    self.loaded = False
+    self.annotation = None
     self.webView.setHtml(html)
 
   def onLoadFinished(self,worked):
-    self.qImage.fill(0)
-    self.webView.render(self.qImage)
-    utils = slicer.qMRMLUtils()
-    utils.qImageToVtkImageData(self.qImage,self.vtkImage)
-    self.imageActor.SetInput(self.vtkImage)
-    self.sliceView.scheduleRender()
+    self.loaded = True
+    self.renderRegion(None)
+    if self.pendingAnnotation:
+      self.setAnnotation(*self.pendingAnnotation)
 
-  def processEvent(self, caller=None, event=None):
-    htmlFormat = """
-    <HEAD></HEAD> <BODY>
-      <div id="annotation"> <p style ="position: absolute;
-                display: inline;
-                top: %d;
-                left: %d;
-                border: 2px solid #777;
-                padding: 5px;
-                background-color: #fff;
-                opacity: 0.70" >
-                %s</p>
+  def setAnnotation(self,text,left,top):
+    """
+    move and refill the annotation paragraph of the loaded page,
+    re-rendering only the area it covered before and after
+    """
+    if not self.loaded:
+      self.pendingAnnotation = (text,left,top)
+      return
+    self.pendingAnnotation = None
+    if (text,left,top) == self.annotation:
+      return
+    element = self.annotationElement()
+    if element.isNull():
+      return
+    before = element.geometry()
+    element.setInnerXml(text)
+    element.setStyleProperty('left', '%dpx' % left)
+    element.setStyleProperty('top', '%dpx' % top)
+    self.annotation = (text,left,top)
+    self.renderRegion(before.united(element.geometry()))
+
+  def annotationElement(self):
+    """
+    the annotation paragraph of the page (null until the page is loaded)
+    """
+    return self.webView.page().mainFrame().findFirstElement('#annotationText')
 
-<svg width="640" height="480" xmlns="http://www.w3.org/2000/svg"> <!-- Created with SVG-edit - http://svg-edit.googlecode.com/ --> <defs> <radialGradient id="svg_2" spreadMethod="pad"> <stop stop-color="#3f00ff" offset="0"/> <stop stop-color="#c0ff00" offset="1"/> </radialGradient> <linearGradient spreadMethod="pad" id="svg_5"> <stop stop-color="#3f00ff" offset="0"/> <stop stop-opacity="0.996094" stop-color="#7f0000" offset="0.737549"/> </linearGradient> </defs> <g> <title>Layer 1</title> <rect fill="url(#svg_5)" stroke="#000000" stroke-width="5" x="101" y="136" width="380" height="248" id="svg_1" fill-opacity="0.66" opacity="0.5"/> <path id="svg_4" d="m163,50l131,120l-129,101l-115,-65" opacity="0.5" fill-opacity="0.66" stroke-linecap="null" stroke-linejoin="null" stroke-dasharray="null" stroke-width="5" stroke="#000000" fill="url(#svg_2)"/> </g> </svg>
+  def resize(self,width,height):
+    """
+    match the web view and overlay image to the view size; the back buffer
+    grows geometrically and is otherwise reused
+    """
+    self.webView.resize(width, height)
+    if self.qImage.width() < width or self.qImage.height() < height:
+      self.qImage = qt.QImage(max(width, 2 * self.qImage.width()),
+                              max(height, 2 * self.qImage.height()), qt.QImage.Format_ARGB32)
+    self.size = (width, height)
 
-      </div> </BODY>
+  def renderRegion(self,rect):
+    """
+    render the rect of the page (None for all of it) into the back buffer
+    and copy that area into the overlay image
     """
     viewW,viewH = self.sliceView.width,self.sliceView.height
-    imageW,imageH = self.qImage.width(),self.qImage.height()
-    if (viewW,viewH) != (imageW,imageH):
-      self.qImage = qt.QImage(viewW, viewH, qt.QImage.Format_ARGB32)
+    if (viewW,viewH) != self.size:
+      self.resize(viewW, viewH)
+      rect = None
+    full = qt.QRect(0, 0, viewW, viewH)
+    rect = full if rect is None else rect.intersected(full)
+    if rect.isEmpty():
+      return
+
+    painter = qt.QPainter(self.qImage)
+    painter.setCompositionMode(qt.QPainter.CompositionMode_Clear)
+    painter.fillRect(rect, qt.QColor(0,0,0,0))
+    painter.end()
+    self.webView.render(self.qImage, rect.topLeft(), qt.QRegion(rect))
+
+    utils = slicer.qMRMLUtils()
+    if rect == full:
+      utils.qImageToVtkImageData(self.qImage.copy(rect), self.vtkImage)
+    else:
+      # vtk rows run bottom up
+      from vtk.util import numpy_support
+      utils.qImageToVtkImageData(self.qImage.copy(rect), self.regionImage)
+      scalars = self.vtkImage.GetPointData().GetScalars()
+      overlay = numpy_support.vtk_to_numpy(scalars).reshape(viewH, viewW, -1)
+      region = numpy_support.vtk_to_numpy(self.regionImage.GetPointData().GetScalars())
+      bottom = viewH - rect.y() - rect.height()
+      overlay[bottom:bottom+rect.height(), rect.x():rect.x()+rect.width()] = region.reshape(rect.height(), rect.width(), -1)
+      scalars.Modified()
+      self.vtkImage.Modified()
+    self.sliceView.scheduleRender()
+
+  def processEvent(self, caller=None, event=None):
     posX,posY = self.style.GetEventPosition()
-    posY = viewH - posY
+    posY = self.sliceView.height - posY
     s = 'got %s from %s' % (event,caller.GetClassName())
     s +='<br>size is %d by %d' % (self.sliceView.width,self.sliceView.height)
-    self.setHtml(htmlFormat % (posY,posX,s))
+    if self.profiler:
+      s += timingTable(self.profiler.summary())
+    self.setAnnotation(s, posX, posY)
 
   def addWebActor(self):
     self.webView = qt.QWebView()
@@ -432,12 +386,14 @@ class SliceWebOverlay:
 
     w, h = self.sliceView.width,self.sliceView.height
     self.qImage = qt.QImage(w, h, qt.QImage.Format_ARGB32)
+    self.size = None
     self.vtkImage = vtk.vtkImageData()
+    self.regionImage = vtk.vtkImageData()
 
     self.mapper = vtk.vtkImageMapper()
     self.mapper.SetColorLevel(128)
     self.mapper.SetColorWindow(255)
-    self.mapper.SetInput(self.vtkImage)
+    self.mapper.SetInputData(self.vtkImage)
     self.actor2D = vtk.vtkActor2D()
     self.actor2D.SetMapper(self.mapper)
 
@@ -451,6 +407,7 @@ class SliceWebOverlay:
 
     self.webView.connect('loadFinished(bool)', lambda worked : self.onLoadFinished(worked) )
     #self.webView.page().connect('repaintRequested(QRect)', lambda rect : onLoadFinished(rect, self.webView, self.qImage) )
+    self.setHtml(self.template)
 
     self.style = self.sliceView.interactor()
     events = ("ModifiedEvent", "MouseMoveEvent", "EnterEvent", "LeaveEvent",)
@@ -471,6 +428,7 @@ class ModelDrawEffectTest(unittest.TestCase):
   """
 
   def __init__(self):
+    unittest.TestCase.__init__(self)
     self.webView = None
     self.htmlFormat = """
     <HEAD></HEAD> <BODY>
@@ -525,7 +483,7 @@ class ModelDrawEffectTest(unittest.TestCase):
     self.webView.render(self.qImage)
     utils = slicer.qMRMLUtils()
     utils.qImageToVtkImageData(self.qImage,self.vtkImage)
-    self.imageActor.SetInput(self.vtkImage)
+    self.imageActor.SetInputData(self.vtkImage)
     self.threeDView.scheduleRender()
 
   def addWebActor(self):
@@ -589,7 +547,7 @@ class ModelDrawEffectTest(unittest.TestCase):
     self.delayDisplay('displaying html',2000)
     self.webView.setHtml(self.htmlFormat)
 
-    for i in xrange(20):
+    for i in range(20):
       self.webView.setHtml(self.htmlFormat % i)
       self.renderWindow.Render()
       self.delayDisplay('displaying html %d' % i,10)
@@ -613,7 +571,7 @@ class ModelDrawEffectTest(unittest.TestCase):
     # get new slice nodes
     layoutManager = slicer.app.layoutManager()
     sliceNodeCount = slicer.mrmlScene.GetNumberOfNodesByClass('vtkMRMLSliceNode')
-    for nodeIndex in xrange(sliceNodeCount):
+    for nodeIndex in range(sliceNodeCount):
       # find the widget for each node in scene
       sliceNode = slicer.mrmlScene.GetNthNodeByClass(nodeIndex, 'vtkMRMLSliceNode')
       layoutName = sliceNode.GetLayoutName()
@@ -622,14 +580,20 @@ class ModelDrawEffectTest(unittest.TestCase):
       if sliceWidget:
         # add obserservers and keep track of tags
         overlay = SliceWebOverlay(sliceWidget.sliceView())
-        overlay.setHtml(self.htmlFormat % nodeIndex)
+        overlay.setAnnotation('Annotation Text %d' % nodeIndex, 5, 5)
         overlaysByLayoutName[layoutName] = overlay
 
         globals()['slicer'].ov.append(overlay)
 
     self.delayDisplay('Check them out!')
-    
-    for layoutName,overlay in overlaysByLayoutName.iteritems():
+
+    # the annotation is filled into the overlay's own page
+    for overlay in overlaysByLayoutName.values():
+      self.assertTrue(overlay.loaded)
+      self.assertFalse(overlay.annotationElement().isNull())
+      self.assertIsNotNone(overlay.annotation)
+
+    for layoutName,overlay in overlaysByLayoutName.items():
       overlay.release()
     overlaysByLayoutName = None
 
@@ -0,0 +1,289 @@
+"""
+Rasterize the ModelDraw control points stored in scenes into label volumes,
+without Slicer (for example to regenerate label maps after changing the
+spline settings):
+
+  python ModelDrawEffectBatch.py archive/*.mrml --output-dir labels --workers 8
+
+Each scene's ModelDraw parameters are read as plain XML and the geometry of
+the label volume - size, origin, spacing and directions - is taken from the
+NRRD header of the scene's label map or of the background volume the
+control points were drawn on (or of --reference). The curves of every
+label and slice are rebuilt with the given curve settings and filled
+into an output NRRD that is written through a memory map, so a worker
+only holds the slices it is filling. Scenes are processed by a pool
+of worker processes, one scene at a time per worker.
+"""
+
+import os
+import re
+import sys
+import gzip
+import argparse
+import concurrent.futures
+import numpy
+
+import ModelDrawEffectCore
+
+# NRRD type names and their NumPy types
+NRRD_TYPES = {}
+for names, dtype in (
+    (('signed char', 'int8', 'int8_t'), 'i1'),
+    (('uchar', 'unsigned char', 'uint8', 'uint8_t'), 'u1'),
+    (('short', 'short int', 'signed short', 'signed short int', 'int16', 'int16_t'), 'i2'),
+    (('ushort', 'unsigned short', 'unsigned short int', 'uint16', 'uint16_t'), 'u2'),
+    (('int', 'signed int', 'int32', 'int32_t'), 'i4'),
+    (('uint', 'unsigned int', 'uint32', 'uint32_t'), 'u4'),
+    (('longlong', 'long long', 'long long int', 'signed long long', 'signed long long int', 'int64', 'int64_t'), 'i8'),
+    (('ulonglong', 'unsigned long long', 'unsigned long long int', 'uint64', 'uint64_t'), 'u8'),
+    (('float',), 'f4'),
+    (('double',), 'f8')):
+  for name in names:
+    NRRD_TYPES[name] = dtype
+
+
+#
+# NRRD files
+#
+
+def readNrrdHeader(path):
+  """
+  the fields of a NRRD header (lower case names) along with 'path' and,
+  for attached data, the byte offset of the data as 'data offset'
+  """
+  header = {'path': path}
+  with open(path, 'rb') as nrrdFile:
+    if not nrrdFile.readline().startswith(b'NRRD'):
+      raise ValueError('%s is not a NRRD file' % path)
+    while True:
+      line = nrrdFile.readline()
+      if not line.strip():
+        break
+      line = line.decode('latin-1').rstrip('\r\n')
+      if line.startswith('#') or ':=' in line:
+        continue
+      name, _, value = line.partition(':')
+      header[name.strip().lower()] = value.strip()
+    header['data offset'] = nrrdFile.tell()
+  return header
+
+
+def parseVector(string):
+  return [float(value) for value in string.strip().strip('()').split(',')]
+
+
+def nrrdGeometry(header):
+  """
+  the array shape (k,j,i) and the 4x4 IJK to RAS matrix of a 3D NRRD header
+  """
+  if int(header.get('dimension', 0)) != 3:
+    raise ValueError('%s is not a 3D volume' % header['path'])
+  sizes = [int(size) for size in header['sizes'].split()]
+  directions = [parseVector(vector) for vector in re.findall(r'\([^)]*\)', header['space directions'])]
+  ijkToRAS = numpy.eye(4)
+  ijkToRAS[:3,:3] = numpy.array(directions).T
+  ijkToRAS[:3,3] = parseVector(header.get('space origin', '(0,0,0)'))
+  if header.get('space', '').lower() in ('left-posterior-superior', 'lps'):
+    ijkToRAS[:2] *= -1
+  return tuple(sizes[::-1]), ijkToRAS
+
+
+def readNrrdData(header):
+  """
+  the (k,j,i) array of a raw (memory mapped) or gzip encoded NRRD
+  """
+  shape, ijkToRAS = nrrdGeometry(header)
+  dtype = numpy.dtype(NRRD_TYPES[header['type']])
+  if header.get('endian', 'little') == 'big':
+    dtype = dtype.newbyteorder('>')
+  else:
+    dtype = dtype.newbyteorder('<')
+  path, offset = header['path'], header['data offset']
+  dataFile = header.get('data file', header.get('datafile'))
+  if dataFile:
+    path, offset = os.path.join(os.path.dirname(header['path']), dataFile), 0
+  encoding = header.get('encoding', 'raw')
+  if encoding == 'raw':
+    return numpy.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+  if encoding in ('gzip', 'gz'):
+    with open(path, 'rb') as nrrdFile:
+      nrrdFile.seek(offset)
+      return numpy.frombuffer(gzip.GzipFile(fileobj=nrrdFile).read(), dtype=dtype).reshape(shape)
+  raise ValueError('%s: unsupported encoding %s' % (header['path'], encoding))
+
+
+def createNrrd(path,shape,ijkToRAS,dtype='int16'):
+  """
+  write the header of a raw NRRD and return its zero filled (k,j,i)
+  data as a writable memory map
+  """
+  lps = numpy.array(ijkToRAS, dtype='float64')
+  lps[:2] *= -1
+  vector = lambda values: '(%s)' % ','.join('%.17g' % value for value in values)
+  typeName = {'i1': 'signed char', 'u1': 'uchar', 'i2': 'short', 'u2': 'ushort', 'i4': 'int', 'u4': 'uint', 'f4': 'float', 'f8': 'double'}
+  dtype = numpy.dtype(dtype).newbyteorder('<')
+  lines = (
+    'NRRD0004',
+    'type: %s' % typeName[dtype.str[1:]],
+    'dimension: 3',
+    'space: left-posterior-superior',
+    'sizes: %d %d %d' % tuple(shape[::-1]),
+    'space directions: %s' % ' '.join(vector(lps[:3,axis]) for axis in range(3)),
+    'kinds: domain domain domain',
+    'endian: little',
+    'encoding: raw',
+    'space origin: %s' % vector(lps[:3,3]),
+  )
+  header = ('\n'.join(lines) + '\n\n').encode('ascii')
+  with open(path, 'wb') as nrrdFile:
+    nrrdFile.write(header)
+    nrrdFile.truncate(len(header) + int(numpy.prod(shape)) * dtype.itemsize)
+  return numpy.memmap(path, dtype=dtype, mode='r+', offset=len(header), shape=tuple(shape))
+
+
+#
+# Rasterizing scenes
+#
+
+def sliceGeometry(controlPoints,ijkToRAS):
+  """
+  the slice axes (rows: two in-plane directions and the normal) and the
+  spacing of the IJK planes the control point slices lie in, with the
+  slices keyed by their offset along that normal
+  """
+  rasToIJK = numpy.linalg.inv(ijkToRAS)
+  spread = numpy.zeros(3)
+  for points in controlPoints.values():
+    ijk = numpy.dot(points, rasToIJK[:3,:3].T) + rasToIJK[:3,3]
+    spread += ijk.max(axis=0) - ijk.min(axis=0)
+  normalAxis = spread.argmin()
+  columns = ijkToRAS[:3,:3].T
+  lengths = numpy.sqrt((columns ** 2).sum(axis=1))
+  axes = columns / lengths[:,numpy.newaxis]
+  axes = axes[[axis for axis in range(3) if axis != normalAxis] + [normalAxis]]
+  keyed = dict((round(float(numpy.dot(points.mean(axis=0), axes[2])), 2), points) for points in controlPoints.values())
+  return axes, lengths[normalAxis], keyed
+
+
+def sceneReferences(scenePath):
+  """
+  the image files of the volume giving the label geometry of a scene and
+  of its background volume, each None if the scene does not single one
+  out. The background is
+  the volume recorded with the ModelDraw parameters, or else the only
+  grayscale volume; the label geometry is that of the scene's label map,
+  or of the background if there is not exactly one label map.
+  """
+  volumes, recorded = ModelDrawEffectCore.readSceneVolumes(scenePath)
+  labelMaps = [fileName for volumeID, fileName, labelMap in volumes if labelMap]
+  grayscale = dict((volumeID, fileName) for volumeID, fileName, labelMap in volumes if not labelMap)
+  background = None
+  if recorded in grayscale:
+    background = grayscale[recorded]
+  elif len(grayscale) == 1:
+    background = list(grayscale.values())[0]
+  if len(labelMaps) == 1:
+    return labelMaps[0], background
+  return background, background
+
+
+def rasterizeScene(scenePath,outputPath,reference=None,settings=None,threads=1):
+  """
+  fill the curves of every label stored in the scene into a new label NRRD
+  at outputPath. settings are ModelDrawEngine options (interpolation,
+  splineSteps, snap, ...). Returns the number of slices filled per label.
+  """
+  parameters = ModelDrawEffectCore.readReferenceScene(scenePath)[0]
+  geometry, background = sceneReferences(scenePath)
+  reference = reference or geometry
+  if reference is None:
+    raise ValueError('%s: no single label map or background volume gives the label geometry; choose one with --reference' % scenePath)
+  background = background or reference
+  shape, ijkToRAS = nrrdGeometry(readNrrdHeader(reference))
+
+  engine = ModelDrawEffectCore.ModelDrawEngine()
+  for name, value in (settings or {}).items():
+    setattr(engine, name, value)
+  engine.applyThreads = threads
+  # nothing is undone here, so keep no journal
+  engine.journal.maxBytes = 0
+  engine.store = ModelDrawEffectCore.ControlPointStore()
+  engine.store.update(parameters)
+  engine.labelArray = createNrrd(outputPath, shape, ijkToRAS)
+  engine.labelRASToIJK = numpy.linalg.inv(ijkToRAS)
+  if engine.snap or engine.edgeTangents:
+    header = readNrrdHeader(background)
+    backgroundIJKToRAS = nrrdGeometry(header)[1]
+    spacing = numpy.sqrt((backgroundIJKToRAS[:3,:3] ** 2).sum(axis=0))
+    engine.background = ModelDrawEffectCore.CachedVolume(0, readNrrdData(header).astype('float32'),
+                                                         numpy.linalg.inv(backgroundIJKToRAS), spacing)
+
+  filled = {}
+  for label in engine.store.labels():
+    controlPoints = engine.store.get(label)
+    if not controlPoints:
+      continue
+    engine.setLabel(label)
+    engine.axes, engine.spacing, keyed = sliceGeometry(controlPoints, ijkToRAS)
+    engine.model.load(keyed)
+    engine.model.changed(engine)
+    if len(engine.controlPoints) > 1:
+      filled[label] = engine.applyCurves(label=int(label))
+    else:
+      engine.sliceOffset = list(engine.controlPoints.keys())[0]
+      filled[label] = int(engine.applyCurve(engine.currentCurve(), label=int(label)))
+    engine.labelArray.flush()
+  del engine.labelArray
+  return filled
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='Rasterize the ModelDraw control points stored in scenes into label volumes.')
+  parser.add_argument('scenes', nargs='+', help='.mrml scenes with ModelDraw control points')
+  parser.add_argument('--output-dir', default='.', help='directory for the <scene>-label.nrrd outputs')
+  parser.add_argument('--reference', help='NRRD file giving the label geometry (default: the label map or background volume of each scene)')
+  parser.add_argument('--workers', type=int, default=None, help='worker processes (default: one per CPU)')
+  parser.add_argument('--threads', type=int, default=1, help='slice threads within each worker')
+  parser.add_argument('--interpolation', choices=('spline', 'linear'), default='spline')
+  parser.add_argument('--spline-steps', type=int, default=10)
+  parser.add_argument('--tension', type=float, default=0.)
+  parser.add_argument('--bias', type=float, default=0.)
+  parser.add_argument('--continuity', type=float, default=0.)
+  parser.add_argument('--snap', action='store_true', help='snap the curves to the grayscale volume')
+  parser.add_argument('--smooth-snap', action='store_true', help='snap along the best smooth path')
+  parser.add_argument('--edge-tangents', action='store_true', help='estimate curve tangents from the grayscale volume')
+  args = parser.parse_args(argv)
+
+  settings = {
+    'interpolation': args.interpolation,
+    'splineSteps': args.spline_steps,
+    'tension': args.tension,
+    'bias': args.bias,
+    'continuity': args.continuity,
+    'snap': args.snap or args.smooth_snap,
+    'snapMode': 'smooth' if args.smooth_snap else 'independent',
+    'edgeTangents': args.edge_tangents,
+  }
+  if not os.path.isdir(args.output_dir):
+    os.makedirs(args.output_dir)
+
+  failed = 0
+  with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+    futures = {}
+    for scene in args.scenes:
+      output = os.path.join(args.output_dir, os.path.splitext(os.path.basename(scene))[0] + '-label.nrrd')
+      futures[executor.submit(rasterizeScene, scene, output, args.reference, settings, args.threads)] = scene
+    for future in concurrent.futures.as_completed(futures):
+      scene = futures[future]
+      try:
+        filled = future.result()
+      except Exception as error:
+        failed += 1
+        print('%s: failed: %s' % (scene, error))
+        continue
+      print('%s: %s' % (scene, ', '.join('label %s %d slices' % item for item in sorted(filled.items())) or 'no control points'))
+  return 1 if failed else 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
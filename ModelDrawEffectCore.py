@@ -0,0 +1,3142 @@
+"""
+Slicer independent core of the ModelDraw effect: curve evaluation,
+interpolation between slices, snapping, rasterization and control point
+storage. Only NumPy and the standard library are imported here, so the
+engine can be used outside of Slicer (worker processes, batch jobs,
+benchmarks); ModelDrawEffectEditor adapts it to the Editor and slice views.
+"""
+
+import io
+import os
+import json
+import time
+import zlib
+import queue
+import base64
+import struct
+import hashlib
+import threading
+import itertools
+import collections
+import functools
+import xml.etree.ElementTree
+import numpy
+
+#
+# StageProfiler
+#
+
+class NullStage:
+  """
+  context manager that does nothing, returned while profiling is disabled
+  """
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self,*args):
+    return False
+
+nullStage = NullStage()
+
+
+class Stage:
+  """
+  context manager timing one stage into a StageProfiler
+  """
+
+  def __init__(self,profiler,name):
+    self.profiler = profiler
+    self.name = name
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self,*args):
+    self.profiler.record(self.name, self.start, time.perf_counter() - self.start)
+    return False
+
+
+class StageProfiler:
+  """
+  Timings of the stages of the effect (event handling, spline evaluation,
+  tangent estimation, snapping, rasterization, feedback and render requests)
+  kept in a fixed-size ring buffer: the newest capacity records are the
+  stage, start time, duration and thread of each timed call. Times come
+  from the monotonic time.perf_counter clock; dump() adds the offset to
+  the wall clock so its start times are seconds since the epoch.
+  Stages are timed with "with profiler.stage(name):" or the timed(name)
+  decorator; while disabled these cost one attribute check.
+  summary() gives per-stage percentiles, and dump() and dumpChromeTrace()
+  write the records as JSON or in the Chrome trace event format (for
+  chrome://tracing or Perfetto).
+  """
+
+  def __init__(self,capacity=8192):
+    self.enabled = False
+    self.capacity = capacity
+    self.lock = threading.Lock()
+    self.reset()
+
+  def reset(self):
+    """
+    forget all records
+    """
+    with self.lock:
+      self.names = []
+      self.stageIndex = {}
+      self.stages = numpy.zeros(self.capacity, dtype='int32')
+      self.starts = numpy.zeros(self.capacity, dtype='float64')
+      self.durations = numpy.zeros(self.capacity, dtype='float64')
+      self.threads = numpy.zeros(self.capacity, dtype='int64')
+      self.count = 0
+      self.epoch = time.time() - time.perf_counter()
+
+  def stage(self,name):
+    """
+    context manager timing the enclosed block as stage name
+    """
+    if not self.enabled:
+      return nullStage
+    return Stage(self, name)
+
+  def timed(self,name):
+    """
+    decorator timing every call of a function as stage name
+    """
+    def decorator(function):
+      @functools.wraps(function)
+      def wrapper(*args, **kwargs):
+        if not self.enabled:
+          return function(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+          return function(*args, **kwargs)
+        finally:
+          self.record(name, start, time.perf_counter() - start)
+      return wrapper
+    return decorator
+
+  def record(self,name,start,duration):
+    """
+    add one record, overwriting the oldest once the buffer is full
+    """
+    with self.lock:
+      if name not in self.stageIndex:
+        self.stageIndex[name] = len(self.names)
+        self.names.append(name)
+      slot = self.count % self.capacity
+      self.stages[slot] = self.stageIndex[name]
+      self.starts[slot] = start
+      self.durations[slot] = duration
+      self.threads[slot] = threading.current_thread().ident or 0
+      self.count += 1
+
+  def records(self):
+    """
+    the buffered records, oldest first, as (stages, starts, durations, threads)
+    arrays (stages index the names list)
+    """
+    with self.lock:
+      size = min(self.count, self.capacity)
+      order = (numpy.arange(size) + self.count - size) % self.capacity
+      return self.stages[order], self.starts[order], self.durations[order], self.threads[order]
+
+  def summary(self):
+    """
+    per-stage count, mean, p50, p95, p99 and max of the buffered
+    durations in milliseconds
+    """
+    stages, starts, durations, threads = self.records()
+    summary = {}
+    for index, name in enumerate(list(self.names)):
+      milliseconds = 1000. * durations[stages == index]
+      if not len(milliseconds):
+        continue
+      p50, p95, p99 = numpy.percentile(milliseconds, (50, 95, 99))
+      summary[name] = {'count': int(len(milliseconds)), 'mean': float(milliseconds.mean()),
+                       'p50': float(p50), 'p95': float(p95), 'p99': float(p99),
+                       'max': float(milliseconds.max())}
+    return summary
+
+  def dump(self,path):
+    """
+    write the summary and the buffered records to a JSON file
+    """
+    stages, starts, durations, threads = self.records()
+    names = list(self.names)
+    events = [{'stage': names[stage], 'start': float(self.epoch + start), 'duration': float(duration), 'thread': int(thread)}
+              for stage, start, duration, thread in zip(stages, starts, durations, threads)]
+    with open(path, 'w') as fp:
+      json.dump({'summary': self.summary(), 'events': events}, fp, indent=1)
+
+  def dumpChromeTrace(self,path):
+    """
+    write the buffered records as complete ('X') events of the Chrome trace
+    event format, in microseconds
+    """
+    stages, starts, durations, threads = self.records()
+    names = list(self.names)
+    origin = starts.min() if len(starts) else 0.
+    events = [{'name': names[stage], 'cat': 'ModelDrawEffect', 'ph': 'X', 'pid': 0, 'tid': int(thread),
+               'ts': 1e6 * (start - origin), 'dur': 1e6 * duration}
+              for stage, start, duration, thread in zip(stages, starts, durations, threads)]
+    with open(path, 'w') as fp:
+      json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
+
+profiler = StageProfiler()
+
+
+#
+# BackgroundVolumeCache
+#
+
+class CachedVolume:
+  """
+  Float copy of a volume node's image data along with its
+  RAS to IJK matrix, (on demand) its gradient magnitude and
+  downsampled copies for coarse searches.
+  """
+
+  def __init__(self,mtime,volume,rasToIJK,spacing):
+    self.mtime = mtime
+    self.volume = volume
+    self.rasToIJK = rasToIJK
+    self.spacing = spacing
+    self.gradient = None
+    # edge tangents estimated on this volume, keyed by estimation
+    # settings and control point voxel
+    self.tangents = {}
+    # CachedVolumes averaged over blocks, keyed by block size
+    self.levels = {}
+
+  def nbytes(self):
+    total = self.volume.nbytes + sum(level.nbytes() for level in self.levels.values())
+    if self.gradient is None:
+      return total
+    return total + self.gradient.nbytes
+
+  def gradientMagnitude(self):
+    if self.gradient is None:
+      # spacing is in i,j,k order while the array is indexed k,j,i
+      derivatives = numpy.gradient(self.volume, *self.spacing[::-1])
+      magnitude = numpy.zeros_like(self.volume)
+      for derivative in derivatives:
+        magnitude += derivative * derivative
+      self.gradient = numpy.sqrt(magnitude, out=magnitude)
+    return self.gradient
+
+  def downsampled(self,factor):
+    """
+    CachedVolume of this volume averaged over factor^3 voxel blocks
+    (itself if the volume is smaller than one block)
+    """
+    if factor not in self.levels:
+      shape = numpy.array(self.volume.shape) // factor
+      if factor < 2 or not shape.all():
+        return self
+      k, j, i = shape
+      blocks = self.volume[:k*factor,:j*factor,:i*factor].reshape(k, factor, j, factor, i, factor)
+      volume = blocks.mean(axis=(1,3,5), dtype='float32')
+      # block b covers voxels factor*b ... factor*b + factor-1
+      toBlocks = numpy.diag((1./factor,) * 3 + (1.,))
+      toBlocks[:3,3] = -0.5 * (factor - 1.) / factor
+      self.levels[factor] = CachedVolume(self.mtime, volume, numpy.dot(toBlocks, self.rasToIJK),
+                                         numpy.asarray(self.spacing) * factor)
+    return self.levels[factor]
+
+
+class BackgroundVolumeCache:
+  """
+  Least-recently-used cache of CachedVolumes keyed by volume node ID.
+  One module-level instance is shared by every tool and logic so each
+  background volume is cast to float only once per modification,
+  no matter how many slice views are editing it.
+  Entries are revalidated against the MTime given by the caller and
+  the oldest entries are evicted once maxBytes is exceeded.
+  """
+
+  def __init__(self,maxBytes=2**31):
+    self.maxBytes = maxBytes
+    self.entries = collections.OrderedDict()
+    self.lock = threading.RLock()
+
+  def get(self,key,mtime,load,gradient=False):
+    """
+    the CachedVolume for key (a volume node ID), rebuilt with load() if it is
+    missing or was built for another mtime - dropping everything derived
+    from the old image. load returns the volume array (indexed k,j,i),
+    its RAS to IJK matrix and its ijk spacing.
+    """
+    with self.lock:
+      entry = self.entries.pop(key, None)
+      if entry is None or entry.mtime != mtime:
+        volume, rasToIJK, spacing = load()
+        entry = CachedVolume(mtime, numpy.asarray(volume, dtype='float32'), rasToIJK, numpy.asarray(spacing))
+      self.entries[key] = entry
+      if gradient:
+        entry.gradientMagnitude()
+      self.evict()
+      return entry
+
+  def evict(self):
+    """
+    drop least recently used entries until the cache fits in maxBytes
+    (the most recently used entry is always kept)
+    """
+    with self.lock:
+      total = sum(entry.nbytes() for entry in self.entries.values())
+      while total > self.maxBytes and len(self.entries) > 1:
+        key, entry = self.entries.popitem(last=False)
+        total -= entry.nbytes()
+
+  def invalidate(self,nodeID=None):
+    """
+    forget the cached copy of one node, or of all nodes
+    """
+    with self.lock:
+      if nodeID is None:
+        self.entries.clear()
+      else:
+        self.entries.pop(nodeID, None)
+
+backgroundVolumeCache = BackgroundVolumeCache()
+
+
+#
+# ControlPointStore
+#
+
+def parseTclList(string):
+  """
+  split a Tcl list string into its elements (braces group, backslashes escape)
+  """
+  elements = []
+  index, length = 0, len(string)
+  while index < length:
+    while index < length and string[index].isspace():
+      index += 1
+    if index >= length:
+      break
+    if string[index] == '{':
+      depth, start = 1, index + 1
+      index += 1
+      while index < length and depth:
+        if string[index] == '\\':
+          index += 1
+        elif string[index] == '{':
+          depth += 1
+        elif string[index] == '}':
+          depth -= 1
+        index += 1
+      elements.append(string[start:index-1])
+    else:
+      start = index
+      quoted = string[index] == '"'
+      if quoted:
+        start += 1
+        index += 1
+        while index < length and string[index] != '"':
+          index += 2 if string[index] == '\\' else 1
+        elements.append(string[start:index])
+        index += 1
+      else:
+        while index < length and not string[index].isspace():
+          index += 2 if string[index] == '\\' else 1
+        elements.append(string[start:index])
+  return elements
+
+
+class ControlPointStore:
+  """
+  Control points of every label, persisted as parameters of the
+  "ModelDraw" vtkMRMLScriptedModuleNode (one parameter per label value,
+  as in the Slicer3 effect).
+  Each label is kept packed as contiguous arrays - the sorted slice
+  offsets, the number of points on each slice and all points
+  concatenated - and written as a versioned, compressed base64 string.
+  Labels are only decoded when first requested. Parameters in the
+  Slicer3 format (Tcl 'array get' of offset and point lists) are still read.
+  """
+
+  version = 'ModelDrawEffect/1:'
+
+  def __init__(self,node=None):
+    self.node = node
+    self.packed = {}
+
+  def get(self,label):
+    """
+    the control points of label as a dictionary of (N,3) arrays keyed by offset
+    """
+    label = str(label)
+    if label not in self.packed:
+      value = self.node.GetParameter(label) if self.node else ''
+      self.packed[label] = self.decode(value)
+    return self.unpack(*self.packed[label])
+
+  def set(self,label,controlPoints):
+    """
+    replace the control points of label (a dictionary keyed by offset)
+    """
+    label = str(label)
+    self.packed[label] = self.pack(controlPoints)
+    if self.node:
+      self.node.SetParameter(label, self.encode(*self.packed[label]))
+
+  def pack(self,controlPoints):
+    offsets = sorted(offset for offset in controlPoints if len(controlPoints[offset]))
+    counts = numpy.array([len(controlPoints[offset]) for offset in offsets], dtype='int32')
+    if offsets:
+      points = numpy.concatenate([numpy.asarray(controlPoints[offset], dtype='float64').reshape(-1,3) for offset in offsets])
+    else:
+      points = numpy.zeros((0,3))
+    return numpy.array(offsets, dtype='float64'), counts, points
+
+  def unpack(self,offsets,counts,points):
+    starts = numpy.concatenate(([0], numpy.cumsum(counts)))
+    return dict((float(offset), points[starts[index]:starts[index+1]].copy()) for index, offset in enumerate(offsets))
+
+  def encode(self,offsets,counts,points):
+    buffer = io.BytesIO()
+    numpy.savez_compressed(buffer, offsets=offsets, counts=counts, points=points)
+    return self.version + base64.b64encode(buffer.getvalue()).decode('ascii')
+
+  def decode(self,value):
+    if not value:
+      return self.pack({})
+    if value.startswith(self.version):
+      arrays = numpy.load(io.BytesIO(base64.b64decode(value[len(self.version):])))
+      return arrays['offsets'], arrays['counts'], arrays['points']
+    return self.pack(self.parseLegacy(value))
+
+  def parseLegacy(self,value):
+    """
+    control points from the Slicer3 string: offset {{r a s} {r a s} ...} ...
+    """
+    elements = parseTclList(value)
+    controlPoints = {}
+    for offset, points in zip(elements[::2], elements[1::2]):
+      points = [[float(v) for v in parseTclList(point)] for point in parseTclList(points)]
+      controlPoints[round(float(offset), 2)] = numpy.array(points, dtype='float64').reshape(-1,3)
+    return controlPoints
+
+  def save(self,path):
+    """
+    write every label to a sidecar .npz file
+    """
+    if self.node:
+      # decode labels that have not been requested yet so they are included
+      for label in self.labels():
+        self.get(label)
+    arrays = {'version': numpy.array(self.version)}
+    for label, (offsets, counts, points) in self.packed.items():
+      arrays['offsets_' + label] = offsets
+      arrays['counts_' + label] = counts
+      arrays['points_' + label] = points
+    numpy.savez_compressed(path, **arrays)
+
+  def load(self,path):
+    """
+    replace the stored labels with those of a sidecar .npz file
+    """
+    arrays = numpy.load(path)
+    if str(arrays['version']) != self.version:
+      raise ValueError('%s is not a %s file' % (path, self.version))
+    for name in arrays.files:
+      if name.startswith('offsets_'):
+        label = name[len('offsets_'):]
+        self.packed[label] = (arrays[name], arrays['counts_' + label], arrays['points_' + label])
+        if self.node:
+          self.node.SetParameter(label, self.encode(*self.packed[label]))
+
+  def parameters(self):
+    """
+    the encoded value of every label, as kept on the node, without
+    decoding the labels that have not been requested
+    """
+    parameters = {}
+    for label in self.labels():
+      if self.node:
+        parameters[label] = self.node.GetParameter(label)
+      else:
+        parameters[label] = self.encode(*self.packed[label])
+    return parameters
+
+  def labels(self):
+    """
+    label values that have a parameter or have been set
+    """
+    labels = set(self.packed.keys())
+    if self.node:
+      names = self.node.GetParameterNamesAsCommaSeparatedList()
+      labels.update(name for name in names.split(',') if name)
+    return sorted(labels)
+
+  def update(self,parameters):
+    """
+    set labels from a dictionary of parameter values (as stored on the
+    node, in either format), e.g. those of readReferenceScene
+    """
+    for label, value in parameters.items():
+      self.set(label, self.unpack(*self.decode(value)))
+
+  def transform(self,matrix,sliceNormal,spacing,origin=0.):
+    """
+    map the control points of every label through the 4x4 matrix and move
+    each slice's points onto the slice plane nearest to their centroid
+    (planes are spacing mm apart along sliceNormal, one of them at offset
+    origin). The points of all labels are transformed and projected as one
+    array. Slices landing on the same plane keep the later one, as the
+    Slicer3 import did.
+    """
+    labels = [label for label in self.labels() if len(self.get(label))]
+    if not labels:
+      return
+    packed = [self.packed[label] for label in labels]
+    counts = numpy.concatenate([labelCounts for offsets, labelCounts, points in packed])
+    points = numpy.concatenate([labelPoints for offsets, labelCounts, labelPoints in packed])
+    matrix = numpy.asarray(matrix, dtype='float64')
+    sliceNormal = numpy.asarray(sliceNormal, dtype='float64')
+    sliceNormal = sliceNormal / numpy.sqrt((sliceNormal ** 2).sum())
+
+    points = numpy.dot(points, matrix[:3,:3].T) + matrix[:3,3]
+    starts = numpy.concatenate(([0], numpy.cumsum(counts)[:-1]))
+    centroids = numpy.add.reduceat(points, starts, axis=0) / counts[:,numpy.newaxis]
+    steps = numpy.round((numpy.dot(centroids, sliceNormal) - origin) / spacing)
+    offsets = numpy.round(origin + steps * spacing, 2)
+    distances = numpy.repeat(offsets, counts) - numpy.dot(points, sliceNormal)
+    points += distances[:,numpy.newaxis] * sliceNormal
+
+    # split the slices back into their labels
+    sliceStart = 0
+    pointStarts = numpy.concatenate((starts, [len(points)]))
+    for label, (labelOffsets, labelCounts, labelPoints) in zip(labels, packed):
+      controlPoints = {}
+      for index in range(sliceStart, sliceStart + len(labelCounts)):
+        controlPoints[float(offsets[index])] = points[pointStarts[index]:pointStarts[index+1]]
+      sliceStart += len(labelCounts)
+      self.set(label, controlPoints)
+
+
+# the ModelDraw node attribute naming the background volume the control
+# points were drawn on
+backgroundAttribute = 'ModelDraw.backgroundVolume'
+
+def readReferenceScene(path):
+  """
+  the ModelDraw parameters (a dictionary of parameter values keyed by
+  label) and the image file names of the grayscale volumes of a .mrml
+  scene. The scene is read as plain XML, so this can run off the main
+  thread; nothing is added to a MRML scene.
+  """
+  root = xml.etree.ElementTree.parse(path).getroot()
+  directory = os.path.dirname(os.path.abspath(path))
+  parameters = {}
+  for element in root.iter('ScriptedModule'):
+    if element.get('ModuleName', '').strip() != 'ModelDraw':
+      continue
+    for name, value in element.attrib.items():
+      if name.startswith('parameter') and name[len('parameter'):].isdigit():
+        # Slicer3 and early Slicer4 scenes: parameterN="label value"
+        label, _, value = value.strip().partition(' ')
+        parameters[label] = value
+      elif name == 'parameters':
+        # later scenes: parameters="label:value;label:value"
+        for item in value.split(';'):
+          label, _, value = item.partition(':')
+          if label:
+            parameters[label] = value
+
+  volumes = [fileName for volumeID, fileName, labelMap in sceneVolumes(root, directory) if not labelMap]
+  return parameters, volumes
+
+
+def readSceneVolumes(path):
+  """
+  the volumes of a .mrml scene, as (node id, image file name, label map)
+  tuples, and the id of the background volume the ModelDraw control points
+  were drawn on (None if the scene does not record it), read as plain XML
+  """
+  root = xml.etree.ElementTree.parse(path).getroot()
+  background = None
+  for element in root.iter('ScriptedModule'):
+    if element.get('ModuleName', '').strip() != 'ModelDraw':
+      continue
+    # node attributes are written as attributes="name:value;name:value"
+    for item in element.get('attributes', '').split(';'):
+      name, _, value = item.partition(':')
+      if name == backgroundAttribute and value:
+        background = value
+  return sceneVolumes(root, os.path.dirname(os.path.abspath(path))), background
+
+
+def sceneVolumes(root,directory):
+  """
+  (node id, image file name, label map) of the volumes of a parsed scene
+  """
+  storageFiles = dict((element.get('id'), element.get('fileName')) for element in root.iter() if element.get('fileName'))
+  volumes = []
+  for element in root.iter('Volume'):
+    fileName = storageFiles.get(element.get('storageNodeRef'))
+    if fileName:
+      volumes.append((element.get('id'), os.path.join(directory, fileName), element.get('labelMap', '0') == '1'))
+  return volumes
+
+
+#
+# GridIndex
+#
+
+class GridIndex:
+  """
+  Uniform grid over numbered 2D points for nearest neighbor queries.
+  The items are kept ordered by grid cell (sortedKeys, sortedItems), so the
+  items of a cell are found by binary search. Inserting, deleting and moving
+  items update these arrays in place - renumbering the items after an
+  inserted or deleted one as a single vectorized step - rather than
+  rebuilding the index.
+  """
+
+  # cell coordinates are packed into one int64 key
+  keyOffset = 2**30
+  keyStride = 2**31
+
+  def __init__(self,cellSize,points=()):
+    self.cellSize = float(cellSize)
+    self.build(points)
+
+  def build(self,points):
+    """
+    index the (N,2) points, numbered by their order
+    """
+    self.points = numpy.array(points, dtype='float64').reshape(-1,2)
+    self.keys = self.cellKeys(self.points)
+    order = numpy.argsort(self.keys, kind='mergesort')
+    self.sortedKeys = self.keys[order]
+    self.sortedItems = order.astype('int64')
+
+  def cellKeys(self,points):
+    cells = numpy.floor(numpy.asarray(points, dtype='float64').reshape(-1,2) / self.cellSize).astype('int64')
+    return (cells[:,0] + self.keyOffset) * self.keyStride + (cells[:,1] + self.keyOffset)
+
+  def __len__(self):
+    return len(self.points)
+
+  def unsort(self,item):
+    low = numpy.searchsorted(self.sortedKeys, self.keys[item], side='left')
+    high = numpy.searchsorted(self.sortedKeys, self.keys[item], side='right')
+    position = low + numpy.nonzero(self.sortedItems[low:high] == item)[0][0]
+    self.sortedKeys = numpy.delete(self.sortedKeys, position)
+    self.sortedItems = numpy.delete(self.sortedItems, position)
+
+  def sort(self,item):
+    position = numpy.searchsorted(self.sortedKeys, self.keys[item], side='right')
+    self.sortedKeys = numpy.insert(self.sortedKeys, position, self.keys[item])
+    self.sortedItems = numpy.insert(self.sortedItems, position, item)
+
+  def move(self,item,point):
+    """
+    move item to point
+    """
+    key = self.cellKeys(point)[0]
+    if key != self.keys[item]:
+      self.unsort(item)
+      self.keys[item] = key
+      self.sort(item)
+    self.points[item] = point
+
+  def insert(self,item,point):
+    """
+    add a point numbered item, renumbering the items from item on
+    """
+    self.sortedItems[self.sortedItems >= item] += 1
+    self.points = numpy.insert(self.points, item, point, axis=0)
+    self.keys = numpy.insert(self.keys, item, self.cellKeys(point)[0])
+    self.sort(item)
+
+  def delete(self,item):
+    """
+    remove item, renumbering the items after it
+    """
+    self.unsort(item)
+    self.sortedItems[self.sortedItems > item] -= 1
+    self.points = numpy.delete(self.points, item, axis=0)
+    self.keys = numpy.delete(self.keys, item)
+
+  def candidates(self,point,radius):
+    """
+    the items in the cells within radius of point (a superset of
+    the items within radius)
+    """
+    reach = int(numpy.ceil(radius / self.cellSize))
+    center = numpy.floor(numpy.asarray(point, dtype='float64') / self.cellSize).astype('int64')
+    span = numpy.arange(-reach, reach + 1)
+    columns = (center[0] + span + self.keyOffset) * self.keyStride
+    keys = (columns[:,numpy.newaxis] + (center[1] + span + self.keyOffset)).ravel()
+    low = numpy.searchsorted(self.sortedKeys, keys, side='left')
+    high = numpy.searchsorted(self.sortedKeys, keys, side='right')
+    ranges = [self.sortedItems[start:end] for start, end in zip(low, high) if end > start]
+    if not ranges:
+      return numpy.zeros(0, dtype='int64')
+    return numpy.concatenate(ranges)
+
+  def nearest(self,point,radius):
+    """
+    (item, distance) of the point nearest to point within radius, or None
+    """
+    items = self.candidates(point, radius)
+    if not len(items):
+      return None
+    distances = numpy.sqrt(((self.points[items] - point) ** 2).sum(axis=1))
+    best = distances.argmin()
+    if distances[best] > radius:
+      return None
+    return int(items[best]), float(distances[best])
+
+
+#
+# UndoJournal
+#
+
+class SliceDelta:
+  """
+  The label voxels changed within the bounding box of one slice edit,
+  kept as the zlib compressed XOR of the values before and after. Applying
+  the delta to the slice in place toggles between the two states, so the
+  same delta serves both undo and redo.
+  """
+
+  def __init__(self,sliceAxis,sliceIndex,origin,before,after):
+    self.sliceAxis = sliceAxis
+    self.sliceIndex = sliceIndex
+    self.origin = origin
+    self.shape = before.shape
+    self.dtype = before.dtype
+    self.data = zlib.compress(numpy.bitwise_xor(before, after).tobytes(), 1)
+
+  def nbytes(self):
+    return len(self.data)
+
+  def apply(self,labelArray):
+    """
+    toggle the slice region of labelArray (indexed k,j,i) in place
+    """
+    index = [slice(None)] * 3
+    index[2 - self.sliceAxis] = self.sliceIndex
+    plane = labelArray[tuple(index)]
+    (row, column), (rows, columns) = self.origin, self.shape
+    delta = numpy.frombuffer(zlib.decompress(self.data), dtype=self.dtype).reshape(self.shape)
+    region = plane[row:row+rows, column:column+columns]
+    numpy.bitwise_xor(region, delta, out=region)
+
+
+class JournalEntry:
+  """
+  One undoable edit: the SliceDeltas written to the label map and the
+  control points of each changed (label, offset) before and after the edit
+  (None where the slice had no control points).
+  """
+
+  def __init__(self,name,serial):
+    self.name = name
+    self.serial = serial
+    self.deltas = []
+    self.controlPoints = collections.OrderedDict()
+
+  def nbytes(self):
+    size = sum(delta.nbytes() for delta in self.deltas)
+    for before, after in self.controlPoints.values():
+      size += sum(points.nbytes for points in (before, after) if points is not None)
+    return size
+
+  def empty(self):
+    return not self.deltas and not self.controlPoints
+
+
+class UndoJournal:
+  """
+  Undo and redo stacks of JournalEntries. Edits between begin and end
+  (which nest) form one entry; edits recorded outside of them are entries
+  of their own. Repeated control point edits of a slice within an entry
+  are merged, so a whole drag undoes at once. When the entries hold more
+  than maxBytes the oldest are dropped; with a maxBytes of 0 nothing is
+  recorded. Recording is thread safe, so the slices of a multi-slice
+  apply can be recorded from worker threads.
+  """
+
+  # entries of all journals are numbered in order, so the latest
+  # edit among several journals (one per view) can be found
+  serials = itertools.count(1)
+
+  def __init__(self,maxBytes=2**26):
+    self.maxBytes = maxBytes
+    self.undoEntries = collections.deque()
+    self.redoEntries = []
+    self.pending = None
+    self.depth = 0
+    self.lock = threading.RLock()
+
+  def begin(self,name='edit'):
+    with self.lock:
+      if not self.depth:
+        self.pending = JournalEntry(name, next(self.serials))
+      self.depth += 1
+
+  def end(self):
+    with self.lock:
+      self.depth -= 1
+      if not self.depth:
+        entry, self.pending = self.pending, None
+        self.push(entry)
+
+  def push(self,entry):
+    if entry.empty():
+      return
+    self.undoEntries.append(entry)
+    self.redoEntries = []
+    self.evict()
+
+  def evict(self):
+    """
+    drop the oldest entries until the journal fits in maxBytes
+    """
+    sizes = [entry.nbytes() for entry in self.undoEntries]
+    total = sum(sizes)
+    for size in sizes:
+      if total <= self.maxBytes:
+        break
+      self.undoEntries.popleft()
+      total -= size
+
+  def nbytes(self):
+    return sum(entry.nbytes() for entry in list(self.undoEntries) + self.redoEntries)
+
+  def recordSlice(self,sliceAxis,sliceIndex,origin,before,after):
+    """
+    record that the region of a label slice at origin (row,column)
+    changed from before to after
+    """
+    if not self.maxBytes:
+      return
+    delta = SliceDelta(sliceAxis, sliceIndex, origin, before, after)
+    with self.lock:
+      self.begin('apply')
+      self.pending.deltas.append(delta)
+      self.end()
+
+  def recordControlPoints(self,label,offset,before,after):
+    """
+    record that the control points of label at offset changed from
+    before to after (copies are kept; None for no control points)
+    """
+    if not self.maxBytes:
+      return
+    after = None if after is None else numpy.array(after, dtype='float64')
+    with self.lock:
+      self.begin('control points')
+      key = (label, offset)
+      if key in self.pending.controlPoints:
+        before = self.pending.controlPoints[key][0]
+      elif before is not None:
+        before = numpy.array(before, dtype='float64')
+      self.pending.controlPoints[key] = (before, after)
+      self.end()
+
+  def canUndo(self):
+    return bool(self.undoEntries)
+
+  def canRedo(self):
+    return bool(self.redoEntries)
+
+  def latest(self,redo=False):
+    """
+    serial of the entry undo (or redo) would replay (0 if none)
+    """
+    entries = self.redoEntries if redo else self.undoEntries
+    return entries[-1].serial if entries else 0
+
+  def undo(self):
+    """
+    move the latest entry to the redo stack and return it (None if none)
+    """
+    with self.lock:
+      if not self.undoEntries:
+        return None
+      entry = self.undoEntries.pop()
+      self.redoEntries.append(entry)
+      return entry
+
+  def redo(self):
+    """
+    move the latest undone entry back to the undo stack and return it
+    """
+    with self.lock:
+      if not self.redoEntries:
+        return None
+      entry = self.redoEntries.pop()
+      self.undoEntries.append(entry)
+      return entry
+
+
+#
+# AutosaveJournal
+#
+
+class AutosaveJournal:
+  """
+  Crash safe copy of the control points of every label, kept in a
+  directory as a snapshot (the labels' encoded ControlPointStore
+  parameters, as JSON) and an append-only journal of the slices edited
+  since. Labels are only decoded once a record edits them. Each record holds the
+  edit, label, offset and the slice's points after the edit (none for a
+  removed slice), with a CRC so that a record torn by a crash ends the
+  replay. Edits are queued by record() and written by a background thread
+  in batches, every interval seconds at most, keeping only the latest
+  record of a slice within a batch. The writer folds the journal into a
+  new snapshot once it holds compactBytes or is compactInterval seconds old.
+  If writing fails (e.g. the disk is full) the writer stops and keeps the
+  exception in error; later edits are dropped and flush and close give up
+  instead of waiting.
+  """
+
+  edits = ('add', 'split', 'move', 'delete', 'copy', 'undo', 'redo')
+  magic = b'ModelDrawJournal1\n'
+  # crc, edit, offset, label length, point count
+  header = struct.Struct('<IBdHI')
+
+  def __init__(self,directory,interval=0.5,compactBytes=2**20,compactInterval=60.):
+    self.directory = directory
+    self.journalPath = os.path.join(directory, 'journal.bin')
+    self.snapshotPath = os.path.join(directory, 'snapshot.json')
+    self.interval = interval
+    self.compactBytes = compactBytes
+    self.compactInterval = compactInterval
+    self.queue = queue.Queue()
+    self.thread = None
+    self.error = None
+    # the labels as written, kept by the writer for compaction: encoded
+    # parameters, or control point dictionaries once edited
+    self.state = {}
+    # time of the latest edit in the state (None for none since start)
+    self.edited = None
+    self.journalFile = None
+    self.compacted = 0.
+
+  def encodeRecord(self,edit,label,offset,points):
+    label = str(label).encode('utf-8')
+    body = self.header.pack(0, self.edits.index(edit), offset, len(label), len(points))[4:]
+    body += label + numpy.ascontiguousarray(points, dtype='<f8').tobytes()
+    return struct.pack('<I', zlib.crc32(body) & 0xffffffff) + body
+
+  def readRecords(self,data):
+    """
+    the (edit, label, offset, points) records of journal data, up to the
+    first incomplete or corrupt one
+    """
+    records = []
+    position = len(self.magic) if data.startswith(self.magic) else len(data)
+    while position + self.header.size <= len(data):
+      crc, edit, offset, labelLength, count = self.header.unpack_from(data, position)
+      end = position + self.header.size + labelLength + 24 * count
+      if end > len(data) or zlib.crc32(data[position+4:end]) & 0xffffffff != crc or edit >= len(self.edits):
+        break
+      start = position + self.header.size
+      label = data[start:start+labelLength].decode('utf-8')
+      points = numpy.frombuffer(data, dtype='<f8', count=3*count, offset=start+labelLength).reshape(-1,3).astype('float64')
+      records.append((self.edits[edit], label, offset, points))
+      position = end
+    return records
+
+  def readSnapshot(self):
+    """
+    the encoded labels and edit time of the snapshot ({} and None if there is none)
+    """
+    if not os.path.exists(self.snapshotPath):
+      return {}, None
+    with open(self.snapshotPath) as snapshotFile:
+      snapshot = json.load(snapshotFile)
+    return snapshot['parameters'], snapshot['edited']
+
+  def lastEdit(self):
+    """
+    the time of the latest edit that was written, or None if nothing was
+    edited since journaling last started
+    """
+    if os.path.exists(self.journalPath) and os.path.getsize(self.journalPath) > len(self.magic):
+      return os.path.getmtime(self.journalPath)
+    return self.readSnapshot()[1]
+
+  def recover(self):
+    """
+    the control points of the snapshot with the journal replayed over
+    them, as a dictionary of labels (empty if nothing was saved)
+    """
+    store = ControlPointStore()
+    state = dict((label, store.unpack(*store.decode(value))) for label, value in self.readSnapshot()[0].items())
+    if os.path.exists(self.journalPath):
+      with open(self.journalPath, 'rb') as journalFile:
+        data = journalFile.read()
+      for edit, label, offset, points in self.readRecords(data):
+        controlPoints = state.setdefault(label, {})
+        if len(points):
+          controlPoints[offset] = points
+        else:
+          controlPoints.pop(offset, None)
+    return state
+
+  def start(self,parameters):
+    """
+    start journaling from the encoded labels of a ControlPointStore (see
+    ControlPointStore.parameters), which are written as the first snapshot
+    """
+    if not os.path.isdir(self.directory):
+      os.makedirs(self.directory)
+    self.queue.put(('snapshot', parameters))
+    self.thread = threading.Thread(target=self.run, name='ModelDraw autosave')
+    self.thread.daemon = True
+    self.thread.start()
+
+  def record(self,edit,label,offset,controlPoints):
+    """
+    queue the points of a slice after an edit (None or empty when the
+    slice was removed); returns at once
+    """
+    if self.thread is None or self.error is not None:
+      return
+    points = numpy.zeros((0,3)) if controlPoints is None else numpy.array(controlPoints, dtype='float64').reshape(-1,3)
+    self.queue.put(('record', (edit, str(label), offset, points)))
+
+  def snapshot(self,parameters):
+    """
+    replace everything written with the encoded labels (e.g. after an import)
+    """
+    if self.thread is not None:
+      self.queue.put(('snapshot', parameters))
+
+  def flush(self,timeout=10.):
+    """
+    wait until everything queued is on disk, for at most timeout seconds.
+    Returns False if that did not happen (see error).
+    """
+    if self.thread is None:
+      return self.error is None
+    done = threading.Event()
+    self.queue.put(('flush', done))
+    deadline = time.time() + timeout
+    while not done.wait(0.05):
+      if not self.thread.is_alive() or time.time() > deadline:
+        return False
+    return True
+
+  def close(self,timeout=10.):
+    if self.thread is not None:
+      self.queue.put(('close', None))
+      self.thread.join(timeout)
+      self.thread = None
+
+  def run(self):
+    """
+    write the queued records in batches (on the writer thread), keeping
+    the error that stops it
+    """
+    try:
+      self.writeQueued()
+    except Exception as error:
+      self.error = error
+    finally:
+      if self.journalFile:
+        try:
+          self.journalFile.close()
+        except (IOError, OSError):
+          pass
+        self.journalFile = None
+
+  def writeQueued(self):
+    running = True
+    while running:
+      batch = [self.queue.get()]
+      deadline = time.time() + self.interval
+      while batch[-1][0] == 'record':
+        try:
+          batch.append(self.queue.get(timeout=max(0., deadline - time.time())))
+        except queue.Empty:
+          break
+      records = collections.OrderedDict()
+      for command, argument in batch:
+        if command == 'record':
+          edit, label, offset, points = argument
+          records.pop((label, offset), None)
+          records[(label, offset)] = argument
+          continue
+        self.write(records.values())
+        records.clear()
+        if command == 'snapshot':
+          self.state = dict((str(label), value) for label, value in argument.items())
+          self.edited = None
+          self.compact()
+        elif command == 'flush':
+          argument.set()
+        elif command == 'close':
+          running = False
+      self.write(records.values())
+
+  def write(self,records):
+    """
+    append records to the journal and apply them to the written state,
+    compacting when the journal is due
+    """
+    records = list(records)
+    if not records:
+      return
+    data = b''.join(self.encodeRecord(*record) for record in records)
+    self.journalFile.write(data)
+    self.journalFile.flush()
+    os.fsync(self.journalFile.fileno())
+    self.edited = time.time()
+    for edit, label, offset, points in records:
+      controlPoints = self.controlPoints(label)
+      if len(points):
+        controlPoints[offset] = points
+      else:
+        controlPoints.pop(offset, None)
+    if self.journalFile.tell() > self.compactBytes or time.time() - self.compacted > self.compactInterval:
+      self.compact()
+
+  def controlPoints(self,label):
+    """
+    the written control points of label, decoded on first use
+    """
+    value = self.state.get(label, {})
+    if not isinstance(value, dict):
+      store = ControlPointStore()
+      value = store.unpack(*store.decode(value))
+    self.state[label] = value
+    return value
+
+  def compact(self):
+    """
+    write the state as the new snapshot and empty the journal. A crash
+    in between replays the journal over a snapshot that already has it,
+    which gives the same state.
+    """
+    store = ControlPointStore()
+    parameters = {}
+    for label, value in self.state.items():
+      parameters[label] = store.encode(*store.pack(value)) if isinstance(value, dict) else value
+    temporary = self.snapshotPath + '.new'
+    with open(temporary, 'w') as snapshotFile:
+      json.dump({'parameters': parameters, 'edited': self.edited}, snapshotFile)
+      snapshotFile.flush()
+      os.fsync(snapshotFile.fileno())
+    os.replace(temporary, self.snapshotPath)
+    if self.journalFile is None:
+      self.journalFile = open(self.journalPath, 'wb')
+    self.journalFile.seek(0)
+    self.journalFile.truncate()
+    self.journalFile.write(self.magic)
+    self.journalFile.flush()
+    os.fsync(self.journalFile.fileno())
+    self.compacted = time.time()
+
+
+#
+# ContourSurface
+#
+
+class ContourSurface:
+  """
+  Closed triangle surface through a stack of closed slice curves.
+  Each curve is resampled to pointCount points equally spaced by arclength
+  and oriented counterclockwise around the slice normal (a ring). The band
+  between consecutive rings joins each point to the point of the other ring
+  at the cyclic shift that best aligns them, found for all shifts at once
+  by FFT cross-correlation. The lowest and highest rings are closed with
+  fans around their centroids.
+  Rings and bands are cached: bands are stored as triangles of ring-local
+  indices, so when one curve changes only that ring and the two bands next
+  to it are rebuilt, and the rest are just re-indexed.
+  """
+
+  def __init__(self,pointCount=64):
+    self.pointCount = pointCount
+    # offset -> (digest of the curve, ring)
+    self.rings = {}
+    # (lower offset, upper offset) -> (lower digest, upper digest, local triangles)
+    self.bands = {}
+    # number of bands rebuilt by the last update
+    self.rebuilt = 0
+
+  def update(self,curves,sliceNormal):
+    """
+    the (points, triangles, normals) arrays of the surface through the
+    closed (N,3) curves, a dictionary keyed by slice offset. Returns empty
+    arrays if fewer than two curves are given.
+    """
+    sliceNormal = numpy.asarray(sliceNormal, dtype='float64')
+    offsets = sorted(offset for offset in curves if len(curves[offset]) > 3)
+    digests = {}
+    for offset in offsets:
+      curve = numpy.ascontiguousarray(curves[offset], dtype='float64')
+      # a collision would silently keep a stale ring, so use a real digest
+      # of the curve's buffer rather than hash()
+      digests[offset] = hashlib.blake2b(curve, digest_size=16).digest()
+      if self.rings.get(offset, (None,))[0] != digests[offset]:
+        self.rings[offset] = (digests[offset], self.resample(curve, sliceNormal))
+    for offset in list(self.rings.keys()):
+      if offset not in digests:
+        del self.rings[offset]
+
+    self.rebuilt = 0
+    if len(offsets) < 2:
+      self.bands = {}
+      return numpy.zeros((0,3)), numpy.zeros((0,3), dtype='int64'), numpy.zeros((0,3))
+    bands = {}
+    for lower, upper in zip(offsets[:-1], offsets[1:]):
+      band = self.bands.get((lower, upper))
+      if band is None or band[:2] != (digests[lower], digests[upper]):
+        local = self.bandTriangles(self.rings[lower][1], self.rings[upper][1])
+        band = (digests[lower], digests[upper], local)
+        self.rebuilt += 1
+      bands[(lower, upper)] = band
+    self.bands = bands
+
+    count = self.pointCount
+    rings = [self.rings[offset][1] for offset in offsets]
+    bottom, top = len(rings) * count, len(rings) * count + 1
+    points = numpy.vstack(rings + [rings[0].mean(axis=0), rings[-1].mean(axis=0)])
+    triangles = []
+    for index, (lower, upper) in enumerate(zip(offsets[:-1], offsets[1:])):
+      # local indices below count are on the lower ring, the rest on the upper one
+      triangles.append(bands[(lower, upper)][2] + index * count)
+    ring = numpy.arange(count)
+    following = (ring + 1) % count
+    triangles.append(numpy.column_stack((numpy.full(count, bottom), following, ring)))
+    last = (len(rings) - 1) * count
+    triangles.append(numpy.column_stack((numpy.full(count, top), last + ring, last + following)))
+    triangles = numpy.vstack(triangles).astype('int64')
+    return points, triangles, self.vertexNormals(points, triangles)
+
+  def resample(self,curve,sliceNormal):
+    """
+    pointCount points equally spaced by arclength along the closed curve,
+    counterclockwise around sliceNormal
+    """
+    if not numpy.array_equal(curve[0], curve[-1]):
+      curve = numpy.vstack((curve, curve[:1]))
+    segments = numpy.diff(curve, axis=0)
+    lengths = numpy.sqrt((segments * segments).sum(axis=1))
+    cumulative = numpy.concatenate(([0.], numpy.cumsum(lengths)))
+    targets = numpy.arange(self.pointCount) * (cumulative[-1] / self.pointCount)
+    index = numpy.clip(numpy.searchsorted(cumulative, targets, side='right') - 1, 0, len(segments) - 1)
+    t = (targets - cumulative[index]) / numpy.where(lengths[index] > 0, lengths[index], 1.)
+    ring = curve[index] + t[:,numpy.newaxis] * segments[index]
+    area = numpy.dot(numpy.cross(ring, numpy.roll(ring, -1, axis=0)).sum(axis=0), sliceNormal)
+    if area < 0:
+      ring = ring[::-1].copy()
+    return ring
+
+  def bandTriangles(self,lower,upper):
+    """
+    (2*pointCount,3) triangles joining the lower and upper rings, with
+    indices of upper ring points offset by pointCount. Point i of the lower
+    ring is joined to point i+shift of the upper ring, for the shift that
+    minimizes the summed squared distance of the joined points.
+    """
+    count = self.pointCount
+    # sum over i of lower[i].upper[i+shift] for every shift
+    correlation = numpy.fft.ifft(numpy.conj(numpy.fft.fft(lower, axis=0)) * numpy.fft.fft(upper, axis=0), axis=0)
+    shift = correlation.real.sum(axis=1).argmax()
+    i = numpy.arange(count)
+    i1 = (i + 1) % count
+    j = count + (i + shift) % count
+    j1 = count + (i + 1 + shift) % count
+    return numpy.vstack((numpy.column_stack((i, i1, j1)), numpy.column_stack((i, j1, j))))
+
+  def vertexNormals(self,points,triangles):
+    """
+    unit normals at the points: the sums of the area weighted normals
+    of the triangles around each point
+    """
+    p0, p1, p2 = points[triangles[:,0]], points[triangles[:,1]], points[triangles[:,2]]
+    faceNormals = numpy.cross(p1 - p0, p2 - p0)
+    normals = numpy.zeros_like(points)
+    for corner in range(3):
+      numpy.add.at(normals, triangles[:,corner], faceNormals)
+    return normals / numpy.maximum(numpy.sqrt((normals * normals).sum(axis=1)), 1e-12)[:,numpy.newaxis]
+
+
+#
+# ContourPrefetcher
+#
+
+class ContourPrefetcher:
+  """
+  Computes the curves of the slices ahead of the current one on a worker
+  thread while the view scrolls, so moving onto an interpolated slice only
+  takes a cache lookup. The scroll direction is predicted from the last
+  slice change; the next depth slices that way (and the one behind) are
+  interpolated in one call, then evaluated and snapped one at a time.
+  Curves are kept in a least recently used cache of capacity entries keyed
+  by ModelDrawEngine.contourKey (label, offset and control point version).
+  A newer schedule supersedes the pending work, and cancel() stops it and
+  drops the cache when the control points change.
+  """
+
+  def __init__(self,engine,depth=4,capacity=64):
+    self.engine = engine
+    self.depth = depth
+    self.capacity = capacity
+    self.cache = collections.OrderedDict()
+    self.lock = threading.Lock()
+    # work is dropped when the generation (control points) or job changes
+    self.generation = 0
+    self.job = 0
+    self.lastOffset = None
+    self.direction = 1
+    self.executor = None
+
+  def get(self,key):
+    """
+    the cached curve for key, or None
+    """
+    with self.lock:
+      curve = self.cache.get(key)
+      if curve is not None:
+        self.cache.move_to_end(key)
+      return curve
+
+  def put(self,key,curve,generation=None):
+    with self.lock:
+      if generation is not None and generation != self.generation:
+        return
+      self.cache[key] = curve
+      self.cache.move_to_end(key)
+      while len(self.cache) > self.capacity:
+        self.cache.popitem(last=False)
+
+  def cancel(self):
+    """
+    stop pending work and drop the cached curves
+    """
+    with self.lock:
+      self.generation += 1
+      self.cache.clear()
+
+  def shutdown(self):
+    self.cancel()
+    if self.executor:
+      self.executor.shutdown(wait=False)
+      self.executor = None
+
+  def targets(self,offset,spacing):
+    """
+    the offsets to compute after a move to offset: depth slices in the
+    predicted scroll direction and one behind
+    """
+    if self.lastOffset is not None and offset != self.lastOffset:
+      self.direction = 1 if offset > self.lastOffset else -1
+    self.lastOffset = offset
+    steps = list(range(1, self.depth + 1)) + [-1]
+    return [round(offset + self.direction * step * spacing, 2) for step in steps]
+
+  def schedule(self,offset,spacing):
+    """
+    start computing the interpolated slices around offset that are not
+    cached yet. The volumes are looked up here, on the calling thread.
+    """
+    import concurrent.futures
+
+    engine = self.engine
+    stack = engine.controlPointStack()
+    targets = self.targets(offset, spacing)
+    if stack is None or len(stack[0]) < 2:
+      return
+    targets = [target for target in targets if stack[0][0] < target < stack[0][-1]
+               and target not in engine.controlPoints and self.get(engine.contourKey(target)) is None]
+    if not targets:
+      return
+    sliceNormal = engine.sliceAxes()[2]
+    snapArguments = None
+    if engine.snap:
+      entry = engine.backgroundEntry()
+      level = entry.downsampled(engine.snapCoarseFactor)
+      snapArguments = (sliceNormal, entry.volume, entry.rasToIJK, None, None, (level.volume, level.rasToIJK))
+    keys = [engine.contourKey(target) for target in targets]
+    with self.lock:
+      self.job += 1
+      job, generation = self.job, self.generation
+    if self.executor is None:
+      self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    return self.executor.submit(self.run, job, generation, keys, targets, stack, sliceNormal, snapArguments)
+
+  def run(self,job,generation,keys,targets,stack,sliceNormal,snapArguments):
+    """
+    compute the curves of targets (on the worker thread)
+    """
+    engine = self.engine
+    stale = lambda: job != self.job or generation != self.generation
+    if stale():
+      return
+    points = engine.interpolateStack(stack[1], stack[0], targets, sliceNormal)
+    for key, controlPoints in zip(keys, points):
+      if stale():
+        return
+      if numpy.isnan(controlPoints).any() or self.get(key) is not None:
+        continue
+      curve = engine.curve(controlPoints)
+      if snapArguments and len(curve) > 3:
+        curve = engine.snapCurve(curve, len(controlPoints), *snapArguments)
+      self.put(key, curve, generation)
+
+
+#
+# ContourModel
+#
+
+class ContourModel:
+  """
+  The control points, curves and surface of one label, shared by the
+  engines of every view showing the label so that each curve is computed
+  once, in RAS. The slices are normal to sliceNormal, taken from the view
+  the first control point was drawn in: views parallel to it edit the
+  model and show its curves, other views show where its surface crosses
+  their plane (see planeSegments). Subscribers are called with the engine
+  that made a change after the control points change.
+  """
+
+  def __init__(self,label=None,controlPoints=None):
+    self.label = label
+    self.sliceNormal = None
+    self.controlPoints = {}
+    self.curves = {}
+    self.curveStates = {}
+    self.dirty = {}
+    self.pointIndexes = {}
+    self.segmentIndexes = {}
+    self.contourSurface = ContourSurface()
+    # counts control point changes (see ModelDrawEngine.contourKey)
+    self.version = 0
+    self.subscribers = []
+    if controlPoints:
+      self.load(controlPoints)
+
+  def load(self,controlPoints):
+    """
+    replace the control points, dropping everything computed from them
+    """
+    for cache in (self.controlPoints, self.curves, self.curveStates, self.dirty, self.pointIndexes, self.segmentIndexes):
+      cache.clear()
+    self.controlPoints.update(controlPoints)
+    self.sliceNormal = self.estimateNormal()
+
+  def estimateNormal(self):
+    """
+    the unit normal of the planes of the control point slices, signed so
+    that the slice offsets are positions along it (None if no slice has
+    three points off a line)
+    """
+    for offset, points in sorted(self.controlPoints.items()):
+      if len(points) < 3:
+        continue
+      center = points.mean(axis=0)
+      singular, vectors = numpy.linalg.svd(points - center)[1:]
+      if singular[1] < 1e-6:
+        continue
+      normal = vectors[2]
+      if abs(numpy.dot(center, -normal) - offset) < abs(numpy.dot(center, normal) - offset):
+        normal = -normal
+      return normal
+    return None
+
+  def subscribe(self,callback):
+    if callback not in self.subscribers:
+      self.subscribers.append(callback)
+
+  def unsubscribe(self,callback):
+    if callback in self.subscribers:
+      self.subscribers.remove(callback)
+
+  def changed(self,source=None):
+    """
+    note a change of the control points (made by the engine source)
+    """
+    self.version += 1
+    for callback in list(self.subscribers):
+      callback(source)
+
+  def parallel(self,sliceNormal):
+    """
+    True if planes normal to sliceNormal are slices of the model (which
+    any plane is until the first control point sets the orientation)
+    """
+    if self.sliceNormal is None:
+      return True
+    return numpy.dot(self.sliceNormal, sliceNormal) > 1 - 1e-4
+
+  def planeSegments(self,points,triangles,planeNormal,planeOffset):
+    """
+    (S,2,3) end points of the line segments where the triangles of a
+    (points, triangles) surface cross the plane of RAS points p with
+    dot(p, planeNormal) == planeOffset, found for all triangles at once
+    """
+    if not len(triangles):
+      return numpy.zeros((0,2,3))
+    distances = (numpy.dot(points, planeNormal) - planeOffset)[triangles]
+    above = distances > 0
+    count = above.sum(axis=1)
+    crossing = (count == 1) | (count == 2)
+    triangles, distances, above, count = triangles[crossing], distances[crossing], above[crossing], count[crossing]
+    # the corner alone on its side of the plane, then the other two in order
+    rows = numpy.arange(len(triangles))
+    lone = numpy.where(count == 1, above.argmax(axis=1), (~above).argmax(axis=1))
+    corners = [(lone + step) % 3 for step in range(3)]
+    p0, p1, p2 = [points[triangles[rows,corner]] for corner in corners]
+    d0, d1, d2 = [distances[rows,corner][:,numpy.newaxis] for corner in corners]
+    start = p0 + d0 / (d0 - d1) * (p1 - p0)
+    end = p0 + d0 / (d0 - d2) * (p2 - p0)
+    return numpy.stack((start, end), axis=1)
+
+
+#
+# ModelDrawEngine
+#
+
+class CurveState:
+  """
+  Cached computation of one slice's curve: the curve settings (key) and
+  unsnapped (N,splineSteps,3) segment samples, the snapped closed curve,
+  and the segments still waiting to be snapped (None for all of them).
+  With edge tangents it also holds the tangent at each control point and
+  the points whose tangents still need to be estimated from the image.
+  snapConfidence holds the confidence of each snapped sample.
+  """
+
+  def __init__(self,key,segments=None):
+    self.key = key
+    self.segments = segments
+    self.snapped = None
+    self.pendingSnap = None
+    self.snapConfidence = None
+    self.tangents = None
+    self.pendingTangents = set()
+
+
+class ModelDrawEngine:
+  """
+  The curve engine of the effect: control points and curves of one label,
+  spline and inter-slice interpolation, snapping, edge tangents and
+  rasterization into a label array. It uses only NumPy, so it can run in
+  worker processes and batch jobs as well as behind ModelDrawEffectLogic.
+  The slice geometry and the volumes come from the accessors offset,
+  sliceAxes, sliceSpacing, backgroundEntry and labelVolume; by default they
+  return the attributes set on the engine, and adapters override them to
+  read a slice view instead.
+  """
+
+  # Hermite basis matrices shared by all instances, keyed by splineSteps
+  hermiteBases = {}
+
+  # the curve options, as copied to worker processes by applyAllLabels
+  optionNames = ('interpolation', 'splineSteps', 'tension', 'bias', 'continuity',
+                 'snap', 'patchSize', 'snapRange', 'snapSteps', 'snapMode', 'snapMaxStep',
+                 'snapSmoothness', 'snapCoarseRange', 'snapCoarseFactor',
+                 'edgeTangents', 'edgeTangentSampleDistance', 'edgeTangentSampleSteps')
+
+  def __init__(self):
+    # curve options - these mirror the public variables of the Slicer3 effect
+    # interpolation is 'linear' or 'spline' (TBC, or Hermite when edge tangents are given)
+    self.interpolation = 'spline'
+    self.splineSteps = 10
+    self.tension = 0.
+    self.bias = 0.
+    self.continuity = 0.
+    # snap options - patches are width x height samples at 1mm spacing,
+    # searched over snapSteps offsets spanning snapRange mm along the curve normal
+    self.snap = False
+    self.patchSize = (3,15)
+    self.snapRange = 10.
+    self.snapSteps = 10
+    # snapMode 'independent' picks the best offset for each sample on its
+    # own; 'smooth' picks the best closed path whose offset changes by at most
+    # snapMaxStep mm between neighboring samples (each mm of change costing
+    # snapSmoothness times the mean patch difference), first over
+    # snapCoarseRange mm on the volume downsampled by snapCoarseFactor,
+    # then finely around that path
+    self.snapMode = 'independent'
+    self.snapMaxStep = 1.
+    self.snapSmoothness = 0.5
+    self.snapCoarseRange = 20.
+    self.snapCoarseFactor = 2
+    # edge tangent options - the tangent at a control point is the direction
+    # (in edgeTangentSampleSteps around the circle) in which the patch
+    # edgeTangentSampleDistance mm away looks most like the patch at the point
+    self.edgeTangents = False
+    self.edgeTangentSampleDistance = 3.
+    self.edgeTangentSampleSteps = 90
+    # control points and sampled curves for the current label, keyed by
+    # slice offset. They are those of the label's ContourModel (see bindModel),
+    # as are the curve states, surface and grid indexes below
+    self.label = None
+    self.model = None
+    self.store = None
+    # called with the engine that changed the model's control points, when
+    # it is not this one (adapters for a view refresh it)
+    self.modelCallback = None
+    self.bindModel(ContourModel())
+    # indices of the curve samples changed by the last update (None for all)
+    self.changedSamples = None
+    # multi-slice apply runs on a pool of this many threads (None for the default)
+    self.applyThreads = None
+    # applyAllLabels runs on this many processes (None for one per CPU),
+    # and leaves the labels drawn in another orientation in skippedLabels
+    self.applyProcesses = None
+    self.skippedLabels = []
+    self.cancelEvent = threading.Event()
+    # grid indexes over the control points and curve samples of each slice
+    # are in slice plane coordinates (mm), built on the first query of a slice
+    self.indexCellSize = 5.
+    # label map and control point edits, for undo and redo
+    self.journal = UndoJournal()
+    # adapters for a view set a ContourPrefetcher, and an AutosaveJournal
+    # that control point edits are written to
+    self.prefetcher = None
+    self.autosave = None
+    # slice geometry and volumes used when there is no view: the slice
+    # offset, the unit row, column and normal directions, the distance
+    # between slices, the background CachedVolume and the label array
+    # (indexed k,j,i) with its RAS to IJK matrix
+    self.sliceOffset = 0.
+    self.axes = numpy.eye(3)
+    self.spacing = 1.
+    self.background = None
+    self.labelArray = None
+    self.labelRASToIJK = numpy.eye(4)
+
+  def setLabel(self,label):
+    """
+    switch to editing the control points of label, loading them from the scene
+    """
+    if label == self.label:
+      return
+    if self.store is None:
+      self.store = self.controlPointStore()
+    self.label = label
+    self.bindModel(self.contourModel(label))
+
+  def contourModel(self,label):
+    """
+    the ContourModel of label, loaded from the store. Each engine has its
+    own; adapters override this to share one between the views of a scene.
+    """
+    return ContourModel(label, self.store.get(label))
+
+  def bindModel(self,model):
+    """
+    edit and show the control points, curves and surface of model
+    """
+    if self.model is not None:
+      self.model.unsubscribe(self.onModelChanged)
+    self.model = model
+    self.controlPoints = model.controlPoints
+    self.curves = model.curves
+    self.curveStates = model.curveStates
+    self.dirty = model.dirty
+    self.pointIndexes = model.pointIndexes
+    self.segmentIndexes = model.segmentIndexes
+    self.contourSurface = model.contourSurface
+    model.subscribe(self.onModelChanged)
+
+  def onModelChanged(self,source):
+    if self.prefetcher:
+      self.prefetcher.cancel()
+    if source is not self and self.modelCallback:
+      self.modelCallback()
+
+  def storeControlPoints(self):
+    """
+    save the control points of the current label into the scene
+    """
+    if self.store is not None and self.label is not None:
+      self.store.set(self.label, self.controlPoints)
+
+  def reloadControlPoints(self):
+    """
+    reread the control points of the current label from a new store,
+    after they were replaced behind the engine (e.g. by an import)
+    """
+    self.store = self.controlPointStore()
+    self.model.load(self.store.get(self.label))
+    self.model.changed(self)
+
+  def controlPointStore(self):
+    """
+    the ControlPointStore that setLabel and storeControlPoints use
+    (kept in memory unless an adapter gives it a node to persist to)
+    """
+    return ControlPointStore()
+
+  def defaultLabel(self):
+    """
+    the label value to apply when none is given
+    """
+    return self.label
+
+  def offset(self):
+    """
+    the current slice offset, rounded to avoid roundoff issues
+    caused by the slice controllers (offsets are used as keys)
+    """
+    return round(self.sliceOffset, 2)
+
+  def controlPointsChanged(self):
+    """
+    note a change of the control points: prefetched curves are out of date
+    and the other views of the model are told. The first control point
+    sets the orientation of the model's slices, and the last one clears it.
+    """
+    if not self.controlPoints:
+      self.model.sliceNormal = None
+    elif self.model.sliceNormal is None:
+      self.model.sliceNormal = self.sliceAxes()[2]
+    self.model.changed(self)
+
+  def autosaveEdit(self,edit,offset):
+    """
+    queue the control points of the slice at offset, after edit, for the autosave journal
+    """
+    if self.autosave is not None:
+      self.autosave.record(edit, self.label, offset, self.controlPoints.get(offset))
+
+  def editable(self):
+    """
+    True if the current slice is parallel to the slices of the current
+    label, so that its control points can be drawn and shown here
+    """
+    return self.model.parallel(self.sliceAxes()[2])
+
+  def contourKey(self,offset):
+    """
+    the cache key of the curve shown at offset (see ContourPrefetcher)
+    """
+    settings = (self.interpolation, self.splineSteps, self.tension, self.bias, self.continuity, self.snap, self.snapMode)
+    return (self.label, offset, self.model.version, settings)
+
+  def prefetch(self):
+    """
+    start computing the curves of the slices the view is likely to move
+    to next, if there is a prefetcher
+    """
+    if self.prefetcher and self.editable():
+      self.prefetcher.schedule(self.offset(), self.sliceSpacing())
+
+  def moveControlPoint(self,index,ras,offset=None,heavy=True):
+    """
+    move one control point and update the curve of its slice,
+    recomputing only the segments that depend on that point
+    """
+    if offset is None:
+      offset = self.offset()
+    before = self.controlPoints[offset].copy()
+    self.controlPoints[offset][index] = ras
+    self.journal.recordControlPoints(self.label, offset, before, self.controlPoints[offset])
+    self.controlPointsChanged()
+    self.autosaveEdit('move', offset)
+    if offset in self.pointIndexes:
+      self.pointIndexes[offset][1].move(index, self.planeCoordinates(ras)[0])
+    self.dirty.setdefault(offset, set()).add(index)
+    return self.updateCurve(offset, heavy)
+
+  def insertControlPoint(self,index,ras,offset=None):
+    """
+    insert a control point before index (at the end for the point count)
+    and recompute the curve of its slice
+    """
+    if offset is None:
+      offset = self.offset()
+    ras = numpy.array(ras, dtype='float64').reshape(1,3)
+    controlPoints = self.controlPoints.get(offset, numpy.zeros((0,3)))
+    self.controlPoints[offset] = numpy.insert(controlPoints, index, ras, axis=0)
+    self.journal.recordControlPoints(self.label, offset, controlPoints if len(controlPoints) else None, self.controlPoints[offset])
+    self.controlPointsChanged()
+    self.autosaveEdit('split' if index < len(controlPoints) else 'add', offset)
+    if offset in self.pointIndexes:
+      self.pointIndexes[offset][1].insert(index, self.planeCoordinates(ras)[0])
+    self.storeControlPoints()
+    return self.updateCurve(offset)
+
+  def deleteControlPoint(self,index,offset=None):
+    """
+    remove a control point (and the slice, with its last point)
+    and recompute the curve of its slice
+    """
+    if offset is None:
+      offset = self.offset()
+    controlPoints = numpy.delete(self.controlPoints[offset], index, axis=0)
+    self.journal.recordControlPoints(self.label, offset, self.controlPoints[offset], controlPoints if len(controlPoints) else None)
+    if len(controlPoints):
+      self.controlPoints[offset] = controlPoints
+      if offset in self.pointIndexes:
+        self.pointIndexes[offset][1].delete(index)
+    else:
+      del self.controlPoints[offset]
+      self.dropIndexes(offset)
+    self.controlPointsChanged()
+    self.autosaveEdit('delete', offset)
+    self.storeControlPoints()
+    return self.updateCurve(offset)
+
+  def dropIndexes(self,offset=None):
+    """
+    forget the grid indexes of one slice, or of all slices
+    """
+    if offset is None:
+      self.pointIndexes.clear()
+      self.segmentIndexes.clear()
+    else:
+      self.pointIndexes.pop(offset, None)
+      self.segmentIndexes.pop(offset, None)
+
+  def planeCoordinates(self,ras):
+    """
+    (N,2) coordinates in mm of the RAS points along the slice row and column directions
+    """
+    axes = self.sliceAxes()
+    return numpy.dot(numpy.asarray(ras, dtype='float64').reshape(-1,3), axes[:2].T)
+
+  def controlPointIndex(self,offset):
+    """
+    the GridIndex of the control points at offset, built if it is missing
+    or was built for another slice orientation
+    """
+    axesKey = tuple(numpy.round(self.sliceAxes(), 6).ravel())
+    entry = self.pointIndexes.get(offset)
+    if entry is None or entry[0] != axesKey:
+      points = self.planeCoordinates(self.controlPoints.get(offset, numpy.zeros((0,3))))
+      entry = (axesKey, GridIndex(self.indexCellSize, points))
+      self.pointIndexes[offset] = entry
+    return entry[1]
+
+  def nearestControlPoint(self,ras,radius,offset=None):
+    """
+    (index, distance in mm) of the control point at offset nearest
+    to ras within radius mm in the slice plane, or None
+    """
+    if offset is None:
+      offset = self.offset()
+    if offset not in self.controlPoints:
+      return None
+    return self.controlPointIndex(offset).nearest(self.planeCoordinates(ras)[0], radius)
+
+  def updateSegmentIndex(self,offset,curve,changed):
+    """
+    bring the curve sample index of offset (if there is one) up to date
+    with curve, moving only the segments around the changed samples
+    when there are few of them
+    """
+    entry = self.segmentIndexes.get(offset)
+    if entry is None:
+      return
+    axesKey, grid, plane, halfLength = entry
+    if changed is None or len(changed) > 32 or len(plane) != len(curve):
+      del self.segmentIndexes[offset]
+      return
+    plane = self.planeCoordinates(curve)
+    segments = numpy.unique(numpy.concatenate((changed - 1, changed)) % (len(plane) - 1))
+    midpoints = 0.5 * (plane[segments] + plane[segments + 1])
+    for segment, midpoint in zip(segments, midpoints):
+      grid.move(segment, midpoint)
+    lengths = numpy.sqrt(((plane[segments + 1] - plane[segments]) ** 2).sum(axis=1))
+    self.segmentIndexes[offset] = (axesKey, grid, plane, max(halfLength, 0.5 * lengths.max()))
+
+  def nearestCurveSegment(self,ras,radius,offset=None):
+    """
+    (segment, distance in mm) of the curve segment at offset nearest to ras
+    within radius mm in the slice plane, or None. Segment k joins curve
+    samples k and k+1, and lies between control points k // splineSteps
+    and the next one.
+    """
+    if offset is None:
+      offset = self.offset()
+    curve = self.curves.get(offset)
+    if curve is None or len(curve) < 2:
+      return None
+    axesKey = tuple(numpy.round(self.sliceAxes(), 6).ravel())
+    entry = self.segmentIndexes.get(offset)
+    if entry is None or entry[0] != axesKey:
+      # segments are indexed by their midpoints; queries reach out by
+      # half of the longest segment so no segment within radius is missed
+      plane = self.planeCoordinates(curve)
+      lengths = numpy.sqrt((numpy.diff(plane, axis=0) ** 2).sum(axis=1))
+      entry = (axesKey, GridIndex(self.indexCellSize, 0.5 * (plane[:-1] + plane[1:])), plane, 0.5 * lengths.max())
+      self.segmentIndexes[offset] = entry
+    axesKey, grid, plane, halfLength = entry
+    point = self.planeCoordinates(ras)[0]
+    segments = grid.candidates(point, radius + halfLength)
+    if not len(segments):
+      return None
+    start, end = plane[segments], plane[segments + 1]
+    direction = end - start
+    t = ((point - start) * direction).sum(axis=1) / numpy.maximum((direction * direction).sum(axis=1), 1e-12)
+    closest = start + numpy.clip(t, 0., 1.)[:,numpy.newaxis] * direction
+    distances = numpy.sqrt(((closest - point) ** 2).sum(axis=1))
+    best = distances.argmin()
+    if distances[best] > radius:
+      return None
+    return int(segments[best]), float(distances[best])
+
+  def updateCurve(self,offset=None,heavy=True):
+    """
+    recompute the sampled curve for the control points at offset.
+    If only moved control points are pending (see moveControlPoint) and the
+    curve settings are unchanged, just the spline segments and snapped
+    samples next to those points are recomputed. The indices of the changed
+    samples are left in changedSamples (None when everything changed).
+    Without heavy, snapping and edge tangent estimation are deferred: the
+    segments waiting to be snapped show their unsnapped samples, and moved
+    points use their chord direction as tangent, until the next heavy update.
+    """
+    if offset is None:
+      offset = self.offset()
+    controlPoints = self.controlPoints.get(offset, ())
+    count = len(controlPoints)
+    dirty = self.dirty.pop(offset, None)
+    useTangents = self.edgeTangents and self.interpolation != 'linear'
+    key = (self.interpolation, self.splineSteps, self.tension, self.bias, self.continuity, useTangents, count)
+    state = self.curveStates.get(offset)
+    if count < 2:
+      self.curveStates.pop(offset, None)
+      self.segmentIndexes.pop(offset, None)
+      self.curves[offset] = numpy.zeros((0,3))
+      self.changedSamples = None
+      return self.curves[offset]
+
+    steps = self.splineSteps
+    full = state is None or state.key != key or dirty is None
+    if full:
+      state = CurveState(key)
+      self.curveStates[offset] = state
+      dirty = set(range(count))
+
+    tangents = None
+    if useTangents:
+      if full:
+        state.tangents = self.chordDirections(controlPoints)
+      else:
+        moved = sorted(dirty)
+        state.tangents[moved] = self.chordDirections(controlPoints)[moved]
+      state.pendingTangents.update(dirty)
+      if heavy and state.pendingTangents:
+        estimate = sorted(state.pendingTangents)
+        state.tangents[estimate] = self.estimateEdgeTangents(controlPoints[estimate])
+        dirty = dirty.union(estimate)
+        state.pendingTangents = set()
+      tangents = state.tangents
+
+    if full:
+      state.segments = self.curveSegments(controlPoints, tangents)
+      changedSegments = None
+    else:
+      # a moved point changes the tangents of its neighbors, so the
+      # two segments on either side of it depend on it
+      changedSegments = set((index + shift) % count for index in dirty for shift in (-2,-1,0,1))
+      changedSegments = numpy.array(sorted(changedSegments), dtype='intp')
+      if len(changedSegments):
+        state.segments[changedSegments] = self.curveSegments(controlPoints, tangents, segments=changedSegments)
+      if state.pendingSnap is not None:
+        # snapping also depends on the curve normals and control point
+        # patches, which reach one segment further
+        state.pendingSnap.update((index + shift) % count for index in changedSegments for shift in (-1,0,1))
+    samples = state.segments.reshape(-1,3)
+    curve = numpy.vstack((samples, samples[:1]))
+
+    if self.snap:
+      if heavy and state.pendingSnap != set():
+        if state.snapConfidence is None or len(state.snapConfidence) != len(curve) - 1:
+          state.snapConfidence = numpy.zeros(len(curve) - 1)
+        if state.snapped is None or state.pendingSnap is None or self.snapMode == 'smooth':
+          # the smooth path is global, so any change resnaps all of it
+          state.snapped = self.snapCurve(curve, count, confidence=state.snapConfidence)
+          changedSegments = None
+        else:
+          snapSegments = numpy.array(sorted(state.pendingSnap), dtype='intp')
+          changed = (snapSegments[:,numpy.newaxis] * steps + numpy.arange(steps)).ravel()
+          state.snapped = self.snapCurve(curve, count, samples=changed, previous=state.snapped,
+                                         confidence=state.snapConfidence)
+          if changedSegments is not None:
+            changedSegments = numpy.union1d(changedSegments, snapSegments)
+        state.pendingSnap = set()
+      if state.snapped is not None:
+        snapped = state.snapped.copy()
+        if state.pendingSnap:
+          pending = numpy.array(sorted(state.pendingSnap), dtype='intp')
+          preview = (pending[:,numpy.newaxis] * steps + numpy.arange(steps)).ravel()
+          snapped[preview] = curve[preview]
+          snapped[-1] = snapped[0]
+          if changedSegments is not None:
+            # the preview replaces every pending segment, not just the moved ones
+            changedSegments = numpy.union1d(changedSegments, pending)
+        curve = snapped
+    else:
+      state.snapped = None
+      state.pendingSnap = None
+
+    if changedSegments is None:
+      self.changedSamples = None
+    else:
+      changed = (changedSegments[:,numpy.newaxis] * steps + numpy.arange(steps)).ravel()
+      if len(changedSegments) and changedSegments[0] == 0:
+        # the closing sample repeats the first
+        changed = numpy.append(changed, len(curve) - 1)
+      self.changedSamples = changed
+    self.updateSegmentIndex(offset, curve, self.changedSamples)
+    self.curves[offset] = curve
+    return curve
+
+  def completeCurve(self,offset=None):
+    """
+    finish the deferred work on the curve at offset without
+    recomputing anything that has not changed
+    """
+    if offset is None:
+      offset = self.offset()
+    self.dirty.setdefault(offset, set())
+    return self.updateCurve(offset)
+
+  def heavyUpdatePending(self,offset=None):
+    """
+    True if the curve at offset has deferred work (see updateCurve)
+    """
+    if offset is None:
+      offset = self.offset()
+    state = self.curveStates.get(offset)
+    if not state:
+      return False
+    return bool((self.snap and state.pendingSnap != set()) or state.pendingTangents)
+
+  def curveConfidence(self,offset=None):
+    """
+    confidence (0 to 1) of each snapped sample of the curve at offset,
+    or None if that curve is not snapped
+    """
+    if offset is None:
+      offset = self.offset()
+    state = self.curveStates.get(offset)
+    if not state or state.snapped is None:
+      return None
+    return state.snapConfidence
+
+  def currentCurve(self):
+    """
+    the curve to show on the current slice: the curve through its control
+    points, or through control points interpolated from the defined slices
+    (taken from the prefetcher's cache when it was computed ahead)
+    """
+    offset = self.offset()
+    if offset in self.controlPoints:
+      if offset not in self.curves:
+        self.updateCurve(offset)
+      return self.curves[offset]
+    key = self.contourKey(offset)
+    if self.prefetcher:
+      curve = self.prefetcher.get(key)
+      if curve is not None:
+        return curve
+    controlPoints = self.interpolatedControlPoints(offset)
+    if controlPoints is None:
+      return numpy.zeros((0,3))
+    curve = self.curve(controlPoints)
+    if self.snap and len(curve) > 3:
+      curve = self.snapCurve(curve, len(controlPoints))
+    if self.prefetcher:
+      self.prefetcher.put(key, curve)
+    return curve
+
+  def hermiteBasis(self,steps):
+    """
+    (steps,4) matrix of the h00, h10, h01, h11 Hermite functions
+    sampled at t = 0, 1/steps, ... (steps-1)/steps
+    """
+    if steps not in self.hermiteBases:
+      t = numpy.arange(steps, dtype='float64') / steps
+      t2 = t * t
+      t3 = t2 * t
+      basis = numpy.empty((steps,4))
+      basis[:,0] = 2. * t3 - 3. * t2 + 1.
+      basis[:,1] = t3 - 2. * t2 + t
+      basis[:,2] = -2. * t3 + 3. * t2
+      basis[:,3] = t3 - t2
+      basis.setflags(write=False)
+      self.hermiteBases[steps] = basis
+    return self.hermiteBases[steps]
+
+  def segmentTangents(self,controlPoints,tangents=None):
+    """
+    start and end tangents of each closed-curve segment i -> i+1.
+    Without tangents these are the Kochanek-Bartels (TBC) tangents,
+    otherwise the given unit tangents are oriented along the curve
+    and scaled by the local chord length as in the Slicer3 effect.
+    """
+    p = controlPoints
+    inVector = p - numpy.roll(p, 1, axis=0)
+    outVector = numpy.roll(p, -1, axis=0) - p
+    if tangents is None:
+      t, b, c = self.tension, self.bias, self.continuity
+      source = (((1-t)*(1+b)*(1+c)/2.) * inVector
+                + ((1-t)*(1-b)*(1-c)/2.) * outVector)
+      destination = (((1-t)*(1+b)*(1-c)/2.) * inVector
+                     + ((1-t)*(1-b)*(1+c)/2.) * outVector)
+    else:
+      v = 0.5 * (inVector + outVector)
+      tangents = numpy.asarray(tangents, dtype='float64')
+      sign = numpy.where((v * tangents).sum(axis=1) < 0, -1., 1.)
+      scale = 1.5 * numpy.sqrt((v * v).sum(axis=1))
+      source = destination = tangents * (sign * scale)[:,numpy.newaxis]
+    return source, numpy.roll(destination, -1, axis=0)
+
+  def chordDirections(self,controlPoints):
+    """
+    unit direction from the previous to the next control point at each point
+    """
+    points = numpy.asarray(controlPoints, dtype='float64')
+    chords = numpy.roll(points, -1, axis=0) - numpy.roll(points, 1, axis=0)
+    return chords / numpy.maximum(numpy.sqrt((chords * chords).sum(axis=1)), 1e-12)[:,numpy.newaxis]
+
+  @profiler.timed('tangents')
+  def estimateEdgeTangents(self,controlPoints,axes=None,entry=None):
+    """
+    unit in-plane edge direction at each control point: the direction in
+    which the patch edgeTangentSampleDistance away best matches the patch at
+    the point. Patches at every angle share the slice orientation and only
+    move by the same in-plane shifts around each point, so one window per
+    point covering all of them is sampled in a single trilinear pass, and
+    the whole bank of shifted patches is read out of the windows with one
+    bilinear gather whose indices and weights are the same for every point.
+    The best angle is refined with a parabola through the weights of its
+    neighboring angles.
+    Tangents are cached on the background volume's cache entry per slice
+    orientation and control point voxel, so they are dropped with it when
+    the volume changes.
+    """
+    if axes is None:
+      axes = self.sliceAxes()
+    if entry is None:
+      entry = self.backgroundEntry()
+    tangent, normal, sliceNormal = axes
+    points = numpy.asarray(controlPoints, dtype='float64').reshape(-1,3)
+    voxels = numpy.round(numpy.dot(points, entry.rasToIJK[:3,:3].T) + entry.rasToIJK[:3,3]).astype(int)
+    settings = (tuple(numpy.round(axes, 3).ravel()), self.edgeTangentSampleDistance,
+                self.edgeTangentSampleSteps, tuple(self.patchSize))
+    keys = [(settings, tuple(voxel)) for voxel in voxels]
+    missing = [index for index, key in enumerate(keys) if key not in entry.tangents]
+
+    if missing:
+      steps = self.edgeTangentSampleSteps
+      angleStep = 2. * numpy.pi / steps
+      angles = numpy.arange(steps) * angleStep
+      directions = numpy.outer(numpy.cos(angles), tangent) - numpy.outer(numpy.sin(angles), normal)
+      # windows with a margin of the sample distance around each patch
+      width, height = self.patchSize
+      distance = self.edgeTangentSampleDistance
+      margin = int(numpy.ceil(distance)) + 1
+      windows = self.extractPatches(entry.volume, entry.rasToIJK, points[missing], normal, tangent,
+                                    rows=numpy.arange(-margin, height + margin),
+                                    columns=numpy.arange(-margin, width + margin))
+      centerPatches = windows[:,margin:margin+height,margin:margin+width]
+
+      # (angle,row,column,corner) bilinear indices into the flattened window
+      shifts = numpy.column_stack((-numpy.sin(angles), numpy.cos(angles))) * distance + margin
+      lower = numpy.floor(shifts)
+      fraction = (shifts - lower).astype('float32')
+      row = lower[:,0,numpy.newaxis,numpy.newaxis] + numpy.arange(height)[:,numpy.newaxis]
+      column = lower[:,1,numpy.newaxis,numpy.newaxis] + numpy.arange(width)
+      windowWidth = width + 2 * margin
+      corner = (row * windowWidth + column).astype('intp')[...,numpy.newaxis] + (0, 1, windowWidth, windowWidth + 1)
+      fr, fc = fraction[:,0], fraction[:,1]
+      blend = numpy.column_stack(((1 - fr) * (1 - fc), (1 - fr) * fc, fr * (1 - fc), fr * fc))
+      samplePatches = numpy.einsum('nashk,ak->nash', windows.reshape(len(missing),-1)[:,corner], blend)
+      weights = numpy.abs(samplePatches - centerPatches[:,numpy.newaxis]).mean(axis=(2,3))
+
+      rows = numpy.arange(len(missing))
+      best = weights.argmin(axis=1)
+      before = weights[rows, (best - 1) % steps]
+      at = weights[rows, best]
+      after = weights[rows, (best + 1) % steps]
+      curvature = before - 2. * at + after
+      shift = numpy.where(curvature > 0, 0.5 * (before - after) / numpy.where(curvature > 0, curvature, 1.), 0.)
+      angle = (best + numpy.clip(shift, -0.5, 0.5)) * angleStep
+      estimates = numpy.outer(numpy.cos(angle), tangent) - numpy.outer(numpy.sin(angle), normal)
+      for index, estimate in zip(missing, estimates):
+        entry.tangents[keys[index]] = estimate
+
+    return numpy.array([entry.tangents[key] for key in keys]).reshape(-1,3)
+
+  @profiler.timed('spline')
+  def curveSegments(self,controlPoints,tangents=None,segments=None):
+    """
+    (N,splineSteps,3) samples of the closed curve through the
+    N control points, one row of samples per segment (or only the
+    rows of the given segment indices).
+    All segments are evaluated in one batch against the cached basis.
+    """
+    points = numpy.asarray(controlPoints, dtype='float64')
+    if segments is None:
+      segments = numpy.arange(len(points))
+    p0 = points[segments]
+    p1 = points[(segments + 1) % len(points)]
+    steps = self.splineSteps
+    if self.interpolation == 'linear':
+      t = numpy.arange(steps, dtype='float64') / steps
+      return p0[:,numpy.newaxis] + t[numpy.newaxis,:,numpy.newaxis] * (p1 - p0)[:,numpy.newaxis]
+    m0, m1 = self.segmentTangents(points, tangents)
+    geometry = numpy.array((p0, m0[segments], p1, m1[segments]))
+    return numpy.einsum('sk,knd->nsd', self.hermiteBasis(steps), geometry)
+
+  def curve(self,controlPoints,tangents=None):
+    """
+    sample the closed curve through the control points.
+    Returns an (N*splineSteps+1,3) array whose last point repeats the first,
+    or an empty (0,3) array when there are fewer than two control points.
+    Linear curves are sampled at the same density as splines so that
+    snapping and rasterization treat every mode alike.
+    """
+    controlPoints = numpy.asarray(controlPoints, dtype='float64').reshape(-1,3)
+    if len(controlPoints) < 2:
+      return numpy.zeros((0,3))
+    samples = self.curveSegments(controlPoints, tangents).reshape(-1,3)
+    return numpy.vstack((samples, samples[:1]))
+
+  def surface(self):
+    """
+    (points, triangles, normals) arrays of the closed surface through the
+    curves of the current label's defined slices. Only the parts of the
+    surface next to curves that changed since the last call are rebuilt.
+    """
+    curves = {}
+    for offset in self.controlPoints:
+      if len(self.controlPoints[offset]) > 1:
+        curves[offset] = self.curves[offset] if offset in self.curves else self.updateCurve(offset)
+    sliceNormal = self.model.sliceNormal
+    return self.contourSurface.update(curves, self.sliceAxes()[2] if sliceNormal is None else sliceNormal)
+
+  def crossSection(self):
+    """
+    (S,2,3) RAS end points of the line segments where the surface of the
+    current label crosses the current slice, for slices that are not
+    parallel to the label's. Curves not computed yet by a parallel view
+    are taken unsnapped rather than computed in this view's geometry.
+    """
+    sliceNormal = self.model.sliceNormal
+    if sliceNormal is None:
+      return numpy.zeros((0,2,3))
+    curves = {}
+    for offset, controlPoints in self.controlPoints.items():
+      if len(controlPoints) > 1:
+        curve = self.curves.get(offset)
+        curves[offset] = curve if curve is not None else self.curve(controlPoints)
+    points, triangles, normals = self.contourSurface.update(curves, sliceNormal)
+    return self.model.planeSegments(points, triangles, self.sliceAxes()[2], self.offset())
+
+  def controlPointStack(self,controlPoints=None):
+    """
+    the sorted defined offsets and their control points (by default those
+    of the current label) stacked into a (slices,points,3) array, or None
+    if the slices have different point counts
+    """
+    if controlPoints is None:
+      controlPoints = self.controlPoints
+    offsets = sorted(controlPoints.keys())
+    if not offsets:
+      return None
+    counts = set(len(controlPoints[offset]) for offset in offsets)
+    if len(counts) != 1:
+      return None
+    return numpy.array(offsets), numpy.array([controlPoints[offset] for offset in offsets])
+
+  @profiler.timed('interpolate')
+  def interpolateStack(self,stack,stackOffsets,targetOffsets,sliceNormal,iterations=8):
+    """
+    intersect the spline through each control point index across the
+    (slices,points,3) stack with the slice planes at the target offsets.
+    Each point's inter-slice path is a Catmull-Rom spline over the slice index,
+    so its distance to a plane is a cubic on each segment; the segment containing
+    the crossing is found by search and the cubic root is polished with
+    safeguarded Newton steps, for all targets and points at once.
+    Returns a (targets,points,3) array, NaN for targets outside the stack.
+    """
+    stack = numpy.asarray(stack, dtype='float64')
+    stackOffsets = numpy.asarray(stackOffsets, dtype='float64')
+    targets = numpy.atleast_1d(numpy.asarray(targetOffsets, dtype='float64'))
+    sliceNormal = numpy.asarray(sliceNormal, dtype='float64')
+    sliceCount, pointCount = stack.shape[:2]
+    result = numpy.empty((len(targets), pointCount, 3))
+    result.fill(numpy.nan)
+    if sliceCount < 2:
+      return result
+
+    # tangents of the open splines: central differences, one sided at the ends
+    tangents = numpy.empty_like(stack)
+    tangents[1:-1] = 0.5 * (stack[2:] - stack[:-2])
+    tangents[0] = stack[1] - stack[0]
+    tangents[-1] = stack[-1] - stack[-2]
+    heights = numpy.dot(stack, sliceNormal)
+    slopes = numpy.dot(tangents, sliceNormal)
+
+    inside = (targets >= stackOffsets[0]) & (targets <= stackOffsets[-1])
+    targets = targets[inside]
+    target = targets[:,numpy.newaxis]
+
+    # segment of each point's spline that crosses each target plane
+    segment = (heights[numpy.newaxis] <= target[:,numpy.newaxis]).sum(axis=1) - 1
+    segment = numpy.clip(segment, 0, sliceCount - 2)
+    columns = numpy.arange(pointCount)[numpy.newaxis,:]
+    h0, h1 = heights[segment, columns], heights[segment + 1, columns]
+    m0, m1 = slopes[segment, columns], slopes[segment + 1, columns]
+
+    # plane distance on the segment: c3 t^3 + c2 t^2 + c1 t + c0
+    c3 = 2. * h0 + m0 - 2. * h1 + m1
+    c2 = -3. * h0 - 2. * m0 + 3. * h1 - m1
+    c1 = m0
+    c0 = h0 - target
+    rising = h1 >= h0
+    span = numpy.where(h1 != h0, h1 - h0, 1.)
+    t = numpy.clip((target - h0) / span, 0., 1.)
+    low = numpy.zeros_like(t)
+    high = numpy.ones_like(t)
+    for iteration in range(iterations):
+      value = ((c3 * t + c2) * t + c1) * t + c0
+      below = (value < 0) == rising
+      low = numpy.where(below, t, low)
+      high = numpy.where(below, high, t)
+      derivative = (3. * c3 * t + 2. * c2) * t + c1
+      step = t - value / numpy.where(derivative != 0, derivative, numpy.inf)
+      bracketed = (step >= low) & (step <= high) & (derivative != 0)
+      t = numpy.where(bracketed, step, 0.5 * (low + high))
+
+    basis = numpy.array((2.*t**3 - 3.*t**2 + 1., t**3 - 2.*t**2 + t, -2.*t**3 + 3.*t**2, t**3 - t**2))
+    geometry = numpy.array((stack[segment, columns], tangents[segment, columns],
+                            stack[segment + 1, columns], tangents[segment + 1, columns]))
+    result[inside] = (basis[...,numpy.newaxis] * geometry).sum(axis=0)
+    return result
+
+  def interpolatedControlPoints(self,offset):
+    """
+    control points for an offset between defined slices, on the splines
+    through the defined control points. Returns None outside the defined
+    range or if the point counts differ.
+    """
+    stack = self.controlPointStack()
+    if stack is None or len(stack[0]) < 2:
+      return None
+    points = self.interpolateStack(stack[1], stack[0], offset, self.sliceAxes()[2])[0]
+    if numpy.isnan(points).any():
+      return None
+    return points
+
+  def copyCurve(self,offset=None):
+    """
+    define control points on the slice at offset by interpolating the
+    defined slices, or by shifting the nearest defined slice along the
+    slice normal when interpolation is not possible.
+    Returns the new control points, or None if there is nothing to copy.
+    """
+    if offset is None:
+      offset = self.offset()
+    offsets = sorted(self.controlPoints.keys())
+    others = [other for other in offsets if other != offset]
+    if not others:
+      return None
+    controlPoints = None
+    if len(offsets) > 1 and offsets[0] <= offset <= offsets[-1]:
+      controlPoints = self.interpolatedControlPoints(offset)
+    if controlPoints is None:
+      nearest = min(others, key=lambda other: abs(offset - other))
+      controlPoints = self.controlPoints[nearest] + (offset - nearest) * self.sliceAxes()[2]
+    self.journal.recordControlPoints(self.label, offset, self.controlPoints.get(offset), controlPoints)
+    self.controlPoints[offset] = controlPoints
+    self.dropIndexes(offset)
+    self.controlPointsChanged()
+    self.autosaveEdit('copy', offset)
+    self.storeControlPoints()
+    self.updateCurve(offset)
+    return controlPoints
+
+  def sliceSpacing(self):
+    """
+    distance between slices
+    """
+    return self.spacing
+
+  def applyCurves(self,label=None,erase=True,progress=None):
+    """
+    fill the defined or interpolated curve of every slice between the first
+    and last slices with control points into the label map.
+    Slices are computed and rasterized concurrently on a thread pool; each
+    task writes a different slice of the label array, and NumPy releases the
+    GIL for the heavy array work. The view's slice offset is not changed.
+    progress(done,total) is called on the calling thread as slices finish,
+    and cancelApply() stops the run after the slices already in flight.
+    Returns the number of slices filled.
+    """
+    import concurrent.futures
+
+    offsets = sorted(self.controlPoints.keys())
+    if len(offsets) < 2:
+      # can't interpolate 0 or 1 curve
+      return 0
+    if label is None:
+      label = self.defaultLabel()
+    labelNode, labelArray, rasToIJK = self.labelVolume()
+    spacing = self.sliceSpacing()
+    sliceCount = int(round((offsets[-1] - offsets[0]) / spacing)) + 1
+    targets = [round(offsets[0] + index * spacing, 2) for index in range(sliceCount)]
+    sliceNormal = self.sliceAxes()[2]
+    snapArguments = None
+    if self.snap or self.edgeTangents:
+      entry = self.backgroundEntry()
+      axes = self.sliceAxes()
+    if self.snap:
+      level = entry.downsampled(self.snapCoarseFactor)
+      snapArguments = (sliceNormal, entry.volume, entry.rasToIJK, None, None, (level.volume, level.rasToIJK))
+
+    # interpolate the control points of every slice in one call
+    interpolated = {}
+    stack = self.controlPointStack()
+    if stack is not None:
+      points = self.interpolateStack(stack[1], stack[0], targets, sliceNormal)
+      interpolated = dict(zip(targets, points))
+
+    self.cancelEvent.clear()
+    def applyOffset(offset):
+      if self.cancelEvent.is_set():
+        return False
+      controlPoints = self.controlPoints.get(offset)
+      tangents = None
+      if controlPoints is None:
+        controlPoints = interpolated.get(offset)
+      elif self.edgeTangents and len(controlPoints) > 1:
+        tangents = self.estimateEdgeTangents(controlPoints, axes, entry)
+      if controlPoints is None or numpy.isnan(controlPoints).any():
+        return False
+      curve = self.curve(controlPoints, tangents)
+      if snapArguments and len(curve) > 3:
+        curve = self.snapCurve(curve, len(controlPoints), *snapArguments)
+      return self.applyCurve(curve, label, erase, None, labelArray, rasToIJK)
+
+    filled = 0
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.applyThreads)
+    self.journal.begin('apply curves')
+    try:
+      futures = [executor.submit(applyOffset, offset) for offset in targets]
+      for done, future in enumerate(concurrent.futures.as_completed(futures)):
+        if future.result():
+          filled += 1
+        if progress:
+          progress(done + 1, len(futures))
+        if self.cancelEvent.is_set():
+          for pending in futures:
+            pending.cancel()
+          break
+    finally:
+      executor.shutdown(wait=True)
+      self.journal.end()
+    if filled and labelNode:
+      labelNode.GetImageData().Modified()
+      labelNode.Modified()
+    return filled
+
+  def cancelApply(self):
+    """
+    stop a running applyCurves or applyAllLabels
+    """
+    self.cancelEvent.set()
+
+  def applyAllLabels(self,priority=(),erase=True,progress=None):
+    """
+    fill the defined or interpolated curves of every stored label, on all
+    the slices between each label's first and last defined slices, into
+    the label map as one job. The label array is copied into shared memory
+    and the slices are dealt out to a pool of applyProcesses worker
+    processes started with workerExecutable (or applyThreads threads when
+    there is none), each slice (with all of its labels) to exactly one
+    task, so no two workers write the same voxels. On each slice the labels are
+    filled from lowest to highest priority: the labels listed in priority
+    (highest first) win over the others, which rank by increasing value.
+    The changed slices are then copied back and recorded in the journal as
+    one entry. progress(done,total) is called as tasks finish, and
+    cancelApply() drops the tasks not yet started. Labels whose slices are
+    not parallel to the current slice (see ContourModel) would interpolate
+    along the wrong normal, so they are left out and listed in skippedLabels.
+    Returns the number of slices filled per label.
+    """
+    import concurrent.futures
+    import multiprocessing
+    from multiprocessing import shared_memory
+
+    self.storeControlPoints()
+    store = self.store if self.store is not None else self.controlPointStore()
+    labelPoints = {}
+    for label in store.labels():
+      controlPoints = store.get(label)
+      if controlPoints:
+        labelPoints[int(label)] = controlPoints
+    if self.label is not None and self.controlPoints:
+      labelPoints[int(self.label)] = self.controlPoints
+    sliceNormal = self.sliceAxes()[2]
+    self.skippedLabels = []
+    for label in sorted(labelPoints):
+      current = self.label is not None and label == int(self.label)
+      model = self.model if current else self.contourModel(label)
+      if not model.parallel(sliceNormal):
+        self.skippedLabels.append(label)
+        del labelPoints[label]
+    priority = [int(label) for label in priority]
+    rank = lambda label: (1, len(priority) - priority.index(label)) if label in priority else (0, label)
+    order = sorted(labelPoints, key=rank)
+
+    # the control points of every (slice, label), lowest priority first,
+    # keyed by the label map slice they fill: labels whose first offsets
+    # differ in rounding still share one task per voxel slice
+    labelNode, labelArray, rasToIJK = self.labelVolume()
+    sliceAxis = numpy.abs(numpy.dot(rasToIJK[:3,:3], sliceNormal)).argmax()
+    sliceIndex = lambda offset: int(round(numpy.dot(rasToIJK[sliceAxis,:3], offset * sliceNormal) + rasToIJK[sliceAxis,3]))
+    spacing = self.sliceSpacing()
+    slices = collections.defaultdict(list)
+    for label in order:
+      controlPoints = labelPoints[label]
+      offsets = sorted(controlPoints.keys())
+      sliceCount = int(round((offsets[-1] - offsets[0]) / spacing)) + 1
+      targets = [round(offsets[0] + index * spacing, 2) for index in range(sliceCount)]
+      interpolated = {}
+      stack = self.controlPointStack(controlPoints)
+      if stack is not None and len(offsets) > 1:
+        interpolated = dict(zip(targets, self.interpolateStack(stack[1], stack[0], targets, sliceNormal)))
+      for target in targets:
+        points = controlPoints.get(target)
+        defined = points is not None
+        if not defined:
+          points = interpolated.get(target)
+        if points is not None and not numpy.isnan(points).any():
+          slices[sliceIndex(target)].append((label, points, defined))
+    if not slices:
+      return {}
+
+    memories = []
+    try:
+      memory = shared_memory.SharedMemory(create=True, size=max(labelArray.nbytes, 1))
+      memories.append(memory)
+      sharedLabels = numpy.ndarray(labelArray.shape, labelArray.dtype, buffer=memory.buf)
+      sharedLabels[:] = labelArray
+      job = {
+        'labels': (memory.name, labelArray.shape, labelArray.dtype.str, rasToIJK),
+        'background': None,
+        'axes': self.sliceAxes(),
+        'options': dict((name, getattr(self, name)) for name in self.optionNames),
+        'erase': erase,
+      }
+      if self.snap or self.edgeTangents:
+        entry = self.backgroundEntry()
+        memory = shared_memory.SharedMemory(create=True, size=max(entry.volume.nbytes, 1))
+        memories.append(memory)
+        numpy.ndarray(entry.volume.shape, entry.volume.dtype, buffer=memory.buf)[:] = entry.volume
+        job['background'] = (memory.name, entry.volume.shape, entry.volume.dtype.str, entry.rasToIJK, entry.spacing)
+
+      # a few interleaved tasks per process balance the load and give progress
+      executable = self.workerExecutable()
+      if executable is False:
+        processes = self.applyThreads or os.cpu_count() or 1
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=processes)
+      else:
+        processes = self.applyProcesses or os.cpu_count() or 1
+        context = None
+        if executable:
+          context = multiprocessing.get_context('spawn')
+          context.set_executable(executable)
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=processes, mp_context=context)
+      items = sorted(slices.items())
+      taskCount = min(len(items), 4 * processes)
+      tasks = [items[index::taskCount] for index in range(taskCount)]
+      filled = collections.Counter()
+      self.cancelEvent.clear()
+      try:
+        futures = [executor.submit(applyLabelSlices, job, task) for task in tasks]
+        for done, future in enumerate(concurrent.futures.as_completed(futures)):
+          filled.update(future.result())
+          if progress:
+            progress(done + 1, len(futures))
+          if self.cancelEvent.is_set():
+            for pending in futures:
+              pending.cancel()
+            break
+      finally:
+        executor.shutdown(wait=True)
+        if executable is False:
+          releaseWorkerJob()
+
+      self.journal.begin('apply all labels')
+      try:
+        changed = self.copyLabelSlices(sharedLabels, labelArray, sliceNormal, rasToIJK)
+      finally:
+        self.journal.end()
+      del sharedLabels
+    finally:
+      for memory in memories:
+        memory.close()
+        memory.unlink()
+    if changed and labelNode:
+      labelNode.GetImageData().Modified()
+      labelNode.Modified()
+    return dict(filled)
+
+  def workerExecutable(self):
+    """
+    the Python interpreter that applyAllLabels starts its worker processes
+    with: None for the multiprocessing default (this process's own), or
+    False to run the tasks on threads of this process instead
+    """
+    return None
+
+  def copyLabelSlices(self,source,labelArray,sliceNormal,rasToIJK):
+    """
+    copy the slices (normal to sliceNormal) that differ from source into
+    labelArray, recording the changed voxels in the journal.
+    Returns the number of slices changed.
+    """
+    sliceAxis = numpy.abs(numpy.dot(rasToIJK[:3,:3], sliceNormal)).argmax()
+    changed = 0
+    index = [slice(None)] * 3
+    for sliceIndex in range(labelArray.shape[2 - sliceAxis]):
+      index[2 - sliceAxis] = sliceIndex
+      before, after = labelArray[tuple(index)], source[tuple(index)]
+      rows, columns = numpy.nonzero(before != after)
+      if not len(rows):
+        continue
+      box = (slice(rows.min(), rows.max() + 1), slice(columns.min(), columns.max() + 1))
+      self.journal.recordSlice(sliceAxis, sliceIndex, (box[0].start, box[1].start), before[box].copy(), after[box])
+      before[box] = after[box]
+      changed += 1
+    return changed
+
+  def labelVolume(self):
+    """
+    the label volume node (None without a view), a writable label
+    array (indexed k,j,i) and its RAS to IJK matrix
+    """
+    return None, self.labelArray, self.labelRASToIJK
+
+  def rasterizePolygon(self,polygon,shape):
+    """
+    even-odd scanline fill of the closed (P,2) column,row polygon, clipped
+    to a slice of the given shape. Pixel centers are at integer coordinates.
+    Returns the (row,column) origin of the polygon's bounding box and the
+    boolean mask of filled pixels within it (None if nothing is covered).
+    """
+    polygon = numpy.asarray(polygon, dtype='float64')
+    low = numpy.maximum(numpy.ceil(polygon.min(axis=0)), 0).astype(int)
+    high = numpy.minimum(numpy.floor(polygon.max(axis=0)), numpy.array(shape[::-1]) - 1).astype(int)
+    if (high < low).any():
+      return None
+    columns, rows = high - low + 1
+
+    # crossings of each scanline with each edge
+    x0, y0 = polygon[:,0], polygon[:,1]
+    x1, y1 = numpy.roll(x0, -1), numpy.roll(y0, -1)
+    scanlines = numpy.arange(low[1], high[1] + 1, dtype='float64')[:,numpy.newaxis]
+    crosses = (y0 <= scanlines) != (y1 <= scanlines)
+    row, edge = numpy.nonzero(crosses)
+    x = x0[edge] + (scanlines[row,0] - y0[edge]) * (x1[edge] - x0[edge]) / (y1[edge] - y0[edge])
+
+    # toggle the fill state at the first pixel center right of each crossing
+    column = numpy.clip(numpy.ceil(x).astype(int) - low[0], 0, columns)
+    toggles = numpy.zeros((rows, columns + 1), dtype='int32')
+    numpy.add.at(toggles, (row, column), 1)
+    mask = (numpy.cumsum(toggles[:,:columns], axis=1) & 1).astype(bool)
+    return (low[1], low[0]), mask
+
+  @profiler.timed('rasterize')
+  def applyCurve(self,curve=None,label=None,erase=True,labelNode=None,labelArray=None,rasToIJK=None):
+    """
+    fill the closed RAS curve into the label map slice it lies on.
+    With erase, label is first cleared from that slice, otherwise the
+    curve is drawn over the existing labels. Only the curve's bounding box
+    is scanned and the label array is written in place, so the node is
+    marked modified once; the changed voxels are recorded in the journal.
+    The curve must lie in an IJK plane of the label volume.
+    Returns True if the label map was changed.
+    """
+    if curve is None:
+      curve = self.curves.get(self.offset(), ())
+    if len(curve) < 4:
+      return False
+    if label is None:
+      label = self.defaultLabel()
+    if labelArray is None:
+      labelNode, labelArray, rasToIJK = self.labelVolume()
+
+    ijk = numpy.dot(curve[:-1], rasToIJK[:3,:3].T) + rasToIJK[:3,3]
+    extent = ijk.max(axis=0) - ijk.min(axis=0)
+    sliceAxis = extent.argmin()
+    if extent[sliceAxis] > 0.5:
+      # curve is oblique to the label volume
+      return False
+    sliceIndex = int(round(ijk[:,sliceAxis].mean()))
+    if not 0 <= sliceIndex < labelArray.shape[2 - sliceAxis]:
+      return False
+
+    # the array is indexed k,j,i so the in-plane row and column axes are
+    # the remaining ijk axes in descending order
+    index = [slice(None)] * 3
+    index[2 - sliceAxis] = sliceIndex
+    plane = labelArray[tuple(index)]
+    rowAxis, columnAxis = [axis for axis in (2,1,0) if axis != sliceAxis]
+
+    # bounding box (first and last row and column) of the pixels to write
+    boxes = []
+    previous = None
+    if erase:
+      previous = plane == label
+      rows, columns = numpy.nonzero(previous.any(axis=1))[0], numpy.nonzero(previous.any(axis=0))[0]
+      if len(rows):
+        boxes.append((rows[0], columns[0], rows[-1], columns[-1]))
+    fill = self.rasterizePolygon(ijk[:,(columnAxis,rowAxis)], plane.shape)
+    if fill:
+      (row, column), mask = fill
+      boxes.append((row, column, row + mask.shape[0] - 1, column + mask.shape[1] - 1))
+    if not boxes:
+      return False
+    boxes = numpy.array(boxes)
+    top, left = boxes[:,:2].min(axis=0)
+    bottom, right = boxes[:,2:].max(axis=0) + 1
+    before = plane[top:bottom, left:right].copy()
+
+    if previous is not None:
+      plane[previous] = 0
+    if fill:
+      region = plane[row:row+mask.shape[0], column:column+mask.shape[1]]
+      region[mask] = label
+    after = plane[top:bottom, left:right]
+    rows, columns = numpy.nonzero(before != after)
+    changed = len(rows) > 0
+    if changed:
+      # record only the box around the voxels that actually changed
+      box = (slice(rows.min(), rows.max() + 1), slice(columns.min(), columns.max() + 1))
+      origin = (top + box[0].start, left + box[1].start)
+      self.journal.recordSlice(sliceAxis, sliceIndex, origin, before[box], after[box])
+    if changed and labelNode:
+      labelNode.GetImageData().Modified()
+      labelNode.Modified()
+    return changed
+
+  def undo(self):
+    """
+    revert the latest journal entry; returns it (None if there was nothing to undo)
+    """
+    entry = self.journal.undo()
+    if entry:
+      self.replay(entry, undo=True)
+    return entry
+
+  def redo(self):
+    """
+    reapply the latest undone journal entry; returns it (None if there was nothing to redo)
+    """
+    entry = self.journal.redo()
+    if entry:
+      self.replay(entry, undo=False)
+    return entry
+
+  def replay(self,entry,undo):
+    """
+    toggle the label deltas of entry in place and restore the control
+    points from before (undo) or after the edit
+    """
+    if entry.deltas:
+      labelNode, labelArray, rasToIJK = self.labelVolume()
+      for delta in entry.deltas:
+        delta.apply(labelArray)
+      if labelNode:
+        labelNode.GetImageData().Modified()
+        labelNode.Modified()
+    for (label, offset), (before, after) in entry.controlPoints.items():
+      if label != self.label:
+        self.setLabel(label)
+      controlPoints = before if undo else after
+      if controlPoints is None:
+        self.controlPoints.pop(offset, None)
+      else:
+        self.controlPoints[offset] = controlPoints.copy()
+      self.curveStates.pop(offset, None)
+      self.dirty.pop(offset, None)
+      self.dropIndexes(offset)
+      self.updateCurve(offset)
+      self.autosaveEdit('undo' if undo else 'redo', offset)
+    if entry.controlPoints:
+      self.controlPointsChanged()
+      self.storeControlPoints()
+
+  def sliceAxes(self):
+    """
+    unit row, column and normal directions of the slice plane in RAS
+    """
+    return self.axes
+
+  def backgroundEntry(self):
+    """
+    the CachedVolume of the background volume
+    """
+    return self.background
+
+  def backgroundVolume(self):
+    """
+    float copy of the background volume (indexed k,j,i) and its RAS to IJK matrix,
+    shared through the module-level backgroundVolumeCache
+    """
+    entry = self.backgroundEntry()
+    return entry.volume, entry.rasToIJK
+
+  def sampleVolume(self,volume,ijk):
+    """
+    trilinear interpolation of volume (indexed k,j,i) at the (...,3) ijk
+    positions in one batch. The eight corners of every position are read
+    with a single gather from the flattened volume and blended in float32.
+    Samples outside the volume read as zero, like the background of
+    vtkImageReslice.
+    """
+    ijk = numpy.asarray(ijk, dtype='float32')
+    shape = ijk.shape[:-1]
+    ijk = ijk.reshape(-1,3)
+    lower = numpy.floor(ijk)
+    fraction = ijk - lower
+    # (n,3,2) lower and upper index and weight along each axis; a corner
+    # outside the volume gets no weight along the axis where it falls out
+    size = numpy.array(volume.shape[::-1])
+    index = lower.astype('intp')[:,:,numpy.newaxis] + (0,1)
+    weight = numpy.stack((1. - fraction, fraction), axis=-1)
+    weight[(index < 0) | (index >= size[:,numpy.newaxis])] = 0.
+    index = numpy.clip(index, 0, (size - 1)[:,numpy.newaxis])
+    i, j, k = index[:,0], index[:,1] * size[0], index[:,2] * (size[0] * size[1])
+    flat = (k[:,:,numpy.newaxis,numpy.newaxis] + j[:,numpy.newaxis,:,numpy.newaxis]
+            + i[:,numpy.newaxis,numpy.newaxis,:]).reshape(-1,8)
+    wi, wj, wk = weight[:,0], weight[:,1], weight[:,2]
+    weight = (wk[:,:,numpy.newaxis,numpy.newaxis] * wj[:,numpy.newaxis,:,numpy.newaxis]
+              * wi[:,numpy.newaxis,numpy.newaxis,:]).reshape(-1,8)
+    values = numpy.ravel(volume).take(flat).astype('float32', copy=False)
+    return numpy.einsum('ij,ij->i', values, weight).reshape(shape)
+
+  def extractPatches(self,volume,rasToIJK,points,normals,tangents,rows=None,columns=None):
+    """
+    (...,height,width) image patches centered on the (...,3) RAS points,
+    with rows along the normals and columns along the tangents at 1mm spacing.
+    If rows (or columns) are given they are the mm positions of the rows
+    along the normal (columns along the tangent) from the patch corner, in
+    place of 0..height-1 (0..width-1).
+    All patches are gathered with a single trilinear sampling pass.
+    """
+    width, height = self.patchSize
+    linear = rasToIJK[:3,:3]
+    points = numpy.dot(points, linear.T) + rasToIJK[:3,3]
+    normals = numpy.dot(normals, linear.T).astype('float32')
+    tangents = numpy.dot(tangents, linear.T).astype('float32')
+    corners = (points - 0.5 * height * normals - 0.5 * width * tangents).astype('float32')
+    if rows is None:
+      rows = numpy.arange(height)
+    rows = numpy.asarray(rows, dtype='float32')[:,numpy.newaxis,numpy.newaxis]
+    if columns is None:
+      columns = numpy.arange(width)
+    columns = numpy.asarray(columns, dtype='float32')[numpy.newaxis,:,numpy.newaxis]
+    ijk = (corners[...,numpy.newaxis,numpy.newaxis,:]
+           + rows * normals[...,numpy.newaxis,numpy.newaxis,:]
+           + columns * tangents[...,numpy.newaxis,numpy.newaxis,:])
+    return self.sampleVolume(volume, ijk)
+
+  def curveFrames(self,curve,sliceNormal):
+    """
+    unit tangents and in-plane normals at each sample of a closed curve
+    (the closing duplicate sample is not included)
+    """
+    points = curve[:-1]
+    tangents = 0.5 * (points - numpy.roll(points, 1, axis=0)) + (numpy.roll(points, -1, axis=0) - points)
+    tangents /= numpy.maximum(numpy.sqrt((tangents * tangents).sum(axis=1)), 1e-12)[:,numpy.newaxis]
+    normals = numpy.cross(tangents, sliceNormal)
+    normals /= numpy.maximum(numpy.sqrt((normals * normals).sum(axis=1)), 1e-12)[:,numpy.newaxis]
+    return tangents, normals
+
+  @profiler.timed('snap')
+  def snapCurve(self,curve,controlPointCount,sliceNormal=None,volume=None,rasToIJK=None,samples=None,previous=None,coarse=None,confidence=None):
+    """
+    move each sample of the closed curve along its normal to the offset
+    whose image patch best matches the patch interpolated between the
+    control points on either side (mean absolute difference).
+    Every candidate patch for every sample is gathered at once and the
+    scores and winners are computed as array reductions.
+    In 'independent' mode each sample takes its own best offset, and if
+    sample indices are given only those are snapped and the rest are taken
+    from the previous snapped curve. In 'smooth' mode every sample is snapped
+    along the best closed path (see snapPath), searched over snapCoarseRange
+    on the coarse (volume,rasToIJK) pair - by default the background volume
+    downsampled by snapCoarseFactor - and then refined on the full volume.
+    The confidence of each snapped sample is written into the confidence
+    array if one is given.
+    Returns the snapped closed curve.
+    """
+    if sliceNormal is None:
+      sliceNormal = self.sliceAxes()[2]
+    if volume is None:
+      entry = self.backgroundEntry()
+      volume, rasToIJK = entry.volume, entry.rasToIJK
+      if coarse is None:
+        level = entry.downsampled(self.snapCoarseFactor)
+        coarse = (level.volume, level.rasToIJK)
+    if coarse is None:
+      coarse = (volume, rasToIJK)
+    points = curve[:-1]
+    tangents, normals = self.curveFrames(curve, sliceNormal)
+    frames = (points, tangents, normals, controlPointCount)
+    smooth = self.snapMode == 'smooth'
+    if samples is None or smooth:
+      samples = numpy.arange(len(points))
+    rows = numpy.arange(len(samples))
+
+    if smooth:
+      coarseStep = self.snapCoarseRange / self.snapSteps
+      coarseOffsets = -0.5 * self.snapCoarseRange + numpy.arange(self.snapSteps) * coarseStep
+      coarseOffsets = numpy.tile(coarseOffsets, (len(samples),1))
+      weights = self.snapWeights(frames, samples, coarseOffsets, *coarse)
+      # neighbors may step by one coarse offset even when that is more than
+      # snapMaxStep, or the coarse path could not leave its first offset
+      centers = coarseOffsets[rows, self.snapPath(weights, coarseOffsets, max(self.snapMaxStep, coarseStep))]
+      # the fine offsets span one coarse step on either side of the coarse path
+      fine = (numpy.arange(self.snapSteps) - self.snapSteps // 2) * (2. * coarseStep / self.snapSteps)
+      offsets = centers[:,numpy.newaxis] + fine
+      weights = self.snapWeights(frames, samples, offsets, volume, rasToIJK)
+      best = self.snapPath(weights, offsets)
+    else:
+      offsets = -0.5 * self.snapRange + numpy.arange(self.snapSteps) * (self.snapRange / self.snapSteps)
+      offsets = numpy.tile(offsets, (len(samples),1))
+      weights = self.snapWeights(frames, samples, offsets, volume, rasToIJK)
+      best = weights.argmin(axis=1)
+
+    snapped = (points if previous is None else previous[:-1]).copy()
+    snapped[samples] = points[samples] + offsets[rows, best][:,numpy.newaxis] * normals[samples]
+    if confidence is not None:
+      # how much better the chosen offset matches than a typical one
+      chosen = weights[rows, best]
+      typical = numpy.median(weights, axis=1)
+      confidence[samples] = numpy.clip((typical - chosen) / numpy.maximum(typical, 1e-12), 0., 1.)
+    return numpy.vstack((snapped, snapped[:1]))
+
+  def snapWeights(self,frames,samples,offsets,volume,rasToIJK):
+    """
+    (samples,offsets) mean absolute differences between the patch at each
+    sample moved along its normal by each of its offsets and the template for
+    that sample: the blend of the patches at the control points on either side.
+    frames holds the curve points, tangents, normals and control point count.
+    """
+    points, tangents, normals, controlPointCount = frames
+    steps = len(points) // controlPointCount
+    cp0 = samples // steps
+    cp1 = (cp0 + 1) % controlPointCount
+    needed = numpy.unique(numpy.concatenate((cp0, cp1)))
+    at = needed * steps
+    controlPatches = self.extractPatches(volume, rasToIJK, points[at], normals[at], tangents[at])
+    t = ((samples % steps) / float(steps)).astype('float32')[:,numpy.newaxis,numpy.newaxis]
+    templates = ((1. - t) * controlPatches[numpy.searchsorted(needed, cp0)]
+                 + t * controlPatches[numpy.searchsorted(needed, cp1)])
+
+    # candidate patches for every sample at every offset along the normal
+    count = offsets.shape[1]
+    relative = offsets[0] - offsets[0,0]
+    if numpy.allclose(offsets - offsets[:,:1], relative):
+      # every sample has the same spread of offsets, so its candidate patches
+      # are windows onto one strip along its normal: sample each distinct
+      # row of the strip once and index the windows out of it
+      height = self.patchSize[1]
+      positions = numpy.round(relative[:,numpy.newaxis] + numpy.arange(height), 6)
+      strip, window = numpy.unique(positions, return_inverse=True)
+      base = points[samples] + offsets[:,:1] * normals[samples]
+      strips = self.extractPatches(volume, rasToIJK, base, normals[samples], tangents[samples], rows=strip)
+      patches = strips[:,window.reshape(count,height)]
+    else:
+      candidates = points[samples,numpy.newaxis] + offsets[:,:,numpy.newaxis] * normals[samples,numpy.newaxis]
+      patches = self.extractPatches(volume, rasToIJK, candidates,
+                                    numpy.repeat(normals[samples,numpy.newaxis], count, axis=1),
+                                    numpy.repeat(tangents[samples,numpy.newaxis], count, axis=1))
+    return numpy.abs(patches - templates[:,numpy.newaxis]).mean(axis=(2,3))
+
+  def snapPath(self,weights,offsets,maxStep=None):
+    """
+    index into each row of the (N,K) weights along the closed path of least
+    total weight whose offsets (an (N,K) array in mm, evenly spaced along
+    each row) change by at most maxStep (snapMaxStep by default) between
+    consecutive rows, last to first included. Each mm of change adds
+    snapSmoothness times the mean weight.
+    The path starts from the best state of the row whose minimum stands
+    out most from its median, and the dynamic program makes one pass around
+    the loop from there. Each step is a min-plus over the band of previous
+    states within maxStep, gathered for all rows up front. If no path
+    satisfies the bound each row takes its own minimum.
+    """
+    count, states = weights.shape
+    bound = (self.snapMaxStep if maxStep is None else maxStep) + 1e-9
+    smoothness = self.snapSmoothness * weights.mean()
+
+    # start from the most distinct row and go around the loop from there
+    best = weights.min(axis=1)
+    typical = numpy.median(weights, axis=1)
+    first = int(((typical - best) / numpy.maximum(typical, 1e-12)).argmax())
+    order = (first + numpy.arange(count)) % count
+    weights, offsets = weights[order], offsets[order]
+
+    # previous[row,state,band] are the states of the row before within the
+    # bound, found from the offset of each row's first state and its spacing
+    spacing = numpy.abs(offsets[:,-1] - offsets[:,0]) / max(states - 1, 1)
+    spacing = numpy.maximum(spacing, 1e-9)
+    width = int(numpy.ceil(bound / spacing.min()))
+    before = numpy.roll(offsets, 1, axis=0)
+    shift = numpy.round((offsets[:,0] - before[:,0]) / numpy.roll(spacing, 1))
+    previous = (numpy.arange(states)[:,numpy.newaxis] + numpy.arange(-width, width + 1)
+                + shift[:,numpy.newaxis,numpy.newaxis]).astype('intp')
+    inside = (previous >= 0) & (previous < states)
+    previous = numpy.clip(previous, 0, states - 1)
+    reached = numpy.take_along_axis(before, previous.reshape(count,-1), axis=1)
+    change = numpy.abs(offsets[:,:,numpy.newaxis] - reached.reshape(previous.shape))
+    penalty = numpy.where(inside & (change <= bound), smoothness * change, numpy.inf)
+
+    start = int(weights[0].argmin())
+    cost = numpy.full(states, numpy.inf)
+    cost[start] = weights[0,start]
+    back = numpy.zeros((count,states), dtype='intp')
+    every = numpy.arange(states)
+    for row in range(1, count):
+      total = cost[previous[row]] + penalty[row]
+      choice = total.argmin(axis=1)
+      back[row] = previous[row,every,choice]
+      cost = total[every,choice] + weights[row]
+    # close the loop back onto the start state
+    change = numpy.abs(offsets[0,start] - offsets[-1])
+    cost = numpy.where(change <= bound, cost + smoothness * change, numpy.inf)
+    if not numpy.isfinite(cost.min()):
+      return weights[numpy.argsort(order)].argmin(axis=1)
+    state = int(cost.argmin())
+    path = numpy.empty(count, dtype='intp')
+    for row in range(count - 1, 0, -1):
+      path[row] = state
+      state = back[row,state]
+    path[0] = start
+    result = numpy.empty(count, dtype='intp')
+    result[order] = path
+    return result
+
+
+#
+# Multi-label apply workers
+#
+
+# the engine of the applyAllLabels job a worker process is running,
+# set up on the job's first task (by one thread at a time when the tasks
+# run on threads)
+workerJob = {}
+workerLock = threading.Lock()
+
+def setUpWorkerJob(job):
+  """
+  attach to the shared volumes of an applyAllLabels job and keep an engine
+  with its options in workerJob
+  """
+  from multiprocessing import shared_memory
+
+  releaseWorkerJob()
+  name, shape, dtype, rasToIJK = job['labels']
+  engine = ModelDrawEngine()
+  for option, value in job['options'].items():
+    setattr(engine, option, value)
+  engine.journal.maxBytes = 0
+  engine.axes = job['axes']
+  memory = shared_memory.SharedMemory(name=name)
+  engine.labelArray = numpy.ndarray(shape, dtype, buffer=memory.buf)
+  engine.labelRASToIJK = rasToIJK
+  memories = [memory]
+  if job['background']:
+    backgroundName, backgroundShape, backgroundType, backgroundRASToIJK, spacing = job['background']
+    memory = shared_memory.SharedMemory(name=backgroundName)
+    volume = numpy.ndarray(backgroundShape, backgroundType, buffer=memory.buf)
+    engine.background = CachedVolume(0, volume, backgroundRASToIJK, spacing)
+    memories.append(memory)
+  workerJob.update(name=name, engine=engine, memories=memories)
+
+
+def releaseWorkerJob():
+  """
+  drop the engine of the last job and detach from its shared volumes
+  """
+  engine = workerJob.get('engine')
+  memories = workerJob.get('memories', ())
+  workerJob.clear()
+  if engine is not None:
+    # the arrays must go before the memory they view can be closed
+    engine.labelArray = engine.background = None
+  for memory in memories:
+    memory.close()
+
+
+def applyLabelSlices(job,slices):
+  """
+  fill the (slice index, [(label, controlPoints, defined), ...]) slices of an
+  applyAllLabels job into its shared label array, in a worker process or
+  thread. Returns the number of slices filled per label.
+  """
+  with workerLock:
+    if workerJob.get('name') != job['labels'][0]:
+      setUpWorkerJob(job)
+    engine = workerJob['engine']
+
+  filled = collections.Counter()
+  for sliceIndex, labels in slices:
+    for label, controlPoints, defined in labels:
+      tangents = None
+      if defined and engine.edgeTangents and len(controlPoints) > 1:
+        tangents = engine.estimateEdgeTangents(controlPoints)
+      curve = engine.curve(controlPoints, tangents)
+      if engine.snap and len(curve) > 3:
+        curve = engine.snapCurve(curve, len(controlPoints))
+      if engine.applyCurve(curve, label, job['erase']):
+        filled[label] += 1
+  return filled
+
+
+#
+# LazyClass
+#
+
+class LazyClass:
+  """
+  Stands in for the class className of module moduleName, which is only
+  imported the first time the class is called or one of its attributes
+  is read. ModelDrawEffect registers the effect's extension class in
+  slicer.modules.editorExtensions as one of these: EditorLib's EditBox
+  calls the entry with no arguments to create the extension and reads the
+  options, tool and logic classes from it, so the editor classes (and
+  EditorLib itself) are not imported when Slicer discovers the module.
+  """
+
+  def __init__(self,moduleName,className):
+    self.moduleName = moduleName
+    self.className = className
+
+  def resolve(self):
+    """
+    the class itself, importing its module if needed
+    """
+    import importlib
+    return getattr(importlib.import_module(self.moduleName), self.className)
+
+  def __call__(self,*args,**kwargs):
+    return self.resolve()(*args, **kwargs)
+
+  def __getattr__(self,name):
+    # only reached for names not set in __init__; special names are
+    # looked up by copy, pickle and the like, and should not import
+    if name.startswith('__') or name in ('moduleName', 'className'):
+      raise AttributeError(name)
+    return getattr(self.resolve(), name)
@@ -0,0 +1,1167 @@
+"""
+The ModelDraw editor effect: options panel, per-view tool and the logic
+adapting ModelDrawEffectCore.ModelDrawEngine to a slice view. This module
+imports EditorLib, so ModelDrawEffect only loads it when the Editor first
+creates the effect.
+"""
+
+import os
+import time
+import hashlib
+import concurrent.futures
+import numpy
+from __main__ import vtk, qt, ctk, slicer
+import EditorLib
+from EditorLib.EditOptions import HelpButton
+from EditorLib.EditOptions import EditOptions
+from EditorLib import EditUtil
+from EditorLib import LabelEffect
+import ModelDrawEffectCore
+
+#
+# The Editor Extension itself.
+#
+# This needs to define the hooks to be come an editor effect.
+#
+
+#
+# ModelDrawEffectOptions - see LabelEffect, EditOptions and Effect for superclasses
+#
+
+class ModelDrawEffectOptions(EditorLib.LabelEffectOptions):
+  """ ModelDrawEffect-specfic gui
+  """
+
+  def __init__(self, parent=0):
+    super(ModelDrawEffectOptions,self).__init__(parent)
+
+    # self.attributes should be tuple of options:
+    # 'MouseTool' - grabs the cursor
+    # 'Nonmodal' - can be applied while another is active
+    # 'Disabled' - not available
+    self.attributes = ('MouseTool')
+    self.displayName = 'ModelDrawEffect Effect'
+
+  def __del__(self):
+    super(ModelDrawEffectOptions,self).__del__()
+
+  def create(self):
+    super(ModelDrawEffectOptions,self).create()
+    self.snap = qt.QCheckBox("Snap", self.frame)
+    self.snap.setToolTip("Snap the curve to follow the image profile at the control points")
+    self.frame.layout().addWidget(self.snap)
+    self.widgets.append(self.snap)
+
+    self.smoothSnap = qt.QCheckBox("Smooth Snap", self.frame)
+    self.smoothSnap.setToolTip("Snap the whole curve at once along the best smooth path, with a wider search range")
+    self.frame.layout().addWidget(self.smoothSnap)
+    self.widgets.append(self.smoothSnap)
+
+    self.edgeTangents = qt.QCheckBox("Edge Tangents", self.frame)
+    self.edgeTangents.setToolTip("Use edge directions estimated from the image as curve tangents at the control points")
+    self.frame.layout().addWidget(self.edgeTangents)
+    self.widgets.append(self.edgeTangents)
+
+    self.surfaceModel = qt.QCheckBox("Surface Model", self.frame)
+    self.surfaceModel.setToolTip("Show a live surface model through the curves of the defined slices")
+    self.frame.layout().addWidget(self.surfaceModel)
+    self.widgets.append(self.surfaceModel)
+
+    self.replace = qt.QCheckBox("Replace", self.frame)
+    self.replace.setToolTip("Erase the current label from the slice before drawing the curve")
+    self.frame.layout().addWidget(self.replace)
+    self.widgets.append(self.replace)
+
+    self.apply = qt.QPushButton("Apply", self.frame)
+    self.apply.setToolTip("Fill the curve on the current slice with the current label")
+    self.frame.layout().addWidget(self.apply)
+    self.widgets.append(self.apply)
+
+    self.applyCurves = qt.QPushButton("Apply Curves", self.frame)
+    self.applyCurves.setToolTip("Fill in all curves between the first and last slices with control points")
+    self.frame.layout().addWidget(self.applyCurves)
+    self.widgets.append(self.applyCurves)
+
+    self.importScene = qt.QPushButton("Import...", self.frame)
+    self.importScene.setToolTip("Import the control points of a reference scene, replacing those of this scene")
+    self.frame.layout().addWidget(self.importScene)
+    self.widgets.append(self.importScene)
+
+    self.importRegister = qt.QCheckBox("Register Import", self.frame)
+    self.importRegister.setToolTip("Register the volume of the imported scene to the background volume and transform the imported control points accordingly")
+    self.frame.layout().addWidget(self.importRegister)
+    self.widgets.append(self.importRegister)
+    self.importJob = None
+
+    self.progress = qt.QProgressBar(self.frame)
+    self.progress.hide()
+    self.frame.layout().addWidget(self.progress)
+
+    self.applyAllLabels = qt.QPushButton("Apply All Labels", self.frame)
+    self.applyAllLabels.setToolTip("Fill in the curves of every label with control points, on all their slices")
+    self.frame.layout().addWidget(self.applyAllLabels)
+    self.widgets.append(self.applyAllLabels)
+
+    self.labelPriorityFrame = qt.QFrame(self.frame)
+    self.labelPriorityFrame.setLayout(qt.QHBoxLayout())
+    self.frame.layout().addWidget(self.labelPriorityFrame)
+    self.labelPriorityLabel = qt.QLabel("Label Priority:", self.labelPriorityFrame)
+    self.labelPriorityFrame.layout().addWidget(self.labelPriorityLabel)
+    self.labelPriority = qt.QLineEdit(self.labelPriorityFrame)
+    self.labelPriority.setToolTip("Label values, highest priority first, that win where curves of different labels overlap when applying all labels")
+    self.labelPriorityFrame.layout().addWidget(self.labelPriority)
+    self.widgets.append(self.labelPriority)
+
+    self.undo = qt.QPushButton("Undo", self.frame)
+    self.undo.setToolTip("Undo the last ModelDraw edit: control point changes or curves filled into the label map")
+    self.frame.layout().addWidget(self.undo)
+    self.widgets.append(self.undo)
+
+    self.redo = qt.QPushButton("Redo", self.frame)
+    self.redo.setToolTip("Redo the last undone ModelDraw edit")
+    self.frame.layout().addWidget(self.redo)
+    self.widgets.append(self.redo)
+
+    self.cancel = qt.QPushButton("Cancel", self.frame)
+    self.cancel.setToolTip("Stop filling curves (slices already filled are kept)")
+    self.cancel.hide()
+    self.frame.layout().addWidget(self.cancel)
+
+    HelpButton(self.frame, "Use this tool to draw interpolated outlines.  Left click to add control points, then Apply to fill the curve into the label map.  With Replace checked, the current label is first erased from the slice.")
+
+    self.connections.append( (self.snap, 'clicked()', self.updateMRMLFromGUI) )
+    self.connections.append( (self.smoothSnap, 'clicked()', self.updateMRMLFromGUI) )
+    self.connections.append( (self.edgeTangents, 'clicked()', self.updateMRMLFromGUI) )
+    self.connections.append( (self.surfaceModel, 'clicked()', self.updateMRMLFromGUI) )
+    self.connections.append( (self.replace, 'clicked()', self.updateMRMLFromGUI) )
+    self.connections.append( (self.importRegister, 'clicked()', self.updateMRMLFromGUI) )
+    self.connections.append( (self.importScene, 'clicked()', self.onImport) )
+    self.connections.append( (self.apply, 'clicked()', self.onApply) )
+    self.connections.append( (self.applyCurves, 'clicked()', self.onApplyCurves) )
+    self.connections.append( (self.applyAllLabels, 'clicked()', self.onApplyAllLabels) )
+    self.connections.append( (self.labelPriority, 'editingFinished()', self.updateMRMLFromGUI) )
+    self.connections.append( (self.undo, 'clicked()', self.onUndo) )
+    self.connections.append( (self.redo, 'clicked()', self.onRedo) )
+    self.connections.append( (self.cancel, 'clicked()', self.onCancel) )
+
+    # Add vertical spacer
+    self.frame.layout().addStretch(1)
+
+  def destroy(self):
+    super(ModelDrawEffectOptions,self).destroy()
+
+  # note: this method needs to be implemented exactly as-is
+  # in each leaf subclass so that "self" in the observer
+  # is of the correct type
+  def updateParameterNode(self, caller, event):
+    node = EditUtil.EditUtil().getParameterNode()
+    if node != self.parameterNode:
+      if self.parameterNode:
+        node.RemoveObserver(self.parameterNodeTag)
+      self.parameterNode = node
+      self.parameterNodeTag = node.AddObserver(vtk.vtkCommand.ModifiedEvent, self.updateGUIFromMRML)
+
+  def setMRMLDefaults(self):
+    super(ModelDrawEffectOptions,self).setMRMLDefaults()
+    disableState = self.parameterNode.GetDisableModifiedEvent()
+    self.parameterNode.SetDisableModifiedEvent(1)
+    defaults = (
+      ("snap", "0"),
+      ("smoothSnap", "0"),
+      ("edgeTangents", "0"),
+      ("surfaceModel", "0"),
+      ("replace", "1"),
+      ("importRegister", "1"),
+      ("labelPriority", ""),
+    )
+    for d in defaults:
+      param = "ModelDrawEffect,"+d[0]
+      pvalue = self.parameterNode.GetParameter(param)
+      if pvalue == '':
+        self.parameterNode.SetParameter(param, d[1])
+    self.parameterNode.SetDisableModifiedEvent(disableState)
+
+  def updateGUIFromMRML(self,caller,event):
+    self.disconnectWidgets()
+    super(ModelDrawEffectOptions,self).updateGUIFromMRML(caller,event)
+    self.snap.setChecked(int(self.parameterNode.GetParameter("ModelDrawEffect,snap")))
+    self.smoothSnap.setChecked(int(self.parameterNode.GetParameter("ModelDrawEffect,smoothSnap")))
+    self.edgeTangents.setChecked(int(self.parameterNode.GetParameter("ModelDrawEffect,edgeTangents")))
+    self.surfaceModel.setChecked(int(self.parameterNode.GetParameter("ModelDrawEffect,surfaceModel")))
+    self.replace.setChecked(int(self.parameterNode.GetParameter("ModelDrawEffect,replace")))
+    self.importRegister.setChecked(int(self.parameterNode.GetParameter("ModelDrawEffect,importRegister")))
+    self.labelPriority.text = self.parameterNode.GetParameter("ModelDrawEffect,labelPriority")
+    self.connectWidgets()
+    for tool in self.tools:
+      snapMode = 'smooth' if self.smoothSnap.checked else 'independent'
+      tool.configure(snap=self.snap.checked, edgeTangents=self.edgeTangents.checked, snapMode=snapMode,
+                     surfaceModel=self.surfaceModel.checked)
+
+  def editingTools(self):
+    """
+    one tool per label model among the views parallel to its slices
+    """
+    tools, models = [], []
+    for tool in self.tools:
+      if tool.logic.editable() and tool.logic.model not in models:
+        tools.append(tool)
+        models.append(tool.logic.model)
+    return tools
+
+  def onApply(self):
+    for tool in self.tools:
+      if tool.logic.editable():
+        tool.logic.applyCurve(erase=self.replace.checked)
+
+  def onApplyCurves(self):
+    self.applyCurves.enabled = False
+    self.progress.show()
+    self.cancel.show()
+    try:
+      for tool in self.editingTools():
+        self.progress.setValue(0)
+        tool.logic.applyCurves(erase=self.replace.checked, progress=self.onApplyProgress)
+    finally:
+      self.progress.hide()
+      self.cancel.hide()
+      self.applyCurves.enabled = True
+
+  def onApplyAllLabels(self):
+    if not self.tools:
+      return
+    priority = [int(value) for value in self.labelPriority.text.replace(',', ' ').split() if value.isdigit()]
+    self.applyAllLabels.enabled = False
+    self.progress.setValue(0)
+    self.progress.show()
+    self.cancel.show()
+    logic = self.tools[0].logic
+    try:
+      logic.applyAllLabels(priority=priority, erase=self.replace.checked, progress=self.onApplyProgress)
+    finally:
+      self.progress.hide()
+      self.cancel.hide()
+      self.applyAllLabels.enabled = True
+    if logic.skippedLabels:
+      qt.QMessageBox.warning(slicer.util.mainWindow(), "ModelDraw Apply",
+          "Labels %s were drawn on slices of another orientation and were not applied.\n"
+          "Apply them from a view of that orientation." % ', '.join(map(str, logic.skippedLabels)))
+
+  def onApplyProgress(self,done,total):
+    self.progress.setMaximum(total)
+    self.progress.setValue(done)
+    slicer.app.processEvents()
+
+  def onUndo(self):
+    self.replayLatest(redo=False)
+
+  def onRedo(self):
+    self.replayLatest(redo=True)
+
+  def replayLatest(self,redo):
+    """
+    undo the most recent edit among the views' journals, or redo the
+    edit undone last (the oldest of the undone ones on top of the journals)
+    """
+    tools = [tool for tool in self.tools if tool.logic.journal.latest(redo)]
+    if not tools:
+      return
+    choose = min if redo else max
+    tool = choose(tools, key=lambda tool: tool.logic.journal.latest(redo))
+    if redo:
+      tool.logic.redo()
+    else:
+      tool.logic.undo()
+    tool.updateFeedback()
+    tool.scheduleModelUpdate()
+
+  def onCancel(self):
+    for tool in self.tools:
+      tool.logic.cancelApply()
+    if self.importJob:
+      self.importJob.cancel()
+
+  def onImport(self):
+    if self.importJob or not self.tools:
+      return
+    logic = self.tools[0].logic
+    store = logic.controlPointStore()
+    if any(len(store.get(label)) for label in store.labels()):
+      answer = qt.QMessageBox.question(slicer.util.mainWindow(), "ModelDraw Import",
+                                       "Control points exist in this scene.\nReplace them with import?",
+                                       qt.QMessageBox.Yes | qt.QMessageBox.No)
+      if answer != qt.QMessageBox.Yes:
+        return
+    path = qt.QFileDialog.getOpenFileName(slicer.util.mainWindow(), "Select Scene to Import", "", "MRML Scene (*.mrml)")
+    if not path:
+      return
+    self.importScene.enabled = False
+    self.progress.show()
+    self.cancel.show()
+    self.importJob = ControlPointImport(logic, path, self.importRegister.checked, self.onImportProgress, self.onImportFinished)
+    self.importJob.start()
+
+  def onImportProgress(self,message,done,total):
+    # a zero total shows a busy indicator
+    self.progress.setRange(0, total)
+    self.progress.setValue(done)
+    self.progress.setFormat(message + (' %p%' if total else ''))
+
+  def onImportFinished(self,message):
+    self.importJob = None
+    self.progress.setFormat('%p%')
+    self.progress.hide()
+    self.cancel.hide()
+    self.importScene.enabled = True
+    if self.tools:
+      self.tools[0].logic.reloadControlPoints()
+    for tool in self.tools:
+      tool.updateFeedback()
+      tool.scheduleModelUpdate()
+    if message:
+      qt.QMessageBox.warning(slicer.util.mainWindow(), "ModelDraw Import", message)
+
+  def updateMRMLFromGUI(self):
+    if self.updatingGUI:
+      return
+    disableState = self.parameterNode.GetDisableModifiedEvent()
+    self.parameterNode.SetDisableModifiedEvent(1)
+    super(ModelDrawEffectOptions,self).updateMRMLFromGUI()
+    self.parameterNode.SetParameter("ModelDrawEffect,snap", str(int(self.snap.checked)))
+    self.parameterNode.SetParameter("ModelDrawEffect,smoothSnap", str(int(self.smoothSnap.checked)))
+    self.parameterNode.SetParameter("ModelDrawEffect,edgeTangents", str(int(self.edgeTangents.checked)))
+    self.parameterNode.SetParameter("ModelDrawEffect,surfaceModel", str(int(self.surfaceModel.checked)))
+    self.parameterNode.SetParameter("ModelDrawEffect,replace", str(int(self.replace.checked)))
+    self.parameterNode.SetParameter("ModelDrawEffect,importRegister", str(int(self.importRegister.checked)))
+    self.parameterNode.SetParameter("ModelDrawEffect,labelPriority", self.labelPriority.text)
+    self.parameterNode.SetDisableModifiedEvent(disableState)
+    if not disableState:
+      self.parameterNode.InvokePendingModifiedEvent()
+
+
+#
+# ModelDrawEffectTool
+#
+
+class ModelDrawEffectTool(LabelEffect.LabelEffectTool):
+  """
+  One instance of this will be created per-view when the effect
+  is selected.  It is responsible for implementing feedback and
+  label map changes in response to user input.
+  This class observes the editor parameter node to configure itself
+  and queries the current view for background and label volume
+  nodes to operate on.
+  """
+
+  def __init__(self, sliceWidget):
+    super(ModelDrawEffectTool,self).__init__(sliceWidget)
+    # create a logic instance to do the non-gui work
+    self.logic = ModelDrawEffectLogic(self.sliceWidget.sliceLogic())
+    # edits made in the other views of the label are shown here too
+    self.logic.modelCallback = self.onModelChanged
+    # index of the control point being dragged, if any
+    self.dragIndex = None
+    # pixel distance within which a click picks a control point
+    self.pickTolerance = 6
+
+    # bursts of drag events are coalesced to the latest position, which is
+    # handled once the event queue is empty. Heavy work (snapping) waits until
+    # the pointer has rested for frameBudget milliseconds; until then the
+    # cheap unsnapped preview is shown.
+    self.frameBudget = 33
+    self.pendingMove = None
+    self.moveTimer = qt.QTimer()
+    self.moveTimer.setSingleShot(True)
+    self.moveTimer.setInterval(0)
+    self.moveTimer.connect('timeout()', self.onPendingMove)
+    self.heavyTimer = qt.QTimer()
+    self.heavyTimer.setSingleShot(True)
+    self.heavyTimer.connect('timeout()', self.onHeavyUpdate)
+    self.feedbackTimer = qt.QTimer()
+    self.feedbackTimer.setSingleShot(True)
+    self.feedbackTimer.setInterval(0)
+    self.feedbackTimer.connect('timeout()', self.onSliceChanged)
+    # the surface model is rebuilt at most once per frameBudget while editing
+    self.surfaceModel = False
+    self.modelTimer = qt.QTimer()
+    self.modelTimer.setSingleShot(True)
+    self.modelTimer.connect('timeout()', self.onModelUpdate)
+
+    # feedback actor for the curve on this slice. The points and the
+    # polyline cell are backed by NumPy buffers (see reserveFeedback)
+    self.points = vtk.vtkPoints()
+    self.lines = vtk.vtkCellArray()
+    self.xyBuffer = numpy.zeros((0,3), dtype='float32')
+    self.offsetBuffer = None
+    self.cellBuffer = None
+    self.feedbackCount = None
+    self.polyData = vtk.vtkPolyData()
+    self.polyData.SetPoints(self.points)
+    self.polyData.SetLines(self.lines)
+    self.mapper = vtk.vtkPolyDataMapper2D()
+    self.mapper.SetInputData(self.polyData)
+    self.actor = vtk.vtkActor2D()
+    self.actor.SetMapper(self.mapper)
+    self.actor.GetProperty().SetColor(1,1,0)
+    self.actor.GetProperty().SetLineWidth(1)
+    self.renderer.AddActor2D(self.actor)
+    self.actors.append(self.actor)
+
+    # feedback actor for the line pairs where the label's surface crosses
+    # this slice, when it is not parallel to the label's slices
+    self.crossPoints = vtk.vtkPoints()
+    self.crossLines = vtk.vtkCellArray()
+    self.crossPolyData = vtk.vtkPolyData()
+    self.crossPolyData.SetPoints(self.crossPoints)
+    self.crossPolyData.SetLines(self.crossLines)
+    self.crossMapper = vtk.vtkPolyDataMapper2D()
+    self.crossMapper.SetInputData(self.crossPolyData)
+    self.crossActor = vtk.vtkActor2D()
+    self.crossActor.SetMapper(self.crossMapper)
+    self.crossActor.GetProperty().SetColor(1,1,0)
+    self.crossActor.GetProperty().SetLineWidth(1)
+    self.crossActor.VisibilityOff()
+    self.renderer.AddActor2D(self.crossActor)
+    self.actors.append(self.crossActor)
+
+    # highlight of the control point or curve position under the pointer
+    self.hovered = None
+    self.highlightPoints = vtk.vtkPoints()
+    self.highlightVerts = vtk.vtkCellArray()
+    self.highlightPolyData = vtk.vtkPolyData()
+    self.highlightPolyData.SetPoints(self.highlightPoints)
+    self.highlightPolyData.SetVerts(self.highlightVerts)
+    self.highlightMapper = vtk.vtkPolyDataMapper2D()
+    self.highlightMapper.SetInputData(self.highlightPolyData)
+    self.highlightActor = vtk.vtkActor2D()
+    self.highlightActor.SetMapper(self.highlightMapper)
+    self.highlightActor.GetProperty().SetPointSize(7)
+    self.highlightActor.VisibilityOff()
+    self.renderer.AddActor2D(self.highlightActor)
+    self.actors.append(self.highlightActor)
+
+  def cleanup(self):
+    for timer in (self.moveTimer, self.heavyTimer, self.feedbackTimer, self.modelTimer):
+      timer.stop()
+    self.logic.modelCallback = None
+    self.logic.model.unsubscribe(self.logic.onModelChanged)
+    self.logic.prefetcher.shutdown()
+    super(ModelDrawEffectTool,self).cleanup()
+
+  def configure(self,snap,edgeTangents,snapMode='independent',surfaceModel=False):
+    """
+    apply the curve options, recomputing the curve if they changed
+    """
+    if surfaceModel != self.surfaceModel:
+      self.surfaceModel = surfaceModel
+      self.scheduleModelUpdate()
+    if (snap,edgeTangents,snapMode) != (self.logic.snap,self.logic.edgeTangents,self.logic.snapMode):
+      self.logic.snap = snap
+      self.logic.edgeTangents = edgeTangents
+      self.logic.snapMode = snapMode
+      self.logic.curves.clear()
+      self.updateFeedback()
+
+  def onPendingMove(self):
+    """
+    move the dragged control point to the latest pointer position
+    """
+    if self.pendingMove is None or self.dragIndex is None:
+      return
+    xy, self.pendingMove = self.pendingMove, None
+    self.logic.moveControlPoint(self.dragIndex, self.logic.xyToRAS(xy)[:3], heavy=False)
+    self.updateFeedback(self.logic.changedSamples)
+    self.scheduleModelUpdate()
+    if self.logic.heavyUpdatePending():
+      self.heavyTimer.start(int(self.frameBudget))
+
+  def onHeavyUpdate(self):
+    """
+    complete the deferred work on the current curve
+    """
+    if self.logic.heavyUpdatePending():
+      self.logic.completeCurve()
+      self.updateFeedback(self.logic.changedSamples)
+      self.scheduleModelUpdate()
+
+  def scheduleModelUpdate(self):
+    """
+    rebuild the surface model once the current burst of edits settles
+    """
+    if self.surfaceModel and not self.modelTimer.isActive():
+      self.modelTimer.start(int(self.frameBudget))
+
+  def onModelUpdate(self):
+    if self.surfaceModel:
+      self.logic.updateSurfaceModel()
+
+  def onModelChanged(self):
+    """
+    another view changed the control points of the label shown here
+    """
+    if not self.feedbackTimer.isActive():
+      self.feedbackTimer.start()
+
+  @ModelDrawEffectCore.profiler.timed('feedback')
+  def onSliceChanged(self):
+    """
+    show the curve of the slice the view moved to and start computing
+    the slices it is likely to move to next
+    """
+    self.updateFeedback()
+    self.logic.prefetch()
+
+  def reserveFeedback(self,count):
+    """
+    make the feedback buffers hold at least count points, doubling their
+    capacity as needed. The vtkPoints data and the offsets and connectivity
+    of the polyline's cell array wrap NumPy buffers without copying, and
+    are handed to the cell array once here, so a frame only writes into
+    them and marks them modified.
+    """
+    if self.cellBuffer is not None and count <= len(self.xyBuffer):
+      return
+    from vtk.util import numpy_support
+    capacity = max(64, len(self.xyBuffer))
+    while capacity < count:
+      capacity *= 2
+    idType = 'int64' if vtk.vtkIdTypeArray().GetDataTypeSize() == 8 else 'int32'
+    self.xyBuffer = numpy.zeros((capacity,3), dtype='float32')
+    # the polyline cell: its start and end offsets and the point ids
+    self.offsetBuffer = numpy.zeros(2, dtype=idType)
+    self.cellBuffer = numpy.arange(capacity, dtype=idType)
+    self.vtkXY = numpy_support.numpy_to_vtk(self.xyBuffer, deep=0)
+    self.vtkOffsets = numpy_support.numpy_to_vtkIdTypeArray(self.offsetBuffer, deep=0)
+    self.vtkCells = numpy_support.numpy_to_vtkIdTypeArray(self.cellBuffer, deep=0)
+    self.points.SetData(self.vtkXY)
+    self.lines.SetData(self.vtkOffsets, self.vtkCells)
+    self.feedbackCount = None
+
+  def updateFeedback(self,changed=None):
+    """
+    show the curve of the current slice. When the number of samples is
+    unchanged and the indices of the changed samples are given, only those
+    points of the feedback polyline are rewritten in place. Slices across
+    the label's slices show its cross section instead.
+    """
+    editable = self.logic.editable()
+    self.actor.SetVisibility(editable)
+    self.crossActor.SetVisibility(not editable)
+    if not editable:
+      self.updateCrossSection()
+      return
+    curve = self.logic.currentCurve()
+    xy = self.logic.rasToXYArray(curve)
+    count = len(xy)
+    self.reserveFeedback(count)
+    if changed is None or count != self.feedbackCount:
+      self.xyBuffer[:count,:2] = xy[:,:2]
+      self.vtkXY.SetNumberOfTuples(count)
+      # one cell of count points, or no cell at all
+      self.offsetBuffer[1] = count
+      self.vtkOffsets.SetNumberOfTuples(2 if count else 1)
+      self.vtkCells.SetNumberOfTuples(count)
+      self.vtkOffsets.Modified()
+      self.vtkCells.Modified()
+      self.lines.Modified()
+      self.feedbackCount = count
+    else:
+      changed = numpy.asarray(changed, dtype='int64')
+      self.xyBuffer[changed,:2] = xy[changed,:2]
+    self.points.Modified()
+    with ModelDrawEffectCore.profiler.stage('render'):
+      self.sliceView.scheduleRender()
+
+  def updateCrossSection(self):
+    """
+    show the line segments where the surface of the label crosses this slice
+    """
+    from vtk.util import numpy_support
+    segments = self.logic.crossSection()
+    count = len(segments)
+    xy = self.logic.rasToXYArray(segments.reshape(-1,3)).astype('float32')
+    xy[:,2] = 0
+    idType = 'int64' if vtk.vtkIdTypeArray().GetDataTypeSize() == 8 else 'int32'
+    cells = numpy.empty((count,3), dtype=idType)
+    cells[:,0] = 2
+    cells[:,1] = numpy.arange(0, 2 * count, 2)
+    cells[:,2] = cells[:,1] + 1
+    self.crossPoints.SetData(numpy_support.numpy_to_vtk(xy, deep=1))
+    self.crossLines.SetCells(count, numpy_support.numpy_to_vtkIdTypeArray(cells.ravel(), deep=1))
+    self.crossPolyData.Modified()
+    with ModelDrawEffectCore.profiler.stage('render'):
+      self.sliceView.scheduleRender()
+
+  def pick(self,xy):
+    """
+    what is within pickTolerance pixels of xy on this slice: ('point', index)
+    for a control point, ('segment', index) for a curve segment (see
+    nearestCurveSegment), or None. Both are found through the logic's
+    grid indexes rather than per-point widgets.
+    """
+    ras = self.logic.xyToRAS(xy)[:3]
+    radius = self.pickTolerance * self.logic.pixelSize()
+    hit = self.logic.nearestControlPoint(ras, radius)
+    if hit:
+      return ('point', hit[0])
+    hit = self.logic.nearestCurveSegment(ras, radius)
+    if hit:
+      return ('segment', hit[0])
+    return None
+
+  def updateHighlight(self,xy):
+    """
+    mark the control point under xy (orange), or the place on the curve
+    where a click would insert a point (cyan)
+    """
+    hovered = self.pick(xy)
+    if hovered == self.hovered and not (hovered and hovered[0] == 'segment'):
+      return
+    self.hovered = hovered
+    self.highlightVerts.Reset()
+    if hovered is None:
+      self.highlightActor.VisibilityOff()
+    else:
+      if hovered[0] == 'point':
+        controlPoints = self.logic.controlPoints[self.logic.offset()]
+        x, y = self.logic.rasToXYArray(controlPoints[hovered[1]])[0,:2]
+        self.highlightActor.GetProperty().SetColor(1,0.5,0)
+      else:
+        x, y = xy
+        self.highlightActor.GetProperty().SetColor(0,1,1)
+      self.highlightPoints.SetNumberOfPoints(1)
+      self.highlightPoints.SetPoint(0, x, y, 0)
+      self.highlightVerts.InsertNextCell(1)
+      self.highlightVerts.InsertCellPoint(0)
+      self.highlightActor.VisibilityOn()
+    self.highlightPoints.Modified()
+    self.highlightVerts.Modified()
+    self.sliceView.scheduleRender()
+
+  @ModelDrawEffectCore.profiler.timed('event')
+  def processEvent(self, caller=None, event=None):
+    """
+    handle events from the render window interactor
+    """
+
+    # let the superclass deal with the event if it wants to
+    if super(ModelDrawEffectTool,self).processEvent(caller,event):
+      return
+
+    # follow the current paint label
+    self.logic.setLabel(EditUtil.EditUtil().getLabel())
+    # views across the label's slices only show its cross section
+    editable = self.logic.editable()
+
+    if event == "LeftButtonPressEvent" and editable:
+      xy = self.interactor.GetEventPosition()
+      hit = self.pick(xy)
+      self.dragIndex = None
+      if hit:
+        # the whole drag (with the insertion) is undone at once
+        self.logic.journal.begin('drag control point')
+      if hit and hit[0] == 'point':
+        self.dragIndex = hit[1]
+      elif hit:
+        # clicking the curve inserts a point between the control points
+        # around that segment, which can then be dragged
+        self.dragIndex = hit[1] // self.logic.splineSteps + 1
+        self.logic.insertControlPoint(self.dragIndex, self.logic.xyToRAS(xy)[:3])
+        self.updateFeedback()
+        self.scheduleModelUpdate()
+      else:
+        self.logic.apply(xy)
+        self.updateFeedback()
+        self.scheduleModelUpdate()
+      self.abortEvent(event)
+    elif event == "MouseMoveEvent":
+      if self.dragIndex is not None:
+        self.pendingMove = self.interactor.GetEventPosition()
+        if not self.moveTimer.isActive():
+          self.moveTimer.start()
+        self.abortEvent(event)
+      elif editable:
+        self.updateHighlight(self.interactor.GetEventPosition())
+    elif event == "KeyPressEvent" and editable:
+      if self.interactor.GetKeySym() in ('Delete', 'BackSpace'):
+        hit = self.pick(self.interactor.GetEventPosition())
+        if hit and hit[0] == 'point':
+          self.logic.deleteControlPoint(hit[1])
+          self.hovered = None
+          self.updateFeedback()
+          self.scheduleModelUpdate()
+          self.abortEvent(event)
+    elif event == "LeftButtonReleaseEvent":
+      if self.dragIndex is not None:
+        self.onPendingMove()
+        self.dragIndex = None
+        self.logic.journal.end()
+        self.logic.storeControlPoints()
+        self.heavyTimer.start(0)
+        self.abortEvent(event)
+    else:
+      pass
+
+    # events from the slice node
+    if caller and caller.IsA('vtkMRMLSliceNode'):
+      # the slice moved or the view was panned or zoomed -
+      # refresh the feedback once the burst of changes is over
+      if not self.feedbackTimer.isActive():
+        self.feedbackTimer.start()
+
+
+#
+# ControlPointImport
+#
+
+class ControlPointImport:
+  """
+  Imports the control points of a reference scene without blocking the
+  application (the Slicer3 effect's importCallback polled the registration
+  once a second in a modal loop). The scene is parsed on a worker thread,
+  whose completion is handed to the main thread as a modified event of
+  readNotifier (queued through the application logic's RequestModified,
+  as CLI threads do). When registration is requested, the scene's volume
+  is loaded - which blocks, as volume reading in Slicer does - and
+  registered to the background volume by a BRAINSFit CLI whose completion
+  is observed through the CLI node's modified events. The resulting
+  transform and the re-projection onto the slices of logic are then
+  applied to all points as one array operation (ControlPointStore.transform)
+  and the points replace those of the scene. progress(message, done, total) reports each stage
+  (total is 0 while the length is unknown) and finished(message) is called
+  once at the end, with None or an error or warning to show.
+  """
+
+  def __init__(self,logic,path,register,progress,finished):
+    self.logic = logic
+    self.path = path
+    self.register = register
+    self.progress = progress
+    self.finished = finished
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    self.future = None
+    self.store = None
+    self.warning = None
+    self.cliNode = None
+    self.cliTag = None
+    self.transformNode = None
+    self.cancelled = False
+    # modified on the main thread once the worker thread's result is ready
+    self.readNotifier = vtk.vtkObject()
+    self.readTag = self.readNotifier.AddObserver(vtk.vtkCommand.ModifiedEvent, self.onReadDone)
+
+  def start(self):
+    self.progress('Reading %s' % os.path.basename(self.path), 0, 0)
+    self.future = self.executor.submit(self.read, self.path)
+    self.future.add_done_callback(self.notifyRead)
+
+  def notifyRead(self,future):
+    """
+    queue the modified event of readNotifier (called on the worker thread)
+    """
+    slicer.app.applicationLogic().RequestModified(self.readNotifier)
+
+  def read(self,path):
+    """
+    parse the scene and decode its control points (on the worker thread)
+    """
+    parameters, volumes = ModelDrawEffectCore.readReferenceScene(path)
+    store = ModelDrawEffectCore.ControlPointStore()
+    store.update(parameters)
+    return store, volumes
+
+  def cancel(self):
+    self.cancelled = True
+    if self.cliNode:
+      self.cliNode.Cancel()
+    else:
+      self.finish('Import cancelled')
+
+  def finish(self,message=None):
+    if self.readTag:
+      self.readNotifier.RemoveObserver(self.readTag)
+      self.readTag = None
+    self.executor.shutdown(wait=False)
+    if self.cliNode and self.cliTag:
+      self.cliNode.RemoveObserver(self.cliTag)
+      self.cliTag = None
+    finished, self.finished = self.finished, None
+    if finished:
+      finished(message)
+
+  def onReadDone(self,caller,event):
+    if self.cancelled or not self.future.done():
+      return
+    try:
+      self.store, volumes = self.future.result()
+    except (IOError, OSError, ValueError, SyntaxError) as error:
+      self.finish('Could not read %s\n%s' % (self.path, error))
+      return
+    if not any(len(self.store.get(label)) for label in self.store.labels()):
+      self.finish('No model draw information in %s' % self.path)
+      return
+    if not self.register:
+      self.transform(numpy.eye(4))
+    elif not volumes:
+      self.warning = 'No scalar volume in %s\nControl points were imported without registration' % self.path
+      self.transform(numpy.eye(4))
+    else:
+      self.startRegistration(volumes[-1])
+
+  def startRegistration(self,path):
+    fixedNode = self.logic.sliceLogic.GetBackgroundLayer().GetVolumeNode()
+    if not fixedNode:
+      self.warning = 'No background volume to register %s to\nControl points were imported without registration' % path
+      self.transform(numpy.eye(4))
+      return
+    # volumes are read on the main thread, so show the message before it blocks
+    self.progress('Loading %s (Slicer is busy until it is loaded)' % os.path.basename(path), 0, 0)
+    slicer.app.processEvents()
+    if self.cancelled:
+      return
+    loaded, movingNode = slicer.util.loadVolume(path, {'name': 'ModelDrawReference'}, returnNode=True)
+    if not loaded:
+      self.warning = 'Could not import %s\nControl points were imported without registration' % path
+      self.transform(numpy.eye(4))
+      return
+    self.transformNode = slicer.vtkMRMLLinearTransformNode()
+    self.transformNode.SetName('ReferenceToSubject')
+    slicer.mrmlScene.AddNode(self.transformNode)
+    parameters = {
+      'fixedVolume': fixedNode.GetID(),
+      'movingVolume': movingNode.GetID(),
+      'linearTransform': self.transformNode.GetID(),
+      'useRigid': True,
+      'useAffine': True,
+    }
+    self.progress('Registering', 0, 100)
+    self.cliNode = slicer.cli.run(slicer.modules.brainsfit, None, parameters, wait_for_completion=False)
+    self.cliTag = self.cliNode.AddObserver(vtk.vtkCommand.ModifiedEvent, self.onRegistrationModified)
+
+  def onRegistrationModified(self,caller,event):
+    status = self.cliNode.GetStatusString()
+    if status == 'Completed':
+      matrix = self.transformNode.GetMatrixTransformToParent()
+      self.transform(numpy.array([[matrix.GetElement(row,column) for column in range(4)] for row in range(4)]))
+    elif status in ('Cancelled', 'Completed with errors'):
+      self.finish('Registration %s' % status.lower())
+    else:
+      self.progress('Registering (%s)' % status, int(self.cliNode.GetProgress()), 100)
+
+  def transform(self,matrix):
+    """
+    move the imported points into place and replace the scene's control points
+    """
+    self.progress('Transforming control points', 0, 0)
+    self.store.transform(matrix, self.logic.sliceAxes()[2], self.logic.sliceSpacing(), self.logic.offset())
+    target = self.logic.controlPointStore()
+    imported = self.store.labels()
+    for label in target.labels():
+      if label not in imported:
+        target.set(label, {})
+    for label in imported:
+      target.set(label, self.store.get(label))
+    self.finish(self.warning)
+
+
+#
+# ModelDrawEffectLogic
+#
+
+def rasToIJKArray(node):
+  """
+  the RAS to IJK matrix of a volume node as a (4,4) array
+  """
+  matrix = vtk.vtkMatrix4x4()
+  node.GetRASToIJKMatrix(matrix)
+  return numpy.array([[matrix.GetElement(row,column) for column in range(4)] for row in range(4)])
+
+
+def polyDataFromArrays(points,triangles,normals,polyData=None):
+  """
+  fill a vtkPolyData (a new one if not given) with the (N,3) points,
+  (T,3) triangles and (N,3) point normals
+  """
+  from vtk.util import numpy_support
+  if polyData is None:
+    polyData = vtk.vtkPolyData()
+  vtkPoints = vtk.vtkPoints()
+  vtkPoints.SetData(numpy_support.numpy_to_vtk(numpy.ascontiguousarray(points, dtype='float32'), deep=1))
+  idType = 'int64' if vtk.vtkIdTypeArray().GetDataTypeSize() == 8 else 'int32'
+  cells = numpy.column_stack((numpy.full(len(triangles), 3), triangles)).astype(idType).ravel()
+  polys = vtk.vtkCellArray()
+  polys.SetCells(len(triangles), numpy_support.numpy_to_vtkIdTypeArray(cells, deep=1))
+  vtkNormals = numpy_support.numpy_to_vtk(numpy.ascontiguousarray(normals, dtype='float32'), deep=1)
+  vtkNormals.SetName('Normals')
+  polyData.SetPoints(vtkPoints)
+  polyData.SetPolys(polys)
+  polyData.GetPointData().SetNormals(vtkNormals)
+  polyData.Modified()
+  return polyData
+
+
+class ModelDrawEffectLogic(ModelDrawEffectCore.ModelDrawEngine, LabelEffect.LabelEffectLogic):
+  """
+  This class contains helper methods for a given effect
+  type.  It can be instanced as needed by an ModelDrawEffectTool
+  or ModelDrawEffectOptions instance in order to compute intermediate
+  results (say, for user feedback) or to implement the final
+  segmentation editing operation.  This class is split
+  from the ModelDrawEffectTool so that the operations can be used
+  by other code without the need for a view context.
+  The curve work is done by ModelDrawEngine; this class supplies it with
+  the slice geometry, volumes, label and parameter node of the view.
+  The views share the control point store of the scene and a ContourModel
+  per label, so an edit in one view is seen (and computed once) in all.
+  """
+
+  # shared by the instances of every view: the store of the "ModelDraw"
+  # node with its autosave journal, the ContourModel of each label and
+  # the surface model nodes
+  sharedStore = None
+  sharedAutosave = None
+  # the autosave journal whose failure was reported to the user
+  failedAutosave = None
+  contourModels = {}
+  modelNodes = {}
+
+  def __init__(self,sliceLogic):
+    ModelDrawEffectCore.ModelDrawEngine.__init__(self)
+    self.sliceLogic = sliceLogic
+    # curves of the slices ahead are computed while the view scrolls
+    self.prefetcher = ModelDrawEffectCore.ContourPrefetcher(self)
+
+  def apply(self,xy):
+    """
+    add a control point at the xy position on the current slice
+    and recompute the curve for that slice
+    """
+    offset = self.offset()
+    count = len(self.controlPoints.get(offset, ()))
+    self.insertControlPoint(count, self.xyToRAS(xy)[:3], offset)
+
+  def modelDrawNode(self):
+    """
+    the scene's "ModelDraw" parameter node, created if needed
+    """
+    scene = slicer.mrmlScene
+    for index in range(scene.GetNumberOfNodesByClass('vtkMRMLScriptedModuleNode')):
+      node = scene.GetNthNodeByClass(index, 'vtkMRMLScriptedModuleNode')
+      if node.GetModuleName() == "ModelDraw":
+        return node
+    node = slicer.vtkMRMLScriptedModuleNode()
+    node.SetModuleName("ModelDraw")
+    scene.AddNode(node)
+    return node
+
+  def controlPointStore(self):
+    """
+    control points are persisted in the scene's "ModelDraw" node, through
+    one store for all views (a new scene starts a new store and models)
+    """
+    node = self.modelDrawNode()
+    # record the volume the points are drawn on, which gives the batch
+    # rasterizer the label geometry (see readSceneVolumes)
+    background = self.sliceLogic.GetBackgroundLayer().GetVolumeNode()
+    if background and node.GetAttribute(ModelDrawEffectCore.backgroundAttribute) != background.GetID():
+      node.SetAttribute(ModelDrawEffectCore.backgroundAttribute, background.GetID())
+    store = ModelDrawEffectLogic.sharedStore
+    if store is None or store.node is not node:
+      store = ModelDrawEffectLogic.sharedStore = ModelDrawEffectCore.ControlPointStore(node)
+      ModelDrawEffectLogic.contourModels = {}
+      if ModelDrawEffectLogic.sharedAutosave:
+        ModelDrawEffectLogic.sharedAutosave.close()
+      ModelDrawEffectLogic.sharedAutosave = self.startAutosave(store)
+    self.autosave = ModelDrawEffectLogic.sharedAutosave
+    return store
+
+  def autosaveDirectory(self):
+    """
+    where the control points of the case are autosaved: a directory of
+    the temporary path named after the scene file together with the file
+    of the background volume, so that reopening the case finds it again
+    """
+    node = self.sliceLogic.GetBackgroundLayer().GetVolumeNode()
+    volume = ''
+    if node:
+      storageNode = node.GetStorageNode()
+      volume = storageNode.GetFileName() if storageNode and storageNode.GetFileName() else node.GetName()
+    key = '%s\n%s' % (slicer.mrmlScene.GetURL() or '', volume)
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(slicer.app.temporaryPath, 'ModelDrawAutosave', digest)
+
+  def startAutosave(self,store):
+    """
+    offer to restore the autosaved edits of the case when they are newer
+    than the scene file (lost by a crash, or not saved), then start
+    journaling the edits
+    """
+    autosave = ModelDrawEffectCore.AutosaveJournal(self.autosaveDirectory())
+    edited = autosave.lastEdit()
+    sceneFile = slicer.mrmlScene.GetURL()
+    saved = os.path.getmtime(sceneFile) if sceneFile and os.path.exists(sceneFile) else 0
+    if edited and edited > saved and self.confirmRecovery(edited):
+      for label, controlPoints in autosave.recover().items():
+        store.set(label, controlPoints)
+    autosave.start(store.parameters())
+    return autosave
+
+  def autosaveEdit(self,edit,offset):
+    """
+    journal the edit, warning once if the autosave writer has failed
+    """
+    ModelDrawEffectCore.ModelDrawEngine.autosaveEdit(self, edit, offset)
+    autosave = self.autosave
+    if autosave is not None and autosave.error is not None and autosave is not ModelDrawEffectLogic.failedAutosave:
+      ModelDrawEffectLogic.failedAutosave = autosave
+      qt.QMessageBox.warning(slicer.util.mainWindow(), "ModelDraw Autosave",
+          "Autosaving the control points failed:\n\n%s\n\n"
+          "Save the scene to keep your edits." % autosave.error)
+
+  def confirmRecovery(self,edited):
+    """
+    ask whether to restore the control points autosaved at time edited
+    """
+    answer = qt.QMessageBox.question(slicer.util.mainWindow(), "ModelDraw Autosave",
+        "ModelDraw control points edited on %s were not saved with the scene.\n"
+        "Restore them? Otherwise they are discarded." % time.ctime(edited),
+        qt.QMessageBox.Yes | qt.QMessageBox.No)
+    return answer == qt.QMessageBox.Yes
+
+  def contourModel(self,label):
+    """
+    the ContourModel of label shared by the views
+    """
+    self.store = self.controlPointStore()
+    model = self.contourModels.get(label)
+    if model is None:
+      model = ModelDrawEffectCore.ContourModel(label, self.store.get(label))
+      self.contourModels[label] = model
+    return model
+
+  def reloadControlPoints(self):
+    """
+    reread the control points of every label the views share
+    """
+    self.store = self.controlPointStore()
+    for label, model in list(self.contourModels.items()):
+      model.load(self.store.get(label))
+      model.changed(self)
+    self.autosave.snapshot(self.store.parameters())
+
+  def defaultLabel(self):
+    """
+    the Editor's current paint label
+    """
+    return EditUtil.EditUtil().getLabel()
+
+  def offset(self):
+    """
+    the current slice offset, rounded to avoid roundoff issues
+    caused by the slice controllers (offsets are used as keys)
+    """
+    return round(self.sliceLogic.GetSliceOffset(), 2)
+
+  def pixelSize(self):
+    """
+    size in mm of a pixel of the slice view
+    """
+    xyToRAS = self.sliceLogic.GetSliceNode().GetXYToRAS()
+    return numpy.sqrt(sum(xyToRAS.GetElement(row,0) ** 2 for row in range(3)))
+
+  def rasToXYArray(self,ras):
+    """
+    slice view xyz coordinates of the (N,3) RAS points
+    """
+    xyToRAS = self.sliceLogic.GetSliceNode().GetXYToRAS()
+    matrix = numpy.array([[xyToRAS.GetElement(row,column) for column in range(4)] for row in range(4)])
+    rasToXY = numpy.linalg.inv(matrix)
+    ras = numpy.asarray(ras, dtype='float64').reshape(-1,3)
+    return numpy.dot(ras, rasToXY[:3,:3].T) + rasToXY[:3,3]
+
+  def sliceSpacing(self):
+    """
+    distance between slices of the volumes in the view
+    """
+    return self.sliceLogic.GetLowestVolumeSliceSpacing()[2]
+
+  def workerExecutable(self):
+    """
+    worker processes started from Slicer's own executable would start the
+    application (or fork the whole Qt process), so they run the bundled
+    PythonSlicer interpreter - or threads, in a build without one
+    """
+    name = 'PythonSlicer.exe' if os.name == 'nt' else 'PythonSlicer'
+    path = os.path.join(slicer.app.slicerHome, 'bin', name)
+    return path if os.path.exists(path) else False
+
+  def labelVolume(self):
+    """
+    the label volume node, a writable view of its array (indexed k,j,i)
+    and its RAS to IJK matrix
+    """
+    node = self.sliceLogic.GetLabelLayer().GetVolumeNode()
+    return node, slicer.util.array(node.GetID()), rasToIJKArray(node)
+
+  def sliceAxes(self):
+    """
+    unit row, column and normal directions of the slice plane in RAS
+    """
+    sliceToRAS = self.sliceLogic.GetSliceNode().GetSliceToRAS()
+    axes = numpy.array([[sliceToRAS.GetElement(row,column) for row in range(3)] for column in range(3)])
+    return axes / numpy.sqrt((axes * axes).sum(axis=1))[:,numpy.newaxis]
+
+  def backgroundEntry(self):
+    """
+    the backgroundVolumeCache entry of the background volume, revalidated
+    against the node and image data MTimes
+    """
+    node = self.sliceLogic.GetBackgroundLayer().GetVolumeNode()
+    mtime = max(node.GetMTime(), node.GetImageData().GetMTime())
+    load = lambda: (slicer.util.array(node.GetID()), rasToIJKArray(node), node.GetSpacing())
+    return ModelDrawEffectCore.backgroundVolumeCache.get(node.GetID(), mtime, load)
+
+  def surfaceModelNode(self):
+    """
+    the model node showing the surface of the current label, created if needed
+    """
+    node = self.modelNodes.get(self.label)
+    if node is None or not slicer.mrmlScene.IsNodePresent(node):
+      displayNode = slicer.vtkMRMLModelDisplayNode()
+      slicer.mrmlScene.AddNode(displayNode)
+      node = slicer.vtkMRMLModelNode()
+      node.SetName('ModelDraw-%s' % self.label)
+      node.SetAndObservePolyData(vtk.vtkPolyData())
+      slicer.mrmlScene.AddNode(node)
+      node.SetAndObserveDisplayNodeID(displayNode.GetID())
+      self.modelNodes[self.label] = node
+    return node
+
+  def updateSurfaceModel(self):
+    """
+    rebuild the surface model of the current label from its curves
+    """
+    points, triangles, normals = self.surface()
+    node = self.surfaceModelNode()
+    polyDataFromArrays(points, triangles, normals, node.GetPolyData())
+    node.Modified()
+    return node
+
+
+#
+# The ModelDrawEffect class definition
+#
+
+class ModelDrawEffectExtension(LabelEffect.LabelEffect):
+  """Organizes the Options, Tool, and Logic classes into a single instance
+  that can be managed by the EditBox
+  """
+
+  def __init__(self):
+    # name is used to define the name of the icon image resource (e.g. ModelDrawEffect.png)
+    self.name = "ModelDrawEffect"
+    # tool tip is displayed on mouse hover
+    self.toolTip = "Paint: circular paint brush for label map editing"
+
+    self.options = ModelDrawEffectOptions
+    self.tool = ModelDrawEffectTool
+    self.logic = ModelDrawEffectLogic
@@ -0,0 +1,252 @@
+"""
+Benchmarks of the ModelDrawEffect hot paths on synthetic phantoms.
+
+Only ModelDrawEffectCore is used, so no views or Slicer are needed; run it
+with any python that has NumPy and the module directory on its path:
+
+  python ModelDrawEffectBenchmark.py --sizes small medium --output baseline.json
+  python ModelDrawEffectBenchmark.py --compare baseline.json
+
+Results are written as JSON; with --compare the median timings are checked
+against a previous run and the script exits with status 1 if any benchmark
+got slower than the allowed tolerance.
+"""
+
+import sys
+import json
+import time
+import argparse
+import platform
+import numpy
+
+import ModelDrawEffectCore
+
+# phantom volume shapes (slices, rows, columns)
+SIZES = {
+  'small': (64, 64, 64),
+  'medium': (200, 256, 256),
+  'large': (600, 512, 512),
+}
+
+
+#
+# Phantoms
+#
+
+class Phantom:
+  """
+  A volume with a known ellipsoidal object, its RAS to IJK matrix
+  and a label map of the same geometry.
+  """
+
+  def __init__(self,shape,spacing=(1.,1.,1.),radii=None,noise=0.,seed=0):
+    self.shape = shape
+    self.spacing = numpy.array(spacing, dtype='float64')
+    extent = numpy.array(shape[::-1]) * self.spacing
+    self.center = 0.5 * extent
+    if radii is None:
+      radii = 0.35 * extent
+    self.radii = numpy.array(radii, dtype='float64')
+    self.rasToIJK = numpy.diag(tuple(1. / self.spacing) + (1.,))
+
+    # build the volume a slice at a time to bound the temporary memory
+    random = numpy.random.RandomState(seed)
+    self.volume = numpy.empty(shape, dtype='float32')
+    j, i = numpy.mgrid[0:shape[1], 0:shape[2]]
+    for k in range(shape[0]):
+      ras = numpy.array((i, j, numpy.full_like(i, k)), dtype='float64') * self.spacing[:,numpy.newaxis,numpy.newaxis]
+      distance = (((ras - self.center[:,numpy.newaxis,numpy.newaxis]) / self.radii[:,numpy.newaxis,numpy.newaxis]) ** 2).sum(axis=0)
+      self.volume[k] = numpy.where(distance < 1., 100., 0.)
+      if noise:
+        self.volume[k] += random.normal(0., noise, size=distance.shape)
+    self.label = numpy.zeros(shape, dtype='int16')
+
+  def contour(self,s,pointCount):
+    """
+    (pointCount,3) RAS points on the object's outline on the axial plane at s
+    """
+    scale = numpy.sqrt(max(1. - ((s - self.center[2]) / self.radii[2]) ** 2, 0.01))
+    angles = numpy.linspace(0, 2*numpy.pi, pointCount, endpoint=False)
+    return numpy.column_stack((self.center[0] + scale * self.radii[0] * numpy.cos(angles),
+                               self.center[1] + scale * self.radii[1] * numpy.sin(angles),
+                               numpy.full(pointCount, s)))
+
+
+class PhantomLogic(ModelDrawEffectCore.ModelDrawEngine):
+  """
+  Engine whose background, label map and axial slice geometry come from
+  a Phantom.
+  """
+
+  def __init__(self,phantom):
+    ModelDrawEffectCore.ModelDrawEngine.__init__(self)
+    self.phantom = phantom
+    self.background = ModelDrawEffectCore.CachedVolume(0, phantom.volume, phantom.rasToIJK, phantom.spacing)
+    self.labelArray = phantom.label
+    self.labelRASToIJK = phantom.rasToIJK
+    self.spacing = phantom.spacing[2]
+
+
+#
+# Benchmarks
+#
+
+def timeit(function,repeat,setup=None):
+  """
+  run function repeat times and return the timings in seconds;
+  setup, if given, is called untimed before each run
+  """
+  timings = []
+  for iteration in range(repeat):
+    if setup:
+      setup()
+    start = time.perf_counter()
+    function()
+    timings.append(time.perf_counter() - start)
+  return timings
+
+
+def benchmarks(phantom,pointCount):
+  """
+  (name, function, setup) triples timing the hot paths on the phantom
+  """
+  logic = PhantomLogic(phantom)
+  middle = phantom.center[2]
+  controlPoints = phantom.contour(middle, pointCount)
+  curve = logic.curve(controlPoints)
+
+  # defined slices spread through the object for interpolation and apply
+  offsets = numpy.round(numpy.linspace(middle - 0.6 * phantom.radii[2], middle + 0.6 * phantom.radii[2], 5) / phantom.spacing[2]) * phantom.spacing[2]
+  stack = numpy.array([phantom.contour(offset, pointCount) for offset in offsets])
+  targets = numpy.arange(offsets[0], offsets[-1] + phantom.spacing[2] / 2., phantom.spacing[2])
+
+  def splines():
+    logic.curve(controlPoints)
+
+  def snap():
+    logic.snapCurve(curve, pointCount, numpy.array((0,0,1.)), phantom.volume, phantom.rasToIJK)
+
+  # dragging a control point resnaps only the samples of the segments it reaches
+  snapped = logic.snapCurve(curve, pointCount, numpy.array((0,0,1.)), phantom.volume, phantom.rasToIJK)
+  steps = (len(curve) - 1) // pointCount
+  changed = numpy.arange(-3 * steps, 2 * steps) % (len(curve) - 1)
+
+  def snapEdit():
+    logic.snapCurve(curve, pointCount, numpy.array((0,0,1.)), phantom.volume, phantom.rasToIJK,
+                    samples=changed, previous=snapped)
+
+  def snapSmooth():
+    logic.snapMode = 'smooth'
+    try:
+      logic.snapCurve(curve, pointCount, numpy.array((0,0,1.)), phantom.volume, phantom.rasToIJK)
+    finally:
+      logic.snapMode = 'independent'
+
+  def tangents():
+    logic.backgroundEntry().tangents.clear()
+    logic.estimateEdgeTangents(controlPoints)
+
+  def interpolation():
+    logic.interpolateStack(stack, offsets, targets, (0,0,1.))
+
+  def reset():
+    # every apply starts from an empty label map and undo journal, rather
+    # than overwriting the previous run's fill and growing its journal
+    phantom.label[:] = 0
+    logic.journal = ModelDrawEffectCore.UndoJournal()
+
+  def rasterize():
+    logic.applyCurve(curve, 1, True, None, phantom.label, phantom.rasToIJK)
+
+  def resetStack():
+    # load the defined slices through the label's model, which also drops
+    # the curves cached by the previous run
+    reset()
+    logic.model.load(dict((round(offset, 2), points) for offset, points in zip(offsets, stack)))
+    logic.model.changed(logic)
+
+  def multiSliceApply():
+    logic.applyCurves(label=1)
+
+  return (
+    ('splines', splines, None),
+    ('snap', snap, None),
+    ('snapEdit', snapEdit, None),
+    ('snapSmooth', snapSmooth, None),
+    ('tangents', tangents, None),
+    ('interpolation', interpolation, None),
+    ('rasterize', rasterize, reset),
+    ('multiSliceApply', multiSliceApply, resetStack),
+  )
+
+
+def phantoms(size):
+  """
+  (name, Phantom) pairs for a size: a sphere, a noisy ellipsoid and an
+  ellipsoid on anisotropic voxels
+  """
+  shape = SIZES[size]
+  yield 'sphere', Phantom(shape)
+  yield 'noisyEllipsoid', Phantom(shape, radii=numpy.array(shape[::-1]) * (0.4, 0.3, 0.25), noise=20.)
+  yield 'anisotropic', Phantom((max(shape[0] // 4, 16),) + shape[1:], spacing=(0.8, 0.8, 4.))
+
+
+def run(sizes,pointCount,repeat):
+  results = {}
+  for size in sizes:
+    for phantomName, phantom in phantoms(size):
+      for benchmarkName, function, setup in benchmarks(phantom, pointCount):
+        timings = timeit(function, repeat, setup)
+        name = '%s/%s/%s' % (size, phantomName, benchmarkName)
+        results[name] = {'median': float(numpy.median(timings)), 'min': min(timings), 'repeat': repeat}
+        print('%-45s median %9.4f s  min %9.4f s' % (name, results[name]['median'], results[name]['min']))
+  return {
+    'version': 1,
+    'pointCount': pointCount,
+    'environment': {'python': platform.python_version(), 'numpy': numpy.__version__, 'machine': platform.machine()},
+    'results': results,
+  }
+
+
+def compare(report,baseline,tolerance):
+  """
+  names of the benchmarks whose median is more than tolerance slower than the baseline
+  """
+  regressions = []
+  for name, result in sorted(report['results'].items()):
+    if name not in baseline['results']:
+      continue
+    reference = baseline['results'][name]['median']
+    ratio = result['median'] / reference if reference else 1.
+    flag = ''
+    if ratio > 1. + tolerance:
+      regressions.append(name)
+      flag = '  REGRESSION'
+    print('%-45s %6.2fx baseline%s' % (name, ratio, flag))
+  return regressions
+
+
+def main(argv):
+  parser = argparse.ArgumentParser(description='Benchmark the ModelDrawEffect hot paths on synthetic phantoms.')
+  parser.add_argument('--sizes', nargs='+', choices=sorted(SIZES.keys()), default=['small'])
+  parser.add_argument('--points', type=int, default=200, help='control points per contour')
+  parser.add_argument('--repeat', type=int, default=5)
+  parser.add_argument('--output', help='write the results to this JSON file')
+  parser.add_argument('--compare', help='baseline JSON file to compare the results against')
+  parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown as a fraction of the baseline')
+  args = parser.parse_args(argv)
+
+  report = run(args.sizes, args.points, args.repeat)
+  if args.output:
+    with open(args.output, 'w') as fp:
+      json.dump(report, fp, indent=2, sort_keys=True)
+  if args.compare:
+    with open(args.compare) as fp:
+      baseline = json.load(fp)
+    if compare(report, baseline, args.tolerance):
+      return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,717 @@
+"""
+Unit tests of the ModelDrawEffect curve engine and its headless tools.
+
+They need neither Slicer nor its views and run with any Python that has
+NumPy and the module directory on its path, for example:
+
+  python -m unittest ModelDrawEffectCoreTest
+  Slicer --no-main-window --python-script ModelDrawEffectCoreTest.py
+
+The tests of the effect in the Editor are in ModelDrawEffect.py.
+"""
+
+import sys
+import unittest
+import numpy
+
+import ModelDrawEffectCore
+
+
+#
+# Fixtures
+#
+
+def noisyDisk(noise,seed,slices=5,size=64,radius=20.,wave=0.,lobes=6):
+  """
+  float32 volume (indexed k,j,i) of slices with a bright disk of radius
+  centered in each, in Gaussian noise; RAS equals IJK. With a wave the
+  edge swings wave mm in and out of the radius, lobes times around.
+  """
+  random = numpy.random.RandomState(seed)
+  j, i = numpy.mgrid[0:size, 0:size]
+  center = size / 2.
+  edge = radius + wave * numpy.sin(lobes * numpy.arctan2(j - center, i - center))
+  disk = numpy.where((i - center) ** 2 + (j - center) ** 2 < edge ** 2, 100., 0.)
+  return numpy.array([disk] * slices, dtype='float32') + random.normal(0., noise, (slices,size,size)).astype('float32')
+
+
+def circle(count,radius=20.,center=32.,offset=2.):
+  """
+  (count,3) points evenly spaced on a circle in the axial plane at offset,
+  by default on the edge of the noisyDisk
+  """
+  angles = numpy.linspace(0, 2*numpy.pi, count, endpoint=False)
+  return numpy.column_stack((center + radius * numpy.cos(angles), center + radius * numpy.sin(angles), numpy.full(count, offset)))
+
+
+class ParameterNode:
+  """
+  the parameters of a vtkMRMLScriptedModuleNode, which is all the
+  ControlPointStore reads and writes
+  """
+
+  def __init__(self):
+    self.parameters = {}
+
+  def GetParameter(self,name):
+    return self.parameters.get(name, '')
+
+  def SetParameter(self,name,value):
+    self.parameters[name] = value
+
+  def GetParameterNamesAsCommaSeparatedList(self):
+    return ','.join(self.parameters)
+
+
+#
+# Tests
+#
+
+class ModelDrawEffectCoreTest(unittest.TestCase):
+  """
+  Tests of the curve engine, the control point store and journals,
+  and the batch rasterizer.
+  """
+
+  def test_ModelDrawEffectCurves(self):
+    """
+    This tests the curve engine on control points around a circle
+    """
+    logic = ModelDrawEffectCore.ModelDrawEngine()
+    angles = numpy.linspace(0, 2*numpy.pi, 8, endpoint=False)
+    controlPoints = numpy.column_stack((10*numpy.cos(angles), 10*numpy.sin(angles), numpy.zeros(8)))
+    tangents = numpy.column_stack((-numpy.sin(angles), numpy.cos(angles), numpy.zeros(8)))
+
+    for interpolation,edgeTangents,tolerance in (('linear',None,1.), ('spline',None,0.1), ('spline',tangents,0.5)):
+      logic.interpolation = interpolation
+      curve = logic.curve(controlPoints, edgeTangents)
+      self.assertEqual(curve.shape, (8 * logic.splineSteps + 1, 3))
+      # the curve passes through every control point and is closed
+      self.assertTrue(numpy.allclose(curve[::logic.splineSteps][:-1], controlPoints))
+      self.assertTrue(numpy.allclose(curve[0], curve[-1]))
+      radii = numpy.sqrt((curve[:,:2] ** 2).sum(axis=1))
+      self.assertTrue(abs(radii - 10).max() < tolerance)
+
+    self.assertEqual(logic.curve(controlPoints[:1]).shape, (0,3))
+
+  def test_ModelDrawEffectRasterize(self):
+    """
+    This tests filling curves into a label array
+    """
+    logic = ModelDrawEffectCore.ModelDrawEngine()
+    labelArray = numpy.zeros((4,32,32), dtype='int16')
+    labelArray[2,0,0] = 5
+
+    # a square from 4.5 to 9.5 covers pixel centers 5 through 9 on slice k=2
+    square = numpy.array(((4.5,4.5,2), (9.5,4.5,2), (9.5,9.5,2), (4.5,9.5,2), (4.5,4.5,2)))
+    self.assertTrue(logic.applyCurve(square, label=5, erase=False, labelArray=labelArray, rasToIJK=numpy.eye(4)))
+    self.assertEqual((labelArray[2] == 5).sum(), 26)
+    self.assertTrue((labelArray[2,5:10,5:10] == 5).all())
+
+    self.assertTrue(logic.applyCurve(square, label=5, erase=True, labelArray=labelArray, rasToIJK=numpy.eye(4)))
+    self.assertEqual((labelArray == 5).sum(), 25)
+
+    # circle drawn into a sagittal (i) plane
+    angles = numpy.linspace(0, 2*numpy.pi, 65)
+    ellipse = numpy.column_stack((numpy.ones(65), 16 + 10*numpy.cos(angles), 2 + 1.4*numpy.sin(angles)))
+    self.assertTrue(logic.applyCurve(ellipse, label=7, labelArray=labelArray, rasToIJK=numpy.eye(4)))
+    self.assertTrue((labelArray[2,7:26,1] == 7).all())
+    self.assertTrue((labelArray[1:4,12:21,1] == 7).all())
+    self.assertFalse((labelArray[:,:,(0,2)] == 7).any())
+
+  def test_ModelDrawEffectInterpolate(self):
+    """
+    This tests interpolating control points between slices of a cone
+    """
+    logic = ModelDrawEffectCore.ModelDrawEngine()
+    unit = circle(6, 1., 0., 0.)
+    offsets = numpy.array((0., 10., 20.))
+    radii = numpy.array((10., 15., 20.))
+    stack = radii[:,numpy.newaxis,numpy.newaxis] * unit + offsets[:,numpy.newaxis,numpy.newaxis] * (0,0,1)
+
+    targets = (-1., 0., 5., 12.5, 20., 21.)
+    points = logic.interpolateStack(stack, offsets, targets, (0,0,1))
+    self.assertEqual(points.shape, (6,6,3))
+    self.assertTrue(numpy.isnan(points[(0,5),]).all())
+    for target, slicePoints in zip(targets[1:5], points[1:5]):
+      self.assertTrue(numpy.allclose(slicePoints[:,2], target))
+      self.assertTrue(numpy.allclose(slicePoints, (10 + target / 2.) * unit + (0,0,target)))
+
+  def test_ModelDrawEffectStore(self):
+    """
+    This tests round trips of control points through the parameter node
+    """
+    node = ParameterNode()
+    node.SetParameter("3", "12.00 {{1 2 12} {4 5 12.0} {7 8 12}} -3.50 {{0 0 -3.5}}")
+
+    store = ModelDrawEffectCore.ControlPointStore(node)
+    legacy = store.get(3)
+    self.assertEqual(sorted(legacy.keys()), [-3.5, 12.])
+    self.assertTrue(numpy.allclose(legacy[12.], ((1,2,12), (4,5,12), (7,8,12))))
+
+    legacy[20.] = numpy.arange(30.).reshape(10,3)
+    store.set(3, legacy)
+    self.assertTrue(node.GetParameter("3").startswith(ModelDrawEffectCore.ControlPointStore.version))
+
+    reloaded = ModelDrawEffectCore.ControlPointStore(node).get(3)
+    self.assertEqual(sorted(reloaded.keys()), [-3.5, 12., 20.])
+    for offset in legacy:
+      self.assertTrue(numpy.array_equal(reloaded[offset], legacy[offset]))
+    self.assertEqual(ModelDrawEffectCore.ControlPointStore(node).get(4), {})
+
+  def test_ModelDrawEffectProfiler(self):
+    """
+    This tests recording stage timings and their summaries
+    """
+    profiler = ModelDrawEffectCore.StageProfiler(capacity=16)
+    with profiler.stage('idle'):
+      pass
+    self.assertEqual(profiler.count, 0)
+
+    profiler.enabled = True
+    for index in range(20):
+      with profiler.stage('even' if index % 2 == 0 else 'odd'):
+        pass
+    summary = profiler.summary()
+    # only the newest 16 records are kept
+    self.assertEqual(sorted(summary.keys()), ['even', 'odd'])
+    self.assertEqual(summary['even']['count'] + summary['odd']['count'], 16)
+    self.assertTrue(summary['odd']['p50'] <= summary['odd']['p95'] <= summary['odd']['p99'] <= summary['odd']['max'])
+
+    import json, os, tempfile
+    path = os.path.join(tempfile.mkdtemp(), 'trace.json')
+    profiler.dumpChromeTrace(path)
+    with open(path) as fp:
+      events = json.load(fp)['traceEvents']
+    self.assertEqual(len(events), 16)
+    self.assertEqual(set(event['ph'] for event in events), set(('X',)))
+
+    # durations come from the monotonic clock, start times in the JSON
+    # dump are seconds since the epoch
+    import time
+    profiler.dump(path)
+    with open(path) as fp:
+      events = json.load(fp)['events']
+    self.assertTrue(all(abs(event['start'] - time.time()) < 60. for event in events))
+
+  def test_ModelDrawEffectSmoothSnap(self):
+    """
+    This tests the smooth snap path search on synthetic costs and a noisy disk
+    """
+    logic = ModelDrawEffectCore.ModelDrawEngine()
+    logic.snapMaxStep = 1.
+    logic.snapSmoothness = 0.
+    # the cheapest offset of each row jumps around, but the path may
+    # only move one offset per row, and must close back to its start
+    offsets = numpy.tile(numpy.arange(5.), (8,1))
+    weights = numpy.ones((8,5))
+    weights[numpy.arange(8), (0,4,0,4,2,2,2,2)] = 0.
+    path = logic.snapPath(weights, offsets)
+    self.assertTrue((numpy.abs(numpy.diff(offsets[numpy.arange(8), path])) <= 1).all())
+    self.assertTrue(abs(path[0] - path[-1]) <= 1)
+    self.assertEqual(list(path[4:7]), [2,2,2])
+
+    # a disk in noise, drawn through control points on its edge
+    volume = noisyDisk(25., 0)
+    curve = logic.curve(circle(12))
+    errors = {}
+    for mode in ('independent', 'smooth'):
+      logic.snapMode = mode
+      logic.snapSmoothness = 0.5
+      confidence = numpy.zeros(len(curve) - 1)
+      snapped = logic.snapCurve(curve, 12, (0,0,1), volume, numpy.eye(4), confidence=confidence)
+      self.assertTrue(((confidence >= 0) & (confidence <= 1)).all())
+      radii = numpy.sqrt(((snapped[:,:2] - 32.) ** 2).sum(axis=1))
+      errors[mode] = numpy.abs(radii - 20.).mean()
+    self.assertTrue(errors['smooth'] < errors['independent'])
+
+    # a circle through control points on the edge of a wavy disk is off the
+    # edge by different amounts around it, up to 4mm: more than the fine
+    # search reaches, so the coarse path has to follow the edge
+    volume = noisyDisk(10., 1, wave=4.)
+    logic.snapMode = 'smooth'
+    snapped = logic.snapCurve(curve, 12, (0,0,1), volume, numpy.eye(4))
+    radii = numpy.sqrt(((snapped[:,:2] - 32.) ** 2).sum(axis=1))
+    edge = 20. + 4. * numpy.sin(6 * numpy.arctan2(snapped[:,1] - 32., snapped[:,0] - 32.))
+    self.assertTrue(numpy.abs(radii - edge).mean() < 1.)
+    self.assertTrue(numpy.abs(radii - edge).max() < 2.)
+
+  def test_ModelDrawEffectSurface(self):
+    """
+    This tests the closed surface built through the curves of a sphere
+    """
+    logic = ModelDrawEffectCore.ModelDrawEngine()
+    angles = numpy.linspace(0, 2*numpy.pi, 10, endpoint=False)
+    for offset in range(-16, 17, 4):
+      radius = numpy.sqrt(20. ** 2 - offset ** 2)
+      # start each slice at a different angle so the rings need aligning
+      controlPoints = numpy.column_stack((radius * numpy.cos(angles + offset),
+                                          radius * numpy.sin(angles + offset), numpy.full(10, float(offset))))
+      logic.controlPoints[float(offset)] = controlPoints
+    points, triangles, normals = logic.surface()
+    self.assertEqual(logic.contourSurface.rebuilt, 8)
+
+    # closed and consistently oriented: every directed edge appears once
+    # and so does its reverse
+    edges = numpy.vstack((triangles[:,(0,1)], triangles[:,(1,2)], triangles[:,(2,0)]))
+    edgeSet = set(map(tuple, edges))
+    self.assertEqual(len(edgeSet), len(edges))
+    self.assertTrue(all((b, a) in edgeSet for a, b in edgeSet))
+    # normals point outward and the enclosed volume is close to the
+    # sphere's between the end slices
+    self.assertTrue(((points * normals).sum(axis=1) > 0).all())
+    volume = (points[triangles[:,0]] * numpy.cross(points[triangles[:,1]], points[triangles[:,2]])).sum() / 6.
+    expected = numpy.pi * (2 * 20. ** 2 * 16 - 2 * 16. ** 3 / 3.)
+    self.assertTrue(abs(volume - expected) < 0.05 * expected)
+
+    # editing one slice rebuilds only the two bands next to it
+    logic.moveControlPoint(0, logic.controlPoints[0.][0] * 1.1, offset=0.)
+    logic.surface()
+    self.assertEqual(logic.contourSurface.rebuilt, 2)
+
+  def test_ModelDrawEffectIndex(self):
+    """
+    This tests the hit-testing indexes against brute force while points
+    are inserted, moved and deleted
+    """
+    logic = ModelDrawEffectCore.ModelDrawEngine()
+    rng = numpy.random.RandomState(17)
+    for index in range(40):
+      logic.insertControlPoint(rng.randint(index + 1), numpy.append(rng.uniform(-50, 50, 2), 0.))
+    for index in range(10):
+      logic.moveControlPoint(rng.randint(40 - index), numpy.append(rng.uniform(-50, 50, 2), 0.))
+      logic.deleteControlPoint(rng.randint(40 - index))
+
+    controlPoints = logic.controlPoints[logic.offset()]
+    curve = logic.curves[logic.offset()]
+    for query in rng.uniform(-60, 60, (100,2)):
+      ras = numpy.append(query, 0.)
+      distances = numpy.sqrt(((controlPoints - ras) ** 2).sum(axis=1))
+      hit = logic.nearestControlPoint(ras, 8.)
+      if distances.min() > 8.:
+        self.assertTrue(hit is None)
+      else:
+        self.assertAlmostEqual(hit[1], distances.min())
+      hit = logic.nearestCurveSegment(ras, 8.)
+      if hit is not None:
+        self.assertTrue(hit[1] <= 8.)
+        self.assertTrue(0 <= hit[0] < len(curve))
+
+  def test_ModelDrawEffectUndo(self):
+    """
+    This tests undoing and redoing applied curves and control point edits
+    """
+    logic = ModelDrawEffectCore.ModelDrawEngine()
+    logic.setLabel(3)
+    logic.labelArray = numpy.zeros((16,64,64), dtype='int16')
+    logic.labelArray[:,:,:8] = 1
+    logic.labelArray[6,20:30,20:30] = 3
+    original = logic.labelArray.copy()
+    for offset, radius in ((4., 10.), (10., 16.)):
+      for index, ras in enumerate(circle(8, radius, 32., offset)):
+        logic.insertControlPoint(index, ras, offset)
+    self.assertEqual(len(logic.journal.undoEntries), 16)
+
+    self.assertEqual(logic.applyCurves(), 7)
+    applied = logic.labelArray.copy()
+    self.assertTrue(logic.journal.nbytes() < original.nbytes / 10)
+    self.assertEqual(logic.undo().name, 'apply curves')
+    self.assertTrue((logic.labelArray == original).all())
+    logic.redo()
+    self.assertTrue((logic.labelArray == applied).all())
+
+    # a moved point is restored along with its curve
+    before = logic.controlPoints[4.].copy()
+    logic.moveControlPoint(2, (40., 40., 4.), offset=4.)
+    logic.deleteControlPoint(0, offset=10.)
+    logic.undo()
+    self.assertEqual(len(logic.controlPoints[10.]), 8)
+    logic.undo()
+    self.assertTrue((logic.controlPoints[4.] == before).all())
+    self.assertTrue(numpy.allclose(logic.curves[4.], logic.curve(before)))
+    self.assertTrue(logic.redo() and logic.redo())
+    self.assertEqual(len(logic.controlPoints[10.]), 7)
+
+    # a new edit clears the redo stack, and the oldest entries go over budget
+    logic.undo()
+    logic.insertControlPoint(0, (32., 32., 12.))
+    self.assertFalse(logic.journal.canRedo())
+    logic.journal.maxBytes = 2000
+    logic.journal.evict()
+    self.assertTrue(0 < logic.journal.nbytes() <= 2000)
+
+  def test_ModelDrawEffectImport(self):
+    """
+    This tests reading and transforming the control points of a reference scene
+    """
+    import os, tempfile
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'reference.mrml')
+    with open(path, 'w') as sceneFile:
+      sceneFile.write("""<MRML version="Slicer3">
+<Volume id="vtkMRMLScalarVolumeNode1" name="t1" storageNodeRef="vtkMRMLVolumeArchetypeStorageNode1" labelMap="0"></Volume>
+<VolumeArchetypeStorage id="vtkMRMLVolumeArchetypeStorageNode1" fileName="t1.nrrd"></VolumeArchetypeStorage>
+<Volume id="vtkMRMLScalarVolumeNode2" name="t1-label" storageNodeRef="vtkMRMLVolumeArchetypeStorageNode2" labelMap="1"></Volume>
+<VolumeArchetypeStorage id="vtkMRMLVolumeArchetypeStorageNode2" fileName="t1-label.nrrd"></VolumeArchetypeStorage>
+<ScriptedModule id="vtkMRMLScriptedModuleNode1" ModuleName="ModelDraw" parameter0="1 10.00 {{0 0 10} {10 0 10} {0 10 10}} 12.00 {{0 0 12} {10 0 12}}" parameter1="2 -4.00 {{5 5 -4}}"></ScriptedModule>
+</MRML>
+""")
+    parameters, volumes = ModelDrawEffectCore.readReferenceScene(path)
+    self.assertEqual(sorted(parameters.keys()), ['1', '2'])
+    self.assertEqual(volumes, [os.path.join(directory, 't1.nrrd')])
+
+    store = ModelDrawEffectCore.ControlPointStore()
+    store.update(parameters)
+    self.assertEqual(sorted(store.get(1).keys()), [10., 12.])
+
+    # shift by 3.3mm along the normal and rotate in plane; slices are 2mm
+    # apart with one at offset 1, so the points land on offsets 13 and 15
+    matrix = numpy.eye(4)
+    matrix[:2,:2] = ((0,-1), (1,0))
+    matrix[2,3] = 3.3
+    store.transform(matrix, (0,0,1), 2., origin=1.)
+    transformed = store.get(1)
+    self.assertEqual(sorted(transformed.keys()), [13., 15.])
+    self.assertTrue(numpy.allclose(transformed[13.], ((0,0,13), (0,10,13), (-10,0,13))))
+    self.assertTrue(numpy.allclose(store.get(2)[-1.], ((-5,5,-1),)))
+
+  def test_ModelDrawEffectBatch(self):
+    """
+    This tests rasterizing the control points of a scene into a label NRRD
+    """
+    import os, tempfile
+    import ModelDrawEffectBatch
+    directory = tempfile.mkdtemp()
+
+    # a 40x40x20 reference volume with 2mm slices, origin (-20,-20,0) in RAS
+    ijkToRAS = numpy.diag((1., 1., 2., 1.))
+    ijkToRAS[:3,3] = (-20, -20, 0)
+    reference = ModelDrawEffectBatch.createNrrd(os.path.join(directory, 't1.nrrd'), (20,40,40), ijkToRAS, 'float32')
+    reference[:] = 1
+    del reference
+
+    # squares of label 4 on the slices at S=10 and S=20, and a single slice of label 9
+    store = ModelDrawEffectCore.ControlPointStore()
+    square = numpy.array(((-10,-10,0), (10,-10,0), (10,10,0), (-10,10,0)), dtype='float64')
+    store.set(4, {10.: square + (0,0,10), 20.: square + (0,0,20)})
+    store.set(9, {30.: square * 0.5 + (0,0,30)})
+    path = os.path.join(directory, 'scene.mrml')
+    with open(path, 'w') as sceneFile:
+      sceneFile.write("""<MRML>
+<Volume id="vtkMRMLScalarVolumeNode1" storageNodeRef="vtkMRMLVolumeArchetypeStorageNode1"></Volume>
+<VolumeArchetypeStorage id="vtkMRMLVolumeArchetypeStorageNode1" fileName="t1.nrrd"></VolumeArchetypeStorage>
+<ScriptedModule id="vtkMRMLScriptedModuleNode1" ModuleName="ModelDraw" parameter0="4 %s" parameter1="9 %s"></ScriptedModule>
+</MRML>
+""" % (store.encode(*store.packed['4']), store.encode(*store.packed['9'])))
+
+    output = os.path.join(directory, 'scene-label.nrrd')
+    filled = ModelDrawEffectBatch.rasterizeScene(path, output, settings={'interpolation': 'linear'})
+    self.assertEqual(filled, {'4': 6, '9': 1})
+    header = ModelDrawEffectBatch.readNrrdHeader(output)
+    shape, outputIJKToRAS = ModelDrawEffectBatch.nrrdGeometry(header)
+    self.assertEqual(shape, (20,40,40))
+    self.assertTrue(numpy.allclose(outputIJKToRAS, ijkToRAS))
+    labels = ModelDrawEffectBatch.readNrrdData(header)
+    self.assertEqual(sorted(numpy.nonzero((labels == 4).any(axis=(1,2)))[0]), list(range(5,11)))
+    self.assertTrue((labels[5:11,11:30,11:30] == 4).all())
+    self.assertEqual(numpy.nonzero((labels == 9).any(axis=(1,2)))[0].tolist(), [15])
+
+    # with two grayscale volumes the geometry comes from the label map or
+    # the recorded background, and is refused if neither tells them apart
+    volumes = """<Volume id="vtkMRMLScalarVolumeNode1" storageNodeRef="vtkMRMLVolumeArchetypeStorageNode1"></Volume>
+<VolumeArchetypeStorage id="vtkMRMLVolumeArchetypeStorageNode1" fileName="t1.nrrd"></VolumeArchetypeStorage>
+<Volume id="vtkMRMLScalarVolumeNode2" storageNodeRef="vtkMRMLVolumeArchetypeStorageNode2"></Volume>
+<VolumeArchetypeStorage id="vtkMRMLVolumeArchetypeStorageNode2" fileName="t2.nrrd"></VolumeArchetypeStorage>
+"""
+    labelMap = """<Volume id="vtkMRMLScalarVolumeNode3" storageNodeRef="vtkMRMLVolumeArchetypeStorageNode3" labelMap="1"></Volume>
+<VolumeArchetypeStorage id="vtkMRMLVolumeArchetypeStorageNode3" fileName="t1-label.nrrd"></VolumeArchetypeStorage>
+"""
+    for extra, attributes, expected in (
+        ('', '', (None, None)),
+        ('', ' attributes="ModelDraw.backgroundVolume:vtkMRMLScalarVolumeNode2"', ('t2.nrrd', 't2.nrrd')),
+        (labelMap, '', ('t1-label.nrrd', None)),
+        (labelMap, ' attributes="ModelDraw.backgroundVolume:vtkMRMLScalarVolumeNode1"', ('t1-label.nrrd', 't1.nrrd'))):
+      with open(path, 'w') as sceneFile:
+        sceneFile.write('<MRML>\n%s%s<ScriptedModule id="vtkMRMLScriptedModuleNode1" ModuleName="ModelDraw"%s parameter0="4 %s"></ScriptedModule>\n</MRML>\n'
+                        % (volumes, extra, attributes, store.encode(*store.packed['4'])))
+      references = ModelDrawEffectBatch.sceneReferences(path)
+      self.assertEqual(tuple(os.path.basename(reference) if reference else None for reference in references), expected)
+    with open(path, 'w') as sceneFile:
+      sceneFile.write('<MRML>\n%s<ScriptedModule id="vtkMRMLScriptedModuleNode1" ModuleName="ModelDraw" parameter0="4 %s"></ScriptedModule>\n</MRML>\n'
+                      % (volumes, store.encode(*store.packed['4'])))
+    self.assertRaises(ValueError, ModelDrawEffectBatch.rasterizeScene, path, output)
+
+  def test_ModelDrawEffectPrefetch(self):
+    """
+    This tests computing the curves of the slices ahead while scrolling
+    """
+    logic = ModelDrawEffectCore.ModelDrawEngine()
+    for offset, radius in ((0., 10.), (20., 20.)):
+      logic.controlPoints[offset] = circle(8, radius, 0., offset)
+    expected = dict((offset, logic.curve(logic.interpolatedControlPoints(offset))) for offset in (3., 4., 5., 6., 7., 8.))
+
+    prefetcher = ModelDrawEffectCore.ContourPrefetcher(logic, depth=3)
+    logic.prefetcher = prefetcher
+    # scrolling down predicts the slices below
+    logic.sliceOffset = 8.
+    prefetcher.schedule(logic.offset(), 1.).result()
+    self.assertEqual(sorted(key[1] for key in prefetcher.cache), [7., 9., 10., 11.])
+    logic.sliceOffset = 7.
+    prefetcher.schedule(logic.offset(), 1.).result()
+    self.assertEqual(sorted(key[1] for key in prefetcher.cache), [4., 5., 6., 7., 8., 9., 10., 11.])
+    for offset in (6., 5., 4.):
+      logic.sliceOffset = offset
+      self.assertTrue(logic.currentCurve() is prefetcher.get(logic.contourKey(offset)))
+      self.assertTrue(numpy.allclose(logic.currentCurve(), expected[offset]))
+
+    # editing the control points cancels the work and drops the cache
+    future = prefetcher.schedule(4., 1.)
+    logic.moveControlPoint(0, (12., 0., 0.), offset=0.)
+    future.result()
+    self.assertEqual(len(prefetcher.cache), 0)
+    logic.sliceOffset = 3.
+    self.assertFalse(numpy.allclose(logic.currentCurve(), expected[3.]))
+    prefetcher.shutdown()
+
+  def test_ModelDrawEffectAllLabels(self):
+    """
+    This tests filling every label at once on worker processes
+    """
+    logic = ModelDrawEffectCore.ModelDrawEngine()
+    logic.store = ModelDrawEffectCore.ControlPointStore()
+    logic.applyProcesses = 2
+    angles = numpy.linspace(0, 2*numpy.pi, 12, endpoint=False)
+    ring = lambda center, radius, offset: numpy.column_stack((center + radius * numpy.cos(angles),
+                                                              32 + radius * numpy.sin(angles), numpy.full(12, offset)))
+    # two overlapping cylinders, the second defined on one slice only
+    logic.store.set(2, {2.: ring(26, 10, 2.), 12.: ring(26, 10, 12.)})
+    logic.store.set(5, {6.: ring(38, 10, 6.)})
+    # drawn on sagittal slices, so not applied along these
+    logic.store.set(9, {10.: ring(32, 5, 10.)[:,(2,1,0)]})
+    logic.setLabel(7)
+    logic.controlPoints = {4.: ring(32, 5, 4.), 8.: ring(32, 5, 8.)}
+    logic.labelArray = numpy.zeros((16,64,64), dtype='int16')
+    original = logic.labelArray.copy()
+
+    self.assertEqual(logic.applyAllLabels(priority=(7, 5)), {2: 11, 5: 1, 7: 5})
+    self.assertEqual(logic.skippedLabels, [9])
+    labels = logic.labelArray
+    self.assertEqual(numpy.nonzero((labels == 2).any(axis=(1,2)))[0].tolist(), list(range(2,13)))
+    self.assertEqual(labels[6,32,32], 7)
+    self.assertEqual(labels[6,32,40], 5)
+    self.assertEqual(labels[6,32,20], 2)
+    self.assertEqual(labels[3,32,32], 2)
+
+    # the same as filling one label after another, lowest priority first
+    serial = ModelDrawEffectCore.ModelDrawEngine()
+    serial.labelArray = original.copy()
+    for label, controlPoints in ((2, logic.store.get(2)), (5, logic.store.get(5)), (7, logic.controlPoints)):
+      serial.controlPoints = controlPoints
+      serial.curves = {}
+      if len(controlPoints) > 1:
+        serial.applyCurves(label)
+      else:
+        serial.sliceOffset = 6.
+        serial.applyCurve(serial.currentCurve(), label=label)
+    self.assertTrue((serial.labelArray == labels).all())
+
+    logic.undo()
+    self.assertTrue((logic.labelArray == original).all())
+
+    # without a worker interpreter the tasks run on threads, with the same result
+    logic.workerExecutable = lambda: False
+    self.assertEqual(logic.applyAllLabels(priority=(7, 5)), {2: 11, 5: 1, 7: 5})
+    self.assertTrue((logic.labelArray == serial.labelArray).all())
+    self.assertEqual(ModelDrawEffectCore.workerJob, {})
+
+    # labels drawn at slightly different offsets of one voxel slice are
+    # filled by one task in priority order
+    logic = ModelDrawEffectCore.ModelDrawEngine()
+    logic.store = ModelDrawEffectCore.ControlPointStore()
+    logic.workerExecutable = lambda: False
+    logic.store.set(3, {6.3: ring(32, 8, 6.3)})
+    logic.store.set(4, {6.: ring(32, 8, 6.)})
+    logic.labelArray = numpy.zeros((16,64,64), dtype='int16')
+    self.assertEqual(logic.applyAllLabels(priority=(4,)), {3: 1, 4: 1})
+    self.assertEqual(logic.labelArray[6,32,32], 4)
+
+  def test_ModelDrawEffectViews(self):
+    """
+    This tests two views sharing the contour model of a cylinder: curves
+    drawn in one are computed once and the other shows its cross section
+    """
+    model = ModelDrawEffectCore.ContourModel(1)
+    red = ModelDrawEffectCore.ModelDrawEngine()
+    sagittal = ModelDrawEffectCore.ModelDrawEngine()
+    sagittal.axes = numpy.array(((0.,1.,0.), (0.,0.,1.), (1.,0.,0.)))
+    sagittal.sliceOffset = 3.
+    for engine in (red, sagittal):
+      engine.label = 1
+      engine.bindModel(model)
+    changes = []
+    sagittal.modelCallback = lambda: changes.append(model.version)
+
+    # a cylinder of radius 10 drawn on the red slices
+    angles = numpy.linspace(0, 2*numpy.pi, 12, endpoint=False)
+    for offset in range(0, 21, 5):
+      red.sliceOffset = float(offset)
+      for index, angle in enumerate(angles):
+        red.insertControlPoint(index, (10 * numpy.cos(angle), 10 * numpy.sin(angle), offset))
+    self.assertEqual(len(changes), 60)
+    self.assertTrue(numpy.allclose(model.sliceNormal, (0,0,1)))
+    self.assertTrue(red.editable())
+    self.assertFalse(sagittal.editable())
+    self.assertFalse(model.parallel(-model.sliceNormal))
+
+    # the sagittal view uses the curves the red view computed
+    self.assertTrue(sagittal.curves is red.curves)
+    curve = red.curves[10.]
+    segments = sagittal.crossSection()
+    self.assertTrue(red.curves[10.] is curve)
+
+    # a closed outline on the plane x = 3: the cylinder's sides at
+    # y = +-sqrt(91) joined across the end slices
+    ends = segments.reshape(-1,3)
+    self.assertTrue(numpy.allclose(ends[:,0], 3.))
+    self.assertAlmostEqual(ends[:,2].min(), 0.)
+    self.assertAlmostEqual(ends[:,2].max(), 20.)
+    sides = (ends[:,2] > 1e-6) & (ends[:,2] < 20 - 1e-6)
+    self.assertTrue(numpy.allclose(abs(ends[sides,1]), numpy.sqrt(91.), atol=0.2))
+    counts = numpy.unique(numpy.round(ends, 6), axis=0, return_counts=True)[1]
+    self.assertTrue((counts % 2 == 0).all())
+
+    # the views the slices cross do not take part in editing
+    for offset in range(0, 21, 5):
+      red.sliceOffset = float(offset)
+      while float(offset) in red.controlPoints:
+        red.deleteControlPoint(0)
+    self.assertIsNone(model.sliceNormal)
+    self.assertTrue(sagittal.editable())
+    self.assertEqual(len(sagittal.crossSection()), 0)
+
+  def test_ModelDrawEffectAutosave(self):
+    """
+    This tests recovering the control points from the autosave journal
+    after edits, compaction and a torn last record
+    """
+    import os, tempfile
+    directory = tempfile.mkdtemp()
+    logic = ModelDrawEffectCore.ModelDrawEngine()
+    logic.setLabel(3)
+    logic.autosave = ModelDrawEffectCore.AutosaveJournal(directory, interval=0.05)
+    store = ModelDrawEffectCore.ControlPointStore()
+    store.set(5, {2.: numpy.ones((3,3))})
+    logic.autosave.start(store.parameters())
+    logic.autosave.flush()
+    # the first snapshot is not an edit, so there is nothing to recover
+    self.assertIsNone(logic.autosave.lastEdit())
+
+    angles = numpy.linspace(0, 2*numpy.pi, 6, endpoint=False)
+    for offset in (0., 4.):
+      logic.sliceOffset = offset
+      for index, angle in enumerate(angles):
+        logic.insertControlPoint(index, (10 * numpy.cos(angle), 10 * numpy.sin(angle), offset))
+    # a drag: only the latest position of a batch is written
+    for step in range(50):
+      logic.moveControlPoint(0, (10 + 0.1 * step, 0., 4.), offset=4.)
+    logic.copyCurve(2.)
+    logic.sliceOffset = 0.
+    logic.insertControlPoint(1, (9., 3., 0.))
+    logic.deleteControlPoint(3)
+    logic.deleteControlPoint(0, offset=2.)
+    logic.undo()
+    logic.autosave.flush()
+    self.assertIsNotNone(logic.autosave.lastEdit())
+
+    def recovered():
+      state = ModelDrawEffectCore.AutosaveJournal(directory).recover()
+      self.assertEqual(sorted(state.keys()), ['3', '5'])
+      self.assertTrue((state['5'][2.] == 1).all())
+      self.assertEqual(sorted(state['3'].keys()), sorted(logic.controlPoints.keys()))
+      for offset, points in logic.controlPoints.items():
+        self.assertTrue(numpy.array_equal(state['3'][offset], points))
+    recovered()
+    journalSize = os.path.getsize(os.path.join(directory, 'journal.bin'))
+    self.assertTrue(journalSize < 30 * 200)
+
+    # a crash while writing leaves part of a record, which is skipped
+    with open(os.path.join(directory, 'journal.bin'), 'ab') as journalFile:
+      journalFile.write(logic.autosave.encodeRecord('move', 3, 0., numpy.zeros((6,3)))[:40])
+    recovered()
+
+    # compaction folds the journal into the snapshot
+    logic.autosave.compactBytes = 0
+    logic.moveControlPoint(2, (0., 12., 0.), offset=0.)
+    logic.autosave.flush()
+    self.assertEqual(os.path.getsize(os.path.join(directory, 'journal.bin')), len(logic.autosave.magic))
+    recovered()
+    self.assertIsNotNone(logic.autosave.lastEdit())
+
+    # a failing writer is reported instead of blocking flush
+    logic.autosave.journalFile.close()
+    logic.moveControlPoint(2, (0., 13., 0.), offset=0.)
+    self.assertFalse(logic.autosave.flush(timeout=5.))
+    self.assertIsNotNone(logic.autosave.error)
+    logic.autosave.close()
+
+  def test_ModelDrawEffectDragSamples(self):
+    """
+    This tests that the changed samples reported while dragging with snap
+    (and edge tangents) cover every sample that differs from the last curve
+    """
+    volume = noisyDisk(10., 3)
+    random = numpy.random.RandomState(3)
+    for edgeTangents in (False, True):
+      logic = ModelDrawEffectCore.ModelDrawEngine()
+      logic.background = ModelDrawEffectCore.CachedVolume(0, volume, numpy.eye(4), (1.,1.,1.))
+      logic.snap = True
+      logic.edgeTangents = edgeTangents
+      logic.sliceOffset = 2.
+      for index, point in enumerate(circle(12)):
+        logic.insertControlPoint(index, point)
+      previous = logic.currentCurve().copy()
+      for step in range(40):
+        index = random.randint(12)
+        heavy = step % 5 == 4
+        if heavy:
+          curve = logic.completeCurve()
+        else:
+          ras = logic.controlPoints[2.][index] + numpy.append(random.uniform(-2, 2, 2), 0.)
+          curve = logic.moveControlPoint(index, ras, heavy=False)
+        if logic.changedSamples is not None and len(curve) == len(previous):
+          unchanged = numpy.ones(len(curve), dtype=bool)
+          unchanged[logic.changedSamples] = False
+          self.assertTrue(numpy.array_equal(curve[unchanged], previous[unchanged]))
+        previous = curve.copy()
+
+  def test_ModelDrawEffectLazyClass(self):
+    """
+    This tests the extension entry ModelDrawEffect registers for the Editor:
+    EditBox calls it with no arguments and reads the options, tool and logic
+    classes, and only then is the module with the class imported
+    """
+    import os, tempfile
+    directory = tempfile.mkdtemp()
+    with open(os.path.join(directory, 'LazyClassTestEditor.py'), 'w') as fp:
+      fp.write('class Extension:\n'
+               '  options = "options"\n'
+               '  def __init__(self):\n'
+               '    self.tool = "tool"\n')
+    sys.path.insert(0, directory)
+    try:
+      extension = ModelDrawEffectCore.LazyClass('LazyClassTestEditor', 'Extension')
+      self.assertNotIn('LazyClassTestEditor', sys.modules)
+      self.assertRaises(AttributeError, getattr, extension, '__deepcopy__')
+      self.assertNotIn('LazyClassTestEditor', sys.modules)
+      effect = extension()
+      self.assertIs(type(effect), sys.modules['LazyClassTestEditor'].Extension)
+      self.assertEqual((effect.options, effect.tool), ('options', 'tool'))
+      self.assertEqual(extension.options, 'options')
+    finally:
+      sys.path.remove(directory)
+      sys.modules.pop('LazyClassTestEditor', None)
+
+
+if __name__ == '__main__':
+  result = unittest.main(argv=sys.argv[:1], exit=False).result
+  sys.exit(0 if result.wasSuccessful() else 1)